@@ -121,6 +121,14 @@ module.exports = function(grunt)
         });
     });
 
+    grunt.registerTask('wordVectors', 'Converts the downloaded word vector database into a word vector store', function()
+    {
+        const childProcess = require('child_process');
+
+        // The script does nothing when the store has already been converted
+        childProcess.execFileSync('python3', ['scripts/convert_sqlite_word_vectors.py', 'data/english_word_vectors_tensorflow.db'], {stdio: 'inherit'});
+    });
+
     // Load our plugins
     grunt.loadNpmTasks('grunt-browserify');
     grunt.loadNpmTasks('grunt-contrib-watch');
@@ -132,5 +140,5 @@ module.exports = function(grunt)
     grunt.loadNpmTasks('grunt-zip');
 
     // Default task(s).
-    grunt.registerTask('default', ['mkdir:dev', 'dot:matchingPlugin', 'dot:transformPlugin', 'dot:frontend', 'browserify:dev', 'uglify:dev', 'copy:dev', 'if-missing:curl']);
+    grunt.registerTask('default', ['mkdir:dev', 'dot:matchingPlugin', 'dot:transformPlugin', 'dot:frontend', 'browserify:dev', 'uglify:dev', 'copy:dev', 'if-missing:curl', 'wordVectors']);
 };
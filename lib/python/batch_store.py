@@ -0,0 +1,269 @@
+#
+# Electric Brain is an easy to use platform for machine learning.
+# Copyright (C) 2016 Electric Brain Software Corporation
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import collections
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+import uuid
+import numpy
+
+# Every batch segment starts with this marker, followed by the header length and the payload length
+segmentMagic = b'EBB1'
+segmentHeader = struct.Struct('<4sII')
+
+# Arrays are aligned within the segment so that they can be mapped directly as numpy arrays
+segmentAlignment = 64
+
+# Batch segments are identified within the pool folder by this prefix
+segmentPrefix = "electric-brain-batch-"
+
+
+def defaultPoolFolder():
+    """ Returns /dev/shm when it exists, so that batches live in shared memory, otherwise the temporary folder """
+    if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+        return "/dev/shm"
+    return tempfile.gettempdir()
+
+
+def layoutSegment(arrays):
+    """ Works out where each of the arrays goes within a segment. Returns the layout to pass to writeSegment,
+        which includes the total size of the segment in bytes. """
+    descriptors = {}
+    contiguous = {}
+    offset = 0
+    for key in arrays:
+        # Scalars keep their shape, since ascontiguousarray would otherwise turn them into arrays of one element
+        array = numpy.ascontiguousarray(arrays[key]).reshape(numpy.shape(arrays[key]))
+        if array.dtype.kind not in 'biufSU':
+            raise Exception("Segment arrays must be numeric or fixed width strings, but " + str(key) + " has dtype " + str(array.dtype))
+        offset += (-offset) % segmentAlignment
+        descriptors[key] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        contiguous[key] = array
+        offset += array.nbytes
+
+    header = json.dumps(descriptors).encode('utf-8')
+    start = segmentHeader.size + len(header)
+    start += (-start) % segmentAlignment
+    return {"descriptors": descriptors, "arrays": contiguous, "header": header, "start": start, "payload": offset, "size": start + offset}
+
+
+def writeSegment(fileName, layout):
+    """ Writes a segment laid out by layoutSegment. The file is written under a temporary name then renamed,
+        so that the file name never refers to a partial segment. """
+    partialName = fileName + ".partial"
+    with open(partialName, 'wb') as file:
+        file.write(segmentHeader.pack(segmentMagic, len(layout["header"]), layout["payload"]))
+        file.write(layout["header"])
+        for key in layout["arrays"]:
+            file.seek(layout["start"] + layout["descriptors"][key]["offset"])
+            file.write(layout["arrays"][key].data)
+        file.truncate(layout["size"])
+    os.rename(partialName, fileName)
+
+
+def readSegment(fileName):
+    """ Maps a segment, and returns a dictionary of read-only numpy arrays viewing it, or None if the file is not a segment """
+    with open(fileName, 'rb') as file:
+        prefix = file.read(segmentHeader.size)
+        if prefix[:4] != segmentMagic:
+            return None
+
+        magic, headerLength, payloadLength = segmentHeader.unpack(prefix)
+        descriptors = json.loads(file.read(headerLength).decode('utf-8'))
+        if len(descriptors) == 0:
+            return {}
+        mapped = mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ)
+
+    start = segmentHeader.size + headerLength
+    start += (-start) % segmentAlignment
+
+    # The map stays open for as long as any of the arrays viewing it are alive
+    arrays = {}
+    for key in descriptors:
+        descriptor = descriptors[key]
+        dtype = numpy.dtype(descriptor["dtype"])
+        count = int(numpy.prod(descriptor["shape"], dtype = numpy.int64))
+        arrays[key] = numpy.frombuffer(mapped, dtype = dtype, count = count, offset = start + descriptor["offset"]).reshape(descriptor["shape"])
+    return arrays
+
+
+class EBBatchPool:
+    """ Stores prepared batches as memory-mapped segments, shared between the processes that prepare
+        batches and the process that trains on them.
+
+        Each batch is a single file, referred to by its path, which acts as the batch handle. The file holds
+        a JSON header describing each array, followed by the raw array data. Reading a batch maps the file
+        and returns numpy views onto it, so nothing is decompressed or copied before being fed.
+
+        Each group of processes keeps its batches in a folder of its own, which the parent process creates
+        and removes. The pool is bounded - writing a new batch waits until the total size of all unreleased
+        batches in the folder the batch is written to fits within maxBytes. Batches belonging to other runs
+        are never counted. Batches are released explicitly, by deleting their segment.
+    """
+    def __init__(self, folder = None, maxBytes = 1024 * 1024 * 1024, waitTimeout = 300):
+        self.folder = folder or defaultPoolFolder()
+        self.maxBytes = maxBytes
+        self.waitTimeout = waitTimeout
+
+    def usage(self, folder = None):
+        """ Returns the total size in bytes of all the batches currently held in the given folder, by default the pool folder """
+        total = 0
+        for entry in os.scandir(folder or self.folder):
+            if entry.name.startswith(segmentPrefix):
+                try:
+                    total += entry.stat().st_size
+                except FileNotFoundError:
+                    pass
+        return total
+
+    def createHandle(self):
+        return os.path.join(self.folder, segmentPrefix + uuid.uuid4().hex + ".batch")
+
+    def waitForSpace(self, size, folder = None, heldBytes = 0):
+        """ Blocks until a batch of the given size fits within the pool in the given folder. heldBytes is the size of
+            the batches the caller has already written and can't release until it finishes, which are not waited on. """
+        folder = folder or self.folder
+        start = time.time()
+        while True:
+            used = self.usage(folder)
+            # A batch larger than the whole pool is still allowed through once nothing else is held in the pool
+            if used - heldBytes + size <= self.maxBytes or used <= heldBytes:
+                return
+            if time.time() - start > self.waitTimeout:
+                raise Exception("Timed out waiting for space in the batch pool at " + folder + ". " + str(used) + " bytes are held by unreleased batches.")
+            time.sleep(0.05)
+
+    def write(self, arrays, handle = None, heldBytes = 0):
+        """ Writes the dictionary of arrays as a new batch, and returns its handle """
+        if handle is None:
+            handle = self.createHandle()
+
+        layout = layoutSegment(arrays)
+        self.waitForSpace(layout["size"], os.path.dirname(handle), heldBytes)
+        writeSegment(handle, layout)
+        return handle
+
+    def read(self, handle):
+        """ Maps the batch with the given handle, and returns a dictionary of read-only numpy arrays viewing it """
+        arrays = readSegment(handle)
+        if arrays is None:
+            # Batches written by older versions were npz files
+            return dict(numpy.load(handle))
+        return arrays
+
+    def release(self, handle):
+        """ Releases the batch with the given handle, returning its memory to the pool """
+        try:
+            os.unlink(handle)
+        except FileNotFoundError:
+            pass
+
+
+
+class EBBatchCache:
+    """ An in-process cache of read batches, so that the batches a trainSteps message cycles through are not
+        read again on every pass, or by the next message that trains on the same batches.
+
+        Entries are keyed by the batch handle along with the modification time of its file, so a file which
+        is rewritten under the same name is never served stale. Once the cached arrays exceed maxBytes,
+        entries are evicted from the least recently used end - but rather than always the single oldest
+        entry, the largest of the oldest evictionWindow entries goes first. This frees the budget with
+        fewer evictions, keeping more of the small batches cached.
+
+        The cached arrays view the mapped segments, so an entry would keep the memory of its segment alive
+        after the file is deleted. Entries are dropped when their batch is released, and prune() drops the
+        entries of batches whose files have been deleted by another process.
+
+        The cache may be used from the prefetching thread as well as the main thread, so access is locked.
+    """
+    def __init__(self, maxBytes = 512 * 1024 * 1024, evictionWindow = 4):
+        self.maxBytes = maxBytes
+        self.evictionWindow = evictionWindow
+        self.entries = collections.OrderedDict()
+        self.totalBytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, handle, load):
+        """ Returns the arrays for the batch with the given handle, calling load(handle) if they are not cached.
+            The returned dictionary is shared with the cache, so callers should copy it before changing it. """
+        with self.lock:
+            return self.getLocked(handle, load)
+
+    def getLocked(self, handle, load):
+        key = (handle, os.stat(handle).st_mtime_ns)
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry[0]
+
+        self.misses += 1
+        arrays = load(handle)
+        if self.maxBytes <= 0:
+            return arrays
+
+        size = sum(array.nbytes for array in arrays.values())
+        self.discardLocked(handle)
+        self.entries[key] = (arrays, size)
+        self.totalBytes += size
+        self.evict()
+        return arrays
+
+    def evict(self):
+        while self.totalBytes > self.maxBytes and len(self.entries) > 1:
+            oldest = []
+            for key in self.entries:
+                oldest.append(key)
+                if len(oldest) >= self.evictionWindow:
+                    break
+            victim = max(oldest, key = lambda key: self.entries[key][1])
+            self.totalBytes -= self.entries.pop(victim)[1]
+            self.evictions += 1
+
+    def discard(self, handle):
+        """ Removes any cached version of the batch with the given handle """
+        with self.lock:
+            self.discardLocked(handle)
+
+    def discardLocked(self, handle):
+        for key in [key for key in self.entries if key[0] == handle]:
+            self.totalBytes -= self.entries.pop(key)[1]
+
+    def prune(self):
+        """ Drops the entries for batches whose files no longer exist """
+        with self.lock:
+            for key in list(self.entries):
+                if not os.path.exists(key[0]):
+                    self.totalBytes -= self.entries.pop(key)[1]
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self.entries),
+            "bytes": self.totalBytes,
+            "maxBytes": self.maxBytes
+        }
@@ -0,0 +1,60 @@
+#
+# Electric Brain is an easy to use platform for machine learning.
+# Copyright (C) 2016 Electric Brain Software Corporation
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import numpy
+
+
+def quantileBoundaries(lengths, bucketCount):
+    """ Chooses bucket boundaries so that each bucket receives roughly the same number of samples """
+    if len(lengths) == 0 or bucketCount <= 1:
+        return []
+    quantiles = numpy.percentile(lengths, numpy.linspace(0, 100, bucketCount + 1)[1:-1])
+    return sorted(set(int(numpy.ceil(quantile)) for quantile in quantiles))
+
+
+def bucketSamples(lengths, batchSize, bucketBoundaries = None, bucketCount = 8):
+    """ Groups samples of similar length into batches.
+
+        Samples are placed into buckets by comparing their length against the sorted bucket boundaries.
+        When no boundaries are given, they are chosen automatically from quantiles of the lengths. Each
+        bucket is then sorted by length and cut into batches of at most batchSize samples.
+
+        Returns a list of batches, each one a list of indexes into the given lengths.
+    """
+    lengths = numpy.asarray(lengths, dtype = numpy.int64)
+    if bucketBoundaries is None:
+        bucketBoundaries = quantileBoundaries(lengths, bucketCount)
+
+    buckets = numpy.searchsorted(numpy.asarray(bucketBoundaries, dtype = numpy.int64), lengths, side = 'left')
+
+    batches = []
+    for bucket in numpy.unique(buckets):
+        members = numpy.flatnonzero(buckets == bucket)
+        members = members[numpy.argsort(lengths[members], kind = 'mergesort')]
+        for start in range(0, len(members), batchSize):
+            batches.append([int(index) for index in members[start:start + batchSize]])
+    return batches
+
+
+def paddingEfficiency(lengths):
+    """ Returns the fraction of a padded batch, with the given sequence lengths, that is real data """
+    if len(lengths) == 0:
+        return 1.0
+    longest = max(lengths)
+    if longest == 0:
+        return 1.0
+    return float(sum(lengths)) / float(len(lengths) * longest)
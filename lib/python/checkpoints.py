@@ -0,0 +1,155 @@
+#
+# Electric Brain is an easy to use platform for machine learning.
+# Copyright (C) 2016 Electric Brain Software Corporation
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import concurrent.futures
+import json
+import os
+import re
+import shutil
+import time
+import tensorflow as tf
+from batch_store import layoutSegment, writeSegment, readSegment
+
+# Each checkpoint is a directory within the checkpoint folder, named by its version number
+versionPattern = re.compile(r'^version-(\d+)$')
+
+
+class EBCheckpointStore:
+    """ Keeps versioned checkpoints of a model, each in its own directory within the folder:
+
+            weights.segment     The value of every variable, in the same segment format as prepared batches
+            graph.meta          The meta graph, for tools that want to inspect the model
+            checkpoint.json     The version, the time it was saved and any metadata given by the script
+
+        Saving takes a snapshot of the variables between training steps, which only costs a copy in memory.
+        The files are then written on a background thread, one checkpoint at a time, while training carries on.
+        Each checkpoint is written under a temporary name and renamed once complete, after which all but the
+        newest keep checkpoints are deleted.
+
+        Restoring maps the weights file rather than reading it, so the variables are loaded straight from the
+        page cache. Every variable is then assigned by a single run of a grouped assign op, which is built once
+        per graph and fed the arrays through placeholders.
+    """
+    def __init__(self, folder = "checkpoints", keep = 5):
+        self.folder = folder
+        self.keep = keep
+        self.writer = concurrent.futures.ThreadPoolExecutor(1)
+        self.pending = []
+        self.nextVersion = None
+        self.restoreGraph = None
+        self.restoreOps = {}
+
+    def versions(self):
+        """ Returns the version numbers of all the complete checkpoints, oldest first """
+        if not os.path.isdir(self.folder):
+            return []
+        versions = []
+        for name in os.listdir(self.folder):
+            match = versionPattern.match(name)
+            if match is not None:
+                versions.append(int(match.group(1)))
+        return sorted(versions)
+
+    def latest(self):
+        versions = self.versions()
+        return versions[-1] if len(versions) > 0 else None
+
+    def directory(self, version):
+        return os.path.join(self.folder, "version-" + str(version).zfill(6))
+
+    def weightsFile(self, version):
+        return os.path.join(self.directory(version), "weights.segment")
+
+    def describe(self, version):
+        """ Returns the contents of checkpoint.json for the given version """
+        with open(os.path.join(self.directory(version), "checkpoint.json"), 'r') as file:
+            return json.load(file)
+
+    def save(self, session, variables, metadata = None):
+        """ Snapshots the variables and starts writing them as a new checkpoint. Returns the version number, and
+            a future which completes once the checkpoint has been written. """
+        if self.nextVersion is None:
+            self.nextVersion = (self.latest() or 0) + 1
+        version = self.nextVersion
+        self.nextVersion += 1
+
+        values = session.run(variables)
+        arrays = {variable.name: value for variable, value in zip(variables, values)}
+        graphDef = session.graph.as_graph_def(add_shapes = True)
+
+        description = {"version": version, "time": time.time()}
+        description.update(metadata or {})
+
+        pending = self.writer.submit(self.write, version, arrays, session.graph, graphDef, description)
+        self.pending = [future for future in self.pending if not future.done()] + [pending]
+        return version, pending
+
+    def write(self, version, arrays, graph, graphDef, description):
+        directory = self.directory(version)
+        partialDirectory = directory + ".partial"
+        if os.path.isdir(partialDirectory):
+            shutil.rmtree(partialDirectory)
+        os.makedirs(partialDirectory)
+
+        writeSegment(os.path.join(partialDirectory, "weights.segment"), layoutSegment(arrays))
+        tf.train.export_meta_graph(filename = os.path.join(partialDirectory, "graph.meta"), graph_def = graphDef, graph = graph)
+        with open(os.path.join(partialDirectory, "checkpoint.json"), 'w') as file:
+            json.dump(description, file)
+
+        os.rename(partialDirectory, directory)
+        self.prune()
+
+    def prune(self):
+        """ Deletes all but the newest checkpoints """
+        versions = self.versions()
+        for version in versions[:max(len(versions) - self.keep, 0)]:
+            shutil.rmtree(self.directory(version), ignore_errors = True)
+
+    def wait(self):
+        """ Waits for every checkpoint that is still being written, raising any error from writing them """
+        for future in self.pending:
+            future.result()
+        self.pending = []
+
+    def restoreOp(self, graph, variables):
+        """ Returns the placeholders and the grouped op that assign the given variables, building them the first
+            time they are needed for the graph """
+        if graph is not self.restoreGraph:
+            self.restoreGraph = graph
+            self.restoreOps = {}
+
+        key = tuple(variable.name for variable in variables)
+        if key not in self.restoreOps:
+            with graph.as_default(), tf.name_scope("restore"):
+                placeholders = [tf.placeholder(variable.dtype.base_dtype, shape = variable.get_shape()) for variable in variables]
+                assign = tf.group(*[tf.assign(variable, placeholder) for variable, placeholder in zip(variables, placeholders)])
+            self.restoreOps[key] = (placeholders, assign)
+        return self.restoreOps[key]
+
+    def restore(self, session, variables, fileName):
+        """ Loads the variables from a weights file, matching them by name. Returns the names of the variables
+            that were not in the file, which keep their current values. """
+        arrays = readSegment(fileName)
+        if arrays is None:
+            raise Exception("The file " + str(fileName) + " is not a checkpoint weights file")
+
+        found = [variable for variable in variables if variable.name in arrays]
+        missing = [variable.name for variable in variables if variable.name not in arrays]
+        if len(found) > 0:
+            placeholders, assign = self.restoreOp(session.graph, found)
+            session.run(assign, feed_dict = {placeholder: arrays[variable.name] for variable, placeholder in zip(found, placeholders)})
+        return missing
@@ -0,0 +1,114 @@
+#
+# Electric Brain is an easy to use platform for machine learning.
+# Copyright (C) 2016 Electric Brain Software Corporation
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import concurrent.futures
+import multiprocessing
+import threading
+import traceback
+from utils import eprint
+from protocol import EBJSONProtocol, negotiateProtocol
+
+
+class EBMessageDispatcher:
+    """ Reads messages from the parent process, hands them to a handler function and writes back its responses.
+
+        Messages without a requestId are handled one at a time, in order, exactly as they arrive. Before one of
+        them is handled, all work that is still running is allowed to finish, so they also act as barriers -
+        e.g. a reset never runs underneath a training step.
+
+        Messages with a requestId are run in the background whenever chooseLane returns a lane for them, and
+        their responses are written as soon as they are ready - possibly out of order - carrying the same
+        requestId. Each lane has its own pool of threads:
+
+            prepare     Converting samples into batches, which is CPU bound work in numpy and can run in parallel
+            train       Training steps, run one at a time so that steps are applied in the order they were sent
+            evaluate    Evaluation, which can run while a training step is in progress
+            serve       Evaluation while serving, where many requests wait at once so that they can be merged into
+                        batches. See EBMicroBatcher
+
+        If a background message fails, an error response is sent in place of its normal response.
+    """
+    def __init__(self, handle, chooseLane, prepareThreads = None, serveThreads = 64):
+        self.handle = handle
+        self.chooseLane = chooseLane
+        self.protocol = EBJSONProtocol()
+        self.executors = {
+            "prepare": concurrent.futures.ThreadPoolExecutor(prepareThreads or multiprocessing.cpu_count()),
+            "train": concurrent.futures.ThreadPoolExecutor(1),
+            "evaluate": concurrent.futures.ThreadPoolExecutor(1),
+            "serve": concurrent.futures.ThreadPoolExecutor(serveThreads)
+        }
+        self.running = set()
+        self.runningLock = threading.Lock()
+        self.writeLock = threading.Lock()
+
+    def run(self):
+        """ Handles messages until the input is closed """
+        while True:
+            message = self.protocol.readMessage()
+            if message is None:
+                break
+
+            # Lanes are chosen as messages are read, after every barrier before them has been handled
+            lane = self.chooseLane(message)
+            if "requestId" in message and lane is not None:
+                self.submit(lane, message)
+            else:
+                self.waitForRunning()
+                self.execute(message)
+
+        self.waitForRunning()
+        for executor in self.executors.values():
+            executor.shutdown()
+
+    def submit(self, lane, message):
+        future = self.executors[lane].submit(self.execute, message)
+        with self.runningLock:
+            self.running.add(future)
+        future.add_done_callback(self.finished)
+
+    def finished(self, future):
+        with self.runningLock:
+            self.running.discard(future)
+
+    def waitForRunning(self):
+        with self.runningLock:
+            running = list(self.running)
+        concurrent.futures.wait(running)
+
+    def execute(self, message):
+        nextProtocol = None
+        try:
+            response = self.handle(message)
+
+            # The handshake response is always sent with the current protocol, and the negotiated protocol used afterwards
+            if message["type"] == 'handshake':
+                nextProtocol = negotiateProtocol(message)
+                response["protocol"] = nextProtocol.name
+        except Exception as exception:
+            if "requestId" not in message:
+                raise
+            eprint(traceback.format_exc())
+            response = {"type": "error", "message": str(exception)}
+
+        if "requestId" in message:
+            response["requestId"] = message["requestId"]
+
+        with self.writeLock:
+            self.protocol.writeMessage(response)
+            if nextProtocol is not None:
+                self.protocol = nextProtocol
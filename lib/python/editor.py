@@ -47,7 +47,10 @@ def generateEditorNetwork(layers, input, templateVars):
         elif layer['name'] == 'crelu':
             current = tf.nn.crelu(current)
         elif layer['name'] == 'dropout':
-            current = tf.nn.dropout(current, keep_prob = getValue(layer, 'keep_prob'))
+            # The keep probability can be fed as 1.0 to switch dropout off when evaluating. See inference.py
+            keepProbability = tf.placeholder_with_default(float(getValue(layer, 'keep_prob')), shape = [], name = 'keep_prob')
+            tf.add_to_collection('dropout_keep_probabilities', keepProbability)
+            current = tf.nn.dropout(current, keep_prob = keepProbability)
         elif layer['name'] == 'dense':
             current = tf.layers.dense(current, units = getValue(layer, 'units'))
             currentOutputSize = getValue(layer, 'units')
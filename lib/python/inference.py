@@ -0,0 +1,99 @@
+#
+# Electric Brain is an easy to use platform for machine learning.
+# Copyright (C) 2016 Electric Brain Software Corporation
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import numpy
+import tensorflow as tf
+from batch_store import layoutSegment, writeSegment, readSegment
+
+# The keep probability of every dropout layer is added to this collection by generateEditorNetwork
+dropoutCollection = 'dropout_keep_probabilities'
+
+
+def inferenceFeed(graph = None):
+    """ Returns the feed entries which switch off every dropout layer in the graph, for evaluating rather than training """
+    graph = graph or tf.get_default_graph()
+    return {keepProbability: 1.0 for keepProbability in graph.get_collection(dropoutCollection)}
+
+
+def tensorNodeName(tensor):
+    name = tensor if isinstance(tensor, str) else tensor.name
+    return name.split(':')[0]
+
+
+def freezeGraph(session, inputNames, outputs):
+    """ Returns a GraphDef holding only what is needed to compute the outputs, with every variable folded into
+        a constant and dropout switched off. Optimizer slots, summaries and the loss are all left behind. Also
+        returns the names of the inputs that the outputs actually depend on. """
+    graphDef = session.graph.as_graph_def()
+
+    # Dropout is switched off by turning its keep probability into a constant 1.0, which TensorFlow then simplifies
+    keepProbabilityNodes = set(tensorNodeName(tensor) for tensor in session.graph.get_collection(dropoutCollection))
+    for node in graphDef.node:
+        if node.name in keepProbabilityNodes:
+            node.op = "Const"
+            del node.input[:]
+            node.attr.clear()
+            node.attr["dtype"].type = tf.float32.as_datatype_enum
+            node.attr["value"].tensor.CopyFrom(tf.make_tensor_proto(1.0, dtype = tf.float32))
+
+    outputNodeNames = sorted(set(tensorNodeName(tensor) for tensor in outputs))
+    frozen = tf.graph_util.convert_variables_to_constants(session, graphDef, outputNodeNames)
+
+    remaining = set(node.name for node in frozen.node)
+    usedInputs = [name for name in inputNames if tensorNodeName(name) in remaining]
+    return frozen, usedInputs
+
+
+def writeInferenceGraph(fileName, graphDef, signature):
+    """ Writes a frozen graph along with its signature as a single file. The signature names the input and output
+        tensors, and carries anything else the serving process needs, such as the schemas. """
+    arrays = {
+        "graph": numpy.frombuffer(graphDef.SerializeToString(), dtype = numpy.uint8),
+        "signature": numpy.frombuffer(json.dumps(signature).encode('utf-8'), dtype = numpy.uint8)
+    }
+    writeSegment(fileName, layoutSegment(arrays))
+
+
+class EBInferenceGraph:
+    """ A frozen graph loaded for serving, in a graph and session of its own, separate from any training graph """
+    def __init__(self, fileName, sessionConfig = None):
+        arrays = readSegment(fileName)
+        if arrays is None or "graph" not in arrays:
+            raise Exception("The file " + str(fileName) + " is not an exported inference graph")
+
+        self.signature = json.loads(arrays["signature"].tobytes().decode('utf-8'))
+
+        graphDef = tf.GraphDef()
+        graphDef.ParseFromString(arrays["graph"].tobytes())
+
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            tf.import_graph_def(graphDef, name = "")
+        self.session = tf.Session(graph = self.graph, config = sessionConfig)
+
+        self.inputs = set(self.signature["inputs"])
+        self.outputs = self.signature["outputs"]
+
+    def run(self, feedDict):
+        """ Evaluates the outputs, returning them in the same structure as they are named in the signature.
+            Entries in the feed dictionary for inputs which the outputs do not depend on are ignored. """
+        feedDict = {name: feedDict[name] for name in feedDict if name in self.inputs}
+        return self.session.run(self.outputs, feed_dict = feedDict)
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,149 @@
+#
+# Electric Brain is an easy to use platform for machine learning.
+# Copyright (C) 2016 Electric Brain Software Corporation
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import collections
+import concurrent.futures
+import threading
+import time
+
+
+class EBHistogram:
+    """ Counts values into power of two buckets. The bucket named "8" holds the values from 5 to 8. """
+    def __init__(self):
+        self.buckets = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def record(self, value):
+        bucket = 1
+        while bucket < value:
+            bucket *= 2
+        with self.lock:
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+    def summary(self):
+        with self.lock:
+            return {str(bucket): self.buckets[bucket] for bucket in sorted(self.buckets)}
+
+
+class EBMicroBatcher:
+    """ Merges evaluation requests which arrive close together into a single batch.
+
+        submit(samples) queues the samples of one request and returns a future for their results. A background
+        thread takes the oldest request, then keeps adding queued requests until the batch holds maxBatchSize
+        samples or maxLatency seconds have passed since the oldest request arrived. It calls run once with the
+        samples of the whole batch, which must return one result for each sample, and then hands each request
+        back its own slice of the results.
+
+        A request is never split across batches. A request larger than maxBatchSize is run as a batch of its own.
+    """
+    def __init__(self, run, maxBatchSize = 32, maxLatency = 0.005):
+        self.run = run
+        self.maxBatchSize = max(int(maxBatchSize), 1)
+        self.maxLatency = maxLatency
+        self.queue = collections.deque()
+        self.condition = threading.Condition()
+        self.stopped = False
+
+        self.batchSizes = EBHistogram()
+        self.queueDepths = EBHistogram()
+        self.requests = 0
+        self.batches = 0
+        self.samples = 0
+
+        self.thread = threading.Thread(target = self.loop, daemon = True)
+        self.thread.start()
+
+    def submit(self, samples):
+        future = concurrent.futures.Future()
+        with self.condition:
+            if self.stopped:
+                raise Exception("The micro-batcher has been stopped")
+            self.queue.append((samples, future, time.time()))
+            self.condition.notify()
+        return future
+
+    def takeBatch(self):
+        """ Waits for the next batch of requests, returning an empty list once stopped """
+        with self.condition:
+            while len(self.queue) == 0 and not self.stopped:
+                self.condition.wait()
+            if len(self.queue) == 0:
+                return []
+
+            deadline = self.queue[0][2] + self.maxLatency
+            while not self.stopped:
+                queued = sum(len(request[0]) for request in self.queue)
+                remaining = deadline - time.time()
+                if queued >= self.maxBatchSize or remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+
+            # The queue depth is measured as the batch is formed, including the requests that go into it
+            self.queueDepths.record(len(self.queue))
+
+            batch = [self.queue.popleft()]
+            size = len(batch[0][0])
+            while len(self.queue) > 0 and size + len(self.queue[0][0]) <= self.maxBatchSize:
+                request = self.queue.popleft()
+                batch.append(request)
+                size += len(request[0])
+            return batch
+
+    def loop(self):
+        while True:
+            batch = self.takeBatch()
+            if len(batch) == 0:
+                return
+
+            samples = []
+            for request in batch:
+                samples.extend(request[0])
+
+            self.batchSizes.record(len(samples))
+            self.requests += len(batch)
+            self.batches += 1
+            self.samples += len(samples)
+
+            try:
+                results = self.run(samples)
+            except Exception as exception:
+                for request in batch:
+                    request[1].set_exception(exception)
+                continue
+
+            offset = 0
+            for request in batch:
+                request[1].set_result(results[offset:offset + len(request[0])])
+                offset += len(request[0])
+
+    def stop(self):
+        """ Stops once every queued request has been run. Requests still queued are run without waiting for more. """
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        self.thread.join()
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "batches": self.batches,
+            "samples": self.samples,
+            "maxBatchSize": self.maxBatchSize,
+            "maxLatency": self.maxLatency,
+            "batchSizes": self.batchSizes.summary(),
+            "queueDepths": self.queueDepths.summary()
+        }
@@ -0,0 +1,81 @@
+#
+# Electric Brain is an easy to use platform for machine learning.
+# Copyright (C) 2016 Electric Brain Software Corporation
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import numpy
+
+
+class EBOutputPolicy:
+    """ Decides which training iterations send their outputs back, and for which samples.
+
+        The policy is given with the iteration message, either as a mode name or as an object:
+
+            {"mode": "all"}                     Every iteration returns outputs for the whole batch. The default.
+            {"mode": "none"}                    Only the loss is returned.
+            {"mode": "every", "every": 10}      Every 10th iteration returns outputs for the whole batch.
+            {"mode": "sample", "sampleSize": 8} Every iteration returns outputs for 8 randomly chosen samples.
+    """
+    modes = ["all", "none", "every", "sample"]
+
+    def __init__(self, policy = None):
+        if policy is None:
+            policy = {}
+        elif isinstance(policy, str):
+            policy = {"mode": policy}
+
+        self.mode = policy.get("mode", "all")
+        self.every = max(int(policy.get("every", 1)), 1)
+        self.sampleSize = max(int(policy.get("sampleSize", 1)), 1)
+
+        if self.mode not in EBOutputPolicy.modes:
+            raise Exception("Unknown output policy mode: " + str(self.mode))
+
+    def includesOutputs(self, step):
+        """ Returns whether the iteration with the given step number should evaluate its outputs at all """
+        if self.mode == 'none':
+            return False
+        if self.mode == 'every':
+            return step % self.every == 0
+        return True
+
+    def chooseSamples(self, batchSize):
+        """ Returns the sorted indexes of the samples to send outputs for, or None for the whole batch """
+        if self.mode != 'sample' or self.sampleSize >= batchSize:
+            return None
+        return numpy.sort(numpy.random.choice(batchSize, self.sampleSize, replace = False))
+
+
+def selectSamples(component, arrays, indexes):
+    """ Returns the arrays for a component, keeping only the given samples along each array's batch axis """
+    selected = {}
+    for key in arrays:
+        array = arrays[key]
+        axis = component.get_batch_axis(key)
+        if isinstance(array, numpy.ndarray) and array.ndim > axis:
+            selected[key] = numpy.take(array, indexes, axis = axis)
+        else:
+            selected[key] = array
+    return selected
+
+
+def countSamples(component, arrays):
+    """ Returns the number of samples in a batch of arrays for the given component """
+    for key in arrays:
+        array = arrays[key]
+        axis = component.get_batch_axis(key)
+        if isinstance(array, numpy.ndarray) and array.ndim > axis:
+            return array.shape[axis]
+    return 0
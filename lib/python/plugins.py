@@ -24,9 +24,18 @@ class EBNeuralNetworkComponentBase:
     def __init__(self, schema, prefix):
         self.schema = schema
         self.prefix = prefix
+        self.cachedMachineVariableName = self.prefix + "-" + self.schema.machineName
 
     def machineVariableName(self):
-        return self.prefix + "-" + self.schema["metadata"]['variablePath'].replace("[]", "__array__").replace(" ", "")
+        return self.cachedMachineVariableName
+
+    def get_batch_axis(self, key):
+        """ Returns the axis which indexes samples within the converted array for the given key """
+        return 0
+
+    def get_padded_length(self, value):
+        """ Returns the number of time steps the given value will be padded to. Zero for values without any sequences. """
+        return 0
 
 
 def createNeuralNetworkComponent(schema, prefix):
@@ -0,0 +1,107 @@
+#
+# Electric Brain is an easy to use platform for machine learning.
+# Copyright (C) 2016 Electric Brain Software Corporation
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import collections
+import hashlib
+import json
+import threading
+import time
+
+
+def canonicalHash(sample):
+    """ Returns a hash of a sample which is the same for equal samples, regardless of the order of their keys """
+    canonical = json.dumps(sample, sort_keys = True, separators = (',', ':'), ensure_ascii = False)
+    return hashlib.sha1(canonical.encode('utf-8')).hexdigest()
+
+
+class EBPredictionCache:
+    """ A least recently used cache of the outputs for individual samples, so that repeated samples are not
+        converted and run through the network again.
+
+        Entries are keyed by the canonical hash of the sample along with the model version. The version goes up
+        whenever the weights change - on load, reset and every training step - which also clears the cache,
+        since none of its entries can be used again. Entries older than ttl seconds are treated as misses.
+
+        The cache is disabled while maxEntries is zero.
+    """
+    def __init__(self, maxEntries = 0, ttl = None):
+        self.maxEntries = int(maxEntries)
+        self.ttl = ttl
+        self.entries = collections.OrderedDict()
+        self.modelVersion = 0
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def enabled(self):
+        return self.maxEntries > 0
+
+    def invalidate(self):
+        """ Called whenever the weights of the model change """
+        with self.lock:
+            self.modelVersion += 1
+            self.entries.clear()
+
+    def lookup(self, samples):
+        """ Returns the keys for the samples, and a list with the cached output for each sample, or None where
+            there is no usable entry """
+        keys = [(canonicalHash(sample), self.modelVersion) for sample in samples]
+        now = time.time()
+        outputs = []
+        with self.lock:
+            for key in keys:
+                entry = self.entries.get(key)
+                if entry is not None and self.ttl is not None and now - entry[1] > self.ttl:
+                    del self.entries[key]
+                    self.expired += 1
+                    entry = None
+
+                if entry is None:
+                    self.misses += 1
+                    outputs.append(None)
+                else:
+                    self.hits += 1
+                    self.entries.move_to_end(key)
+                    outputs.append(entry[0])
+        return keys, outputs
+
+    def store(self, key, output):
+        with self.lock:
+            # Outputs computed before the model changed are dropped, rather than cached under the old version
+            if key[1] != self.modelVersion:
+                return
+            self.entries[key] = (output, time.time())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxEntries:
+                self.entries.popitem(last = False)
+                self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hitRatio": (self.hits / lookups) if lookups > 0 else None,
+            "expired": self.expired,
+            "evictions": self.evictions,
+            "entries": len(self.entries),
+            "maxEntries": self.maxEntries,
+            "ttl": self.ttl,
+            "modelVersion": self.modelVersion
+        }
@@ -0,0 +1,72 @@
+#
+# Electric Brain is an easy to use platform for machine learning.
+# Copyright (C) 2016 Electric Brain Software Corporation
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import queue
+import threading
+
+
+class EBBatchPrefetcher:
+    """ Loads batches on a background thread, keeping up to depth batches staged ahead of the consumer.
+
+        Iterating over the prefetcher yields (item, batch) pairs in the same order as the given items, where
+        batch is the result of load(item). An exception raised while loading is re-raised in the consumer.
+    """
+    def __init__(self, items, load, depth = 2):
+        self.items = items
+        self.load = load
+        self.staged = queue.Queue(maxsize = max(depth, 1))
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target = self.run, daemon = True)
+        self.thread.start()
+
+    def stage(self, batch):
+        """ Waits for room in the queue, giving up and returning False if the consumer has stopped """
+        while not self.stopped.is_set():
+            try:
+                self.staged.put(batch, timeout = 0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def run(self):
+        for item in self.items:
+            try:
+                batch = (item, self.load(item), None)
+            except Exception as exception:
+                batch = (item, None, exception)
+
+            if not self.stage(batch) or batch[2] is not None:
+                return
+
+        self.stage(None)
+
+    def __iter__(self):
+        try:
+            while True:
+                batch = self.staged.get()
+                if batch is None:
+                    return
+                item, loaded, exception = batch
+                if exception is not None:
+                    raise exception
+                yield item, loaded
+        finally:
+            self.close()
+
+    def close(self):
+        self.stopped.set()
@@ -0,0 +1,149 @@
+#
+# Electric Brain is an easy to use platform for machine learning.
+# Copyright (C) 2016 Electric Brain Software Corporation
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import struct
+import sys
+import numpy
+
+# Every binary frame starts with this marker, followed by the header length and the payload length
+frameMagic = b'EBF1'
+frameHeader = struct.Struct('<4sII')
+
+# Tensors are aligned within the payload so that they can be viewed as typed arrays without copying
+tensorAlignment = 8
+
+
+def encodeJSONValue(value):
+    """ Used as the default function for json.dumps, so that numpy values can be written as JSON """
+    if isinstance(value, numpy.ndarray):
+        return value.tolist()
+    if isinstance(value, numpy.generic):
+        return value.item()
+    raise TypeError("Object of type " + type(value).__name__ + " is not JSON serializable")
+
+
+class EBJSONProtocol:
+    """ The default protocol, where each message is a single line of JSON """
+    name = "json"
+
+    def __init__(self, input = None, output = None):
+        self.input = input or sys.stdin.buffer
+        self.output = output or sys.stdout.buffer
+
+    def readMessage(self):
+        """ Returns the next message, or None once the input has been closed """
+        while True:
+            line = self.input.readline()
+            if len(line) == 0:
+                return None
+            if line.strip():
+                return json.loads(line.decode('utf-8'))
+
+    def writeMessage(self, message):
+        self.output.write(json.dumps(message, default = encodeJSONValue).encode('utf-8') + b"\n")
+        self.output.flush()
+
+
+class EBBinaryProtocol:
+    """ A length-prefixed binary protocol. Each frame holds a JSON header followed by a payload of raw,
+        little-endian tensor data.
+
+        Any numpy array within a message is moved into the payload, and replaced within the header by
+        an object of the form {"$tensor": {"dtype": "float32", "shape": [...], "offset": 0, "length": 1200}}
+    """
+    name = "binary"
+
+    def __init__(self, input = None, output = None):
+        self.input = input or sys.stdin.buffer
+        self.output = output or sys.stdout.buffer
+
+    def readExactly(self, length):
+        data = self.input.read(length)
+        if len(data) < length:
+            return None
+        return data
+
+    def readMessage(self):
+        """ Returns the next message, or None once the input has been closed """
+        header = self.readExactly(frameHeader.size)
+        if header is None:
+            return None
+
+        magic, headerLength, payloadLength = frameHeader.unpack(header)
+        if magic != frameMagic:
+            raise Exception("Received a malformed frame from the parent process")
+
+        headerData = self.readExactly(headerLength)
+        payload = self.readExactly(payloadLength)
+        if headerData is None or payload is None:
+            return None
+
+        return self.decodeValue(json.loads(headerData.decode('utf-8')), payload)
+
+    def decodeValue(self, value, payload):
+        if isinstance(value, dict):
+            if "$tensor" in value and len(value) == 1:
+                tensor = value["$tensor"]
+                dtype = numpy.dtype(tensor["dtype"]).newbyteorder('<')
+                array = numpy.frombuffer(payload, dtype = dtype, count = tensor["length"] // dtype.itemsize, offset = tensor["offset"])
+                return array.reshape(tensor["shape"])
+            return {key: self.decodeValue(value[key], payload) for key in value}
+        elif isinstance(value, list):
+            return [self.decodeValue(item, payload) for item in value]
+        return value
+
+    def encodeValue(self, value, buffers, payloadLength):
+        """ Returns the JSON-compatible version of the value, moving numpy arrays into the given buffer list """
+        if isinstance(value, numpy.ndarray) and value.dtype.kind in 'biuf':
+            array = numpy.ascontiguousarray(value, dtype = value.dtype.newbyteorder('<'))
+            offset = payloadLength[0]
+            padding = (-offset) % tensorAlignment
+            if padding > 0:
+                buffers.append(b'\0' * padding)
+                offset += padding
+            buffers.append(array.tobytes())
+            payloadLength[0] = offset + array.nbytes
+            return {"$tensor": {"dtype": array.dtype.name, "shape": list(array.shape), "offset": offset, "length": array.nbytes}}
+        elif isinstance(value, dict):
+            return {key: self.encodeValue(value[key], buffers, payloadLength) for key in value}
+        elif isinstance(value, (list, tuple)):
+            return [self.encodeValue(item, buffers, payloadLength) for item in value]
+        elif isinstance(value, numpy.ndarray):
+            return value.tolist()
+        elif isinstance(value, numpy.generic):
+            return value.item()
+        return value
+
+    def writeMessage(self, message):
+        buffers = []
+        payloadLength = [0]
+        header = json.dumps(self.encodeValue(message, buffers, payloadLength)).encode('utf-8')
+
+        self.output.write(frameHeader.pack(frameMagic, len(header), payloadLength[0]))
+        self.output.write(header)
+        for buffer in buffers:
+            self.output.write(buffer)
+        self.output.flush()
+
+
+def negotiateProtocol(handshake):
+    """ Returns the protocol to switch to after responding to the given handshake message. The parent
+        process lists the protocols it supports, and binary is chosen whenever it is offered. """
+    if "binary" in handshake.get("protocols", []):
+        return EBBinaryProtocol()
+    return EBJSONProtocol()
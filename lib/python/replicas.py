@@ -0,0 +1,90 @@
+#
+# Electric Brain is an easy to use platform for machine learning.
+# Copyright (C) 2016 Electric Brain Software Corporation
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import time
+import numpy
+
+
+class EBReplicaGroup:
+    """ Exchanges vectors between a fixed group of replica processes on the same machine, through a shared
+        memory-mapped file. Used for synchronous data-parallel training, where every replica computes gradients
+        on its own shard of a batch and all replicas then apply the same averaged gradients.
+
+        The file holds one progress counter per replica, followed by one vector slot per replica. Each exchange
+        is a round made of two phases: every replica writes its slot and marks it written, waits until all
+        replicas have written, combines the slots, and then marks that it has finished reading. A replica only
+        overwrites its slot once every replica has finished reading the previous round.
+
+        Every replica in the group must make the same sequence of exchanges, with vectors of the same size, no
+        larger than the size of the slots.
+    """
+    def __init__(self, fileName, replicaCount, replicaIndex, size, timeout = 600):
+        self.fileName = fileName
+        self.replicaCount = replicaCount
+        self.replicaIndex = replicaIndex
+        self.size = size
+        self.timeout = timeout
+        self.round = 0
+
+        counterBytes = replicaCount * 8
+        totalBytes = counterBytes + replicaCount * size * 4
+
+        # Every replica creates the file if it needs to. Growing it with truncate fills it with zeros.
+        descriptor = os.open(fileName, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if os.fstat(descriptor).st_size < totalBytes:
+                os.ftruncate(descriptor, totalBytes)
+        finally:
+            os.close(descriptor)
+
+        self.counters = numpy.memmap(fileName, dtype = numpy.int64, mode = 'r+', offset = 0, shape = (replicaCount,))
+        self.slots = numpy.memmap(fileName, dtype = numpy.float32, mode = 'r+', offset = counterBytes, shape = (replicaCount, size))
+
+    def waitForCounters(self, value):
+        start = time.time()
+        while numpy.min(self.counters) < value:
+            if time.time() - start > self.timeout:
+                raise Exception("Timed out waiting for the other training replicas. Replica progress: " + str(self.counters.tolist()))
+            time.sleep(0.0005)
+
+    def exchange(self, vector, combine):
+        """ Runs one round of the exchange, returning combine(slots) where slots has one row for each replica """
+        self.round += 1
+        written = self.round * 2 - 1
+        read = self.round * 2
+
+        # Vectors may be shorter than the slots, in which case only the start of each slot is used
+        length = len(vector)
+
+        # Wait until every replica has finished reading the previous round before overwriting our slot
+        self.waitForCounters(written - 1)
+        self.slots[self.replicaIndex, :length] = vector
+        self.counters[self.replicaIndex] = written
+
+        self.waitForCounters(written)
+        result = numpy.array(combine(self.slots[:, :length]), dtype = numpy.float32)
+        self.counters[self.replicaIndex] = read
+        return result
+
+    def allreduceSum(self, vector):
+        """ Returns the sum of the vectors from every replica """
+        return self.exchange(vector, lambda slots: numpy.sum(slots, axis = 0))
+
+    def broadcast(self, vector):
+        """ Returns the vector given by the first replica, ignoring the vectors from the others """
+        return self.exchange(vector, lambda slots: slots[0])
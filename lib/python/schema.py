@@ -16,7 +16,6 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import tensorflow as tf
-from utils import eprint
 
 loaded = False
 
@@ -31,6 +30,15 @@ class EBSchema:
             else:
                 self.__dict__[key] = schema[key]
 
+        # Schemas never change once constructed, so everything derived from the tree is computed up front
+        if 'metadata' in self.__dict__ and 'variablePath' in self.metadata:
+            self.variablePath = self.metadata['variablePath']
+        else:
+            self.variablePath = ""
+        self.machineName = self.variablePath.replace("[]", "__array__").replace(" ", "")
+
+        self.sortedPropertyNames = tuple(sorted(self.properties.keys())) if self.isObject() else ()
+
     def __getitem__(self, key):
         return self.__dict__[key]
 
@@ -61,10 +69,7 @@ class EBSchema:
         return 'binary' in self.type
 
     def propertyNames(self):
-        if not self.isObject():
-            return []
-        else:
-            return sorted(self.properties.keys())
+        return self.sortedPropertyNames
 
     def fields(self):
         if not self.isObject():
@@ -0,0 +1,89 @@
+#
+# Electric Brain is an easy to use platform for machine learning.
+# Copyright (C) 2016 Electric Brain Software Corporation
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import tensorflow as tf
+from utils import eprint
+
+
+def applyCpuAffinity(cpus):
+    """ Pins every thread of the process to the given cores. Threads created afterwards, such as TensorFlow's thread
+        pools, inherit the affinity from the thread that creates them. """
+    if not hasattr(os, "sched_setaffinity"):
+        eprint("CPU affinity is not supported on this platform, so cpuAffinity is ignored")
+        return
+
+    cpus = set(int(cpu) for cpu in cpus)
+    threads = [0]
+    if os.path.isdir("/proc/self/task"):
+        threads = [int(thread) for thread in os.listdir("/proc/self/task")]
+    for thread in threads:
+        try:
+            os.sched_setaffinity(thread, cpus)
+        except ProcessLookupError:
+            # The thread exited while we were going through the list
+            pass
+
+
+def allowedCpuCount():
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count()
+
+
+def createSessionConfig(profile):
+    """ Applies the cpu affinity from a resource profile, and returns the tf.ConfigProto for new sessions, or None
+        when there is no profile. Resource profiles limit the threads and cores used by a model process, so that
+        several models can share a machine. Every field of the profile is optional:
+
+            intraOpThreads  Threads used within a single op, such as a matrix multiplication. 0 lets TensorFlow choose.
+            interOpThreads  Threads used to run independent ops at the same time. 0 lets TensorFlow choose.
+            cpuAffinity     A list of the cores the process may run on
+            allowGrowth     Whether to allocate GPU memory as it is needed, rather than all of it up front
+    """
+    if not profile:
+        return None
+
+    if profile.get("cpuAffinity"):
+        applyCpuAffinity(profile["cpuAffinity"])
+
+    config = tf.ConfigProto(intra_op_parallelism_threads = int(profile.get("intraOpThreads", 0)),
+                            inter_op_parallelism_threads = int(profile.get("interOpThreads", 0)))
+    config.gpu_options.allow_growth = bool(profile.get("allowGrowth", False))
+    return config
+
+
+def describeSessionConfig(config):
+    """ Returns the configuration that sessions created with the given config actually run with, for reporting back """
+    cpus = allowedCpuCount()
+    intraOpThreads = 0
+    interOpThreads = 0
+    allowGrowth = False
+    if config is not None:
+        intraOpThreads = config.intra_op_parallelism_threads
+        interOpThreads = config.inter_op_parallelism_threads
+        allowGrowth = config.gpu_options.allow_growth
+
+    affinity = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(cpus))
+
+    # When the thread counts are left at zero, TensorFlow sizes both pools by the cores the process may run on
+    return {
+        "intraOpThreads": intraOpThreads if intraOpThreads > 0 else cpus,
+        "interOpThreads": interOpThreads if interOpThreads > 0 else cpus,
+        "cpuAffinity": affinity,
+        "allowGrowth": allowGrowth
+    }
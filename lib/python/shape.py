@@ -38,6 +38,18 @@ class EBTensorShape:
         newDimensionNames = self.dimensionNames[1:]
         return EBTensorShape(newDimensionSizes, newDimensionNames, self.variableName)
 
+    def insertDimension(self, index, size, name):
+        """ Returns a new EBTensorShape object with an additional dimension inserted at the given index """
+        newDimensionSizes = self.dimensionSizes[:index] + [size] + self.dimensionSizes[index:]
+        newDimensionNames = self.dimensionNames[:index] + [name] + self.dimensionNames[index:]
+        return EBTensorShape(newDimensionSizes, newDimensionNames, self.variableName)
+
+    def removeDimension(self, index):
+        """ Returns a new EBTensorShape object with the dimension at the given index removed """
+        newDimensionSizes = self.dimensionSizes[:index] + self.dimensionSizes[index + 1:]
+        newDimensionNames = self.dimensionNames[:index] + self.dimensionNames[index + 1:]
+        return EBTensorShape(newDimensionSizes, newDimensionNames, self.variableName)
+
     def __str__(self):
         string = "EBTensorShape("
         for x in range(len(self.dimensionSizes)):
@@ -0,0 +1,273 @@
+#
+# Electric Brain is an easy to use platform for machine learning.
+# Copyright (C) 2016 Electric Brain Software Corporation
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import os
+import tensorflow as tf
+from utils import eprint
+from adamax import AdamaxOptimizer
+from dispatcher import EBMessageDispatcher
+from session_config import createSessionConfig, describeSessionConfig
+from batch_store import EBBatchPool, EBBatchCache
+from checkpoints import EBCheckpointStore
+from prefetch import EBBatchPrefetcher
+
+
+class EBTrainingScript:
+    """ The lifecycle shared by the training scripts of every architecture - the session and its optimizer,
+        summaries, the batch pool, training several steps per message and checkpoints - along with the messages
+        which drive it.
+
+        A script builds its own graph, and implements:
+
+            initialize(data)                        Builds the graph from an initialize message
+            rebuildGraph()                          Builds the graph again, after the default graph has been reset
+            readTrainingBatch(batch)                Returns the feed dictionary for one of the batches given to trainSteps,
+                                                    reading its files with readCachedBatch
+            handleScriptMessage(data, response)     Handles the messages specific to the script
+
+        It may also override createTrainingStep, initializeVariables and weightsChanged.
+    """
+    # The lane that each type of message runs on, when it is sent with a requestId. See EBMessageDispatcher
+    messageLanes = {}
+
+    def __init__(self):
+        self.session = None
+        self.sessionConfig = None
+        self.sessionConfigInUse = None
+        self.optimizerKey = None
+        self.allSummaryOutputs = None
+        self.summaryWriter = None
+        self.batchPool = EBBatchPool()
+        self.batchCache = EBBatchCache()
+        self.checkpoints = EBCheckpointStore()
+
+        # A frozen graph loaded for serving, which evaluation uses in place of the training graph
+        self.inferenceGraph = None
+        self.iterationCount = 0
+
+    def reset(self, optimizationAlgorithm, optimizationParameters, summaries = False, synchronize = True):
+        """ Reinitializes every variable, ready to train from scratch with the given optimizer. The optimizer ops
+            are reused when the algorithm and its parameters are unchanged. Otherwise the graph is rebuilt from
+            scratch, so that the ops of previous optimizers don't pile up in it. Summaries are only evaluated
+            and written when enabled. The new values are only synchronized with any other processes in the
+            group when synchronize is set, which needs every process in the group to be reset at the same time. """
+        optimizerKey = (optimizationAlgorithm, json.dumps(optimizationParameters, sort_keys = True))
+        if self.session is None or optimizerKey != self.optimizerKey:
+            self.buildOptimizer(optimizationAlgorithm, optimizationParameters)
+            self.optimizerKey = optimizerKey
+
+        # A new session is only needed when the resource profile has changed. The parent sends its profile with
+        # every reset, so the contents of the configuration are compared rather than the objects.
+        sessionConfig = describeSessionConfig(self.sessionConfig)
+        if self.session is None or sessionConfig != self.sessionConfigInUse:
+            if self.session is not None:
+                self.session.close()
+            self.session = tf.Session(config = self.sessionConfig)
+            self.sessionConfigInUse = sessionConfig
+
+        if summaries:
+            if self.summaryWriter is None:
+                self.summaryWriter = tf.summary.FileWriter('./logs', self.session.graph)
+            self.allSummaryOutputs = self.mergedSummaries
+        else:
+            self.allSummaryOutputs = None
+
+        self.initializeVariables(synchronize)
+        self.weightsChanged()
+
+    def ensureSession(self):
+        """ Creates the session with the default optimizer, for messages which need the variables before any reset.
+            These messages may only be sent to one process of a group, so the variables are not synchronized. """
+        if self.session is None:
+            self.reset("AdadeltaOptimizer", {}, synchronize = False)
+
+    def buildOptimizer(self, optimizationAlgorithm, optimizationParameters):
+        if self.session is not None:
+            # Start again with a fresh graph, rather than adding a second optimizer to the existing one
+            self.session.close()
+            self.session = None
+            if self.summaryWriter is not None:
+                self.summaryWriter.close()
+                self.summaryWriter = None
+            tf.reset_default_graph()
+            self.rebuildGraph()
+
+        self.optimizationAlgorithm = optimizationAlgorithm
+        self.optimizationParameters = optimizationParameters
+
+        if optimizationAlgorithm == 'AdamaxOptimizer':
+            optimizer = AdamaxOptimizer(**self.optimizationParameters)
+        else:
+            optimizer = getattr(tf.train, optimizationAlgorithm)(**self.optimizationParameters)
+        self.createTrainingStep(optimizer)
+
+        # These are built once per graph, since every call would otherwise add new ops to it
+        tf.summary.scalar("loss", self.totalLoss)
+        self.mergedSummaries = tf.summary.merge_all()
+        self.initializer = tf.global_variables_initializer()
+
+    def createTrainingStep(self, optimizer):
+        self.trainingStep = optimizer.minimize(self.totalLoss)
+
+    def initializeVariables(self, synchronize):
+        self.session.run(self.initializer)
+
+    def weightsChanged(self):
+        """ Called whenever the values of the variables change, by a reset, a load or a training step """
+        pass
+
+    def writeSummary(self, summary):
+        if self.summaryWriter is not None:
+            self.summaryWriter.add_summary(summary, self.iterationCount)
+
+    def readBatch(self, fileName):
+        """ Returns a new feed dictionary for the batch """
+        return self.batchPool.read(fileName)
+
+    def readCachedBatch(self, fileName):
+        """ Returns a new feed dictionary for a training batch, reusing the arrays if the batch has been read before """
+        return dict(self.batchCache.get(fileName, self.batchPool.read))
+
+    def releaseBatch(self, fileName):
+        self.batchCache.discard(fileName)
+        self.batchPool.release(fileName)
+
+    def runTrainingStep(self, feedDict, evaluations = []):
+        """ Runs the training op along with any extra tensors to evaluate. Returns the loss and the values of the extra tensors. """
+        runList = [self.totalLoss, self.trainingStep] + evaluations
+
+        if self.allSummaryOutputs is not None:
+            runList.append(self.allSummaryOutputs)
+
+        results = self.session.run(runList, feed_dict = feedDict)
+        if self.allSummaryOutputs is not None:
+            self.writeSummary(results[-1])
+        return float(results[0]), results[2:2 + len(evaluations)]
+
+    def trainSteps(self, batches, steps, prefetchDepth):
+        """ Trains for the given number of steps, cycling through the batches. Batches are read on a background
+            thread, staying prefetchDepth batches ahead of the training steps. Returns the loss for each step. """
+        if len(batches) == 0:
+            return []
+        if steps is None:
+            steps = len(batches)
+
+        # Batches deleted by the parent since the last message are dropped, so the cache doesn't keep their memory
+        self.batchCache.prune()
+
+        schedule = [batches[step % len(batches)] for step in range(steps)]
+        losses = []
+        for batch, feedDict in EBBatchPrefetcher(schedule, self.readTrainingBatch, prefetchDepth):
+            totalLoss, values = self.runTrainingStep(feedDict)
+            losses.append(totalLoss)
+            self.weightsChanged()
+            self.iterationCount += 1
+        return losses
+
+    def save(self, wait):
+        """ Snapshots the variables into a new checkpoint, which is written in the background unless wait is set.
+            Returns the version of the checkpoint. """
+        self.ensureSession()
+
+        metadata = {
+            "iterationCount": self.iterationCount,
+            "optimizationAlgorithm": self.optimizationAlgorithm
+        }
+        version, pending = self.checkpoints.save(self.session, tf.global_variables(), metadata)
+        if wait:
+            pending.result()
+        return version
+
+    def load(self, fileName):
+        """ Restores the variables from a checkpoint weights file """
+        self.ensureSession()
+
+        # Any checkpoint still being written is finished first, in case it is the one being loaded
+        self.checkpoints.wait()
+
+        missing = self.checkpoints.restore(self.session, tf.global_variables(), fileName)
+        if len(missing) > 0:
+            eprint("Variables not found in " + fileName + ", which keep their initial values: " + ", ".join(missing))
+
+        self.weightsChanged()
+
+    def messageLane(self, data):
+        """ Returns the lane that the message runs on when it is sent with a requestId, or None to handle it in order """
+        return type(self).messageLanes.get(data["type"])
+
+    def handleMessage(self, data):
+        """ Handles a single message from the parent process, and returns the response """
+        response = {}
+        if (data["type"] == 'handshake'):
+            response["type"] = "handshake"
+            response["name"] = "TrainingScript.py"
+            response["version"] = "0.0.1"
+
+            if "batchPoolFolder" in data or "batchPoolBytes" in data:
+                self.batchPool = EBBatchPool(data.get("batchPoolFolder"), data.get("batchPoolBytes", self.batchPool.maxBytes))
+            if "batchCacheBytes" in data:
+                self.batchCache = EBBatchCache(maxBytes = data["batchCacheBytes"])
+            if "checkpointFolder" in data or "checkpointsToKeep" in data:
+                self.checkpoints = EBCheckpointStore(data.get("checkpointFolder", "checkpoints"), data.get("checkpointsToKeep", 5))
+        elif (data["type"] == 'initialize'):
+            # The resource profile is applied first, so that any threads started while building the graph are pinned
+            if "resources" in data:
+                self.sessionConfig = createSessionConfig(data["resources"])
+
+            self.initialize(data)
+
+            response["type"] = "initialized"
+            response["resources"] = describeSessionConfig(self.sessionConfig)
+        elif (data["type"] == 'reset'):
+            if "resources" in data:
+                self.sessionConfig = createSessionConfig(data["resources"])
+            self.reset(data["optimizationAlgorithm"], data["optimizationParameters"], data.get("summaries", False))
+            response["type"] = "resetCompleted"
+            response["resources"] = describeSessionConfig(self.sessionConfig)
+        elif (data["type"] == 'releaseBatches'):
+            for fileName in data["fileNames"]:
+                self.releaseBatch(fileName)
+            response["type"] = "batchesReleased"
+            response["poolBytes"] = self.batchPool.usage()
+        elif (data["type"] == 'batchCacheStats'):
+            response["type"] = "batchCacheStats"
+            response["stats"] = self.batchCache.stats()
+        elif (data["type"] == 'save'):
+            version = self.save(data.get("wait", True))
+            response["type"] = "saved"
+            response["version"] = version
+            response["fileName"] = os.path.abspath(self.checkpoints.weightsFile(version))
+        elif (data["type"] == 'load'):
+            if "version" in data:
+                fileName = self.checkpoints.weightsFile(data["version"])
+            else:
+                fileName = data.get("fileName", "model.tfg")
+            self.load(fileName)
+            response["type"] = "loaded"
+        elif (data["type"] == 'checkpoints'):
+            response["type"] = "checkpoints"
+            response["checkpoints"] = [self.checkpoints.describe(version) for version in self.checkpoints.versions()]
+        else:
+            self.handleScriptMessage(data, response)
+
+        return response
+
+    def main(self):
+        """  This is the main entry point of the training script."""
+        dispatcher = EBMessageDispatcher(self.handleMessage, self.messageLane)
+        dispatcher.run()
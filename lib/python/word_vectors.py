@@ -0,0 +1,448 @@
+#
+# Electric Brain is an easy to use platform for machine learning.
+# Copyright (C) 2016 Electric Brain Software Corporation
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import os
+import shutil
+import sqlite3
+import zlib
+import numpy
+from utils import eprint
+
+# The version of the on-disk format written by EBWordVectorStoreWriter
+storeFormatVersion = 1
+
+# The number of vocabulary rows scored at once during nearest neighbour searches
+nearestBlockSize = 65536
+
+# The stores shared within this process, keyed by the path they were opened with. Each entry is a
+# list holding the store and the number of components currently using it.
+sharedStores = {}
+
+
+def hashWord(encodedWord):
+    """ Returns the stable hash used to place a utf-8 encoded word within the store's hash table """
+    return zlib.crc32(encodedWord)
+
+
+def crc32Table():
+    """ Returns the 256 entry lookup table for the crc32 used by zlib """
+    table = numpy.arange(256, dtype = numpy.uint32)
+    for bit in range(8):
+        table = numpy.where(table & 1, numpy.uint32(0xEDB88320) ^ (table >> 1), table >> 1).astype(numpy.uint32)
+    return table
+
+
+crc32Entries = crc32Table()
+
+
+def hashWords(wordBytes, lengths):
+    """ Returns hashWord() for many words at once, given as a uint8 matrix with one zero padded word per row,
+        along with the length of each word. The loop runs over the byte positions rather than over the words. """
+    crc = numpy.full([len(lengths)], 0xFFFFFFFF, dtype = numpy.uint32)
+    for position in range(wordBytes.shape[1]):
+        updated = crc32Entries[(crc ^ wordBytes[:, position]) & 0xFF] ^ (crc >> 8)
+        crc = numpy.where(lengths > position, updated, crc)
+    return crc ^ numpy.uint32(0xFFFFFFFF)
+
+
+def paddedWords(words, offsets, rows):
+    """ Returns the words at the given rows of a store, given its concatenated utf-8 bytes and its offsets, as a
+        zero padded uint8 matrix with one word per row, along with the length of each word """
+    starts = offsets[rows]
+    lengths = offsets[rows + 1] - starts
+    width = int(lengths.max()) if len(rows) > 0 else 0
+    if len(words) == 0 or width == 0:
+        return numpy.zeros([len(rows), width], dtype = numpy.uint8), lengths
+
+    positions = numpy.arange(width)
+    inside = positions[None, :] < lengths[:, None]
+    indexes = numpy.minimum(starts[:, None] + positions[None, :], len(words) - 1)
+    return numpy.where(inside, words[indexes], 0).astype(numpy.uint8), lengths
+
+
+def storedWordsEqual(words, offsets, rows, wordBytes, lengths):
+    """ Compares the words stored at the given rows against a zero padded matrix of words, returning a boolean for each """
+    starts = offsets[rows]
+    equal = (offsets[rows + 1] - starts) == lengths
+    if len(words) == 0:
+        return equal
+
+    positions = numpy.arange(wordBytes.shape[1])
+    inside = positions[None, :] < lengths[:, None]
+    indexes = numpy.minimum(starts[:, None] + positions[None, :], len(words) - 1)
+    stored = words[indexes]
+    return equal & numpy.all((stored == wordBytes) | ~inside, axis = 1)
+
+
+def normalizeRows(vectors):
+    """ Returns a float32 copy of the given matrix with each row scaled to unit length. Zero rows stay zero. """
+    vectors = numpy.asarray(vectors, dtype = numpy.float32)
+    norms = numpy.linalg.norm(vectors, axis = 1, keepdims = True)
+    return vectors / numpy.maximum(norms, 1e-12)
+
+
+class EBWordVectorStore:
+    """ A read-only store of word vectors, backed by memory-mapped files.
+
+        A store is a folder containing:
+            header.json     The format version, the number of words and the number of dimensions
+            vectors.f32     A little-endian float32 matrix with one row per word
+            words.bin       The utf-8 bytes of every word, concatenated in row order
+            offsets.i64     The offset of each word within words.bin, plus a final end offset
+            table.i32       An open-addressing hash table mapping hashWord() to a row, -1 for empty slots
+            normalized.f32  Unit-length copies of the vectors, written the first time a nearest neighbour search runs
+
+        Opening a store does not read any of the data, and since the files are mapped read-only,
+        every process on a machine shares the same pages.
+    """
+    def __init__(self, folder):
+        self.folder = folder
+
+        with open(os.path.join(folder, "header.json"), "r") as file:
+            self.header = json.load(file)
+
+        if self.header["version"] != storeFormatVersion:
+            raise Exception("Unsupported word vector store version " + str(self.header["version"]) + " in " + folder)
+
+        self.count = self.header["count"]
+        self.dimensions = self.header["dimensions"]
+        self.tableSize = self.header["tableSize"]
+
+        self.vectors = self.mapFile("vectors.f32", numpy.dtype('<f4'), (self.count, self.dimensions))
+        self.words = self.mapFile("words.bin", numpy.uint8, (self.header["wordBytes"],))
+        self.offsets = self.mapFile("offsets.i64", numpy.dtype('<i8'), (self.count + 1,))
+        self.table = self.mapFile("table.i32", numpy.dtype('<i4'), (self.tableSize,))
+
+        # Computed on first use by normalizedVectors()
+        self.normalized = None
+
+    def mapFile(self, filename, dtype, shape):
+        # numpy.memmap refuses to map empty files
+        if numpy.prod(shape) == 0:
+            return numpy.zeros(shape, dtype = dtype)
+        return numpy.memmap(os.path.join(self.folder, filename), dtype = dtype, mode = 'r', shape = shape)
+
+    def word(self, row):
+        """ Returns the word stored at the given row """
+        return self.words[self.offsets[row]:self.offsets[row + 1]].tobytes().decode('utf-8')
+
+    def lookup(self, word):
+        """ Returns the row of the given word, or -1 if the word is not in the store """
+        encoded = word.encode('utf-8')
+        mask = self.tableSize - 1
+        slot = hashWord(encoded) & mask
+        while True:
+            row = int(self.table[slot])
+            if row == -1:
+                return -1
+            if self.words[self.offsets[row]:self.offsets[row + 1]].tobytes() == encoded:
+                return row
+            slot = (slot + 1) & mask
+
+    def lookupRows(self, words):
+        """ Returns an int32 array with the row of every word in the given list, -1 for missing words and None.
+
+            Each distinct word is only looked up once, no matter how many times it appears, and the distinct
+            words are all resolved together by resolveRows.
+        """
+        rows = numpy.full([len(words)], -1, dtype = numpy.int32)
+        present = numpy.flatnonzero(numpy.not_equal(numpy.array(words, dtype = object), None))
+        if len(present) == 0 or self.count == 0:
+            return rows
+
+        distinctWords, inverse = numpy.unique(numpy.array([words[index] for index in present], dtype = str), return_inverse = True)
+        rows[present] = self.resolveRows(distinctWords)[inverse]
+        return rows
+
+    def resolveRows(self, words):
+        """ Returns the row of every word in a numpy array of distinct strings, or -1 where a word is missing.
+
+            The words are hashed together as a matrix of bytes. The hash table is then probed in rounds, where
+            every word which has not yet been found, or reached an empty slot, moves on to the next slot.
+        """
+        encoded = numpy.char.encode(words, 'utf-8')
+        lengths = numpy.char.str_len(encoded).astype(numpy.int64)
+        wordBytes = numpy.frombuffer(encoded.tobytes(), dtype = numpy.uint8).reshape([len(encoded), encoded.dtype.itemsize])
+
+        mask = self.tableSize - 1
+        slots = hashWords(wordBytes, lengths).astype(numpy.int64) & mask
+        rows = numpy.full([len(words)], -1, dtype = numpy.int32)
+        pending = numpy.arange(len(words))
+        while len(pending) > 0:
+            candidates = self.table[slots[pending]].astype(numpy.int64)
+
+            # Words that reach an empty slot are not in the store
+            occupied = candidates != -1
+            pending = pending[occupied]
+            candidates = candidates[occupied]
+
+            matched = self.storedWordsEqual(candidates, wordBytes[pending], lengths[pending])
+            rows[pending[matched]] = candidates[matched]
+            pending = pending[~matched]
+            slots[pending] = (slots[pending] + 1) & mask
+        return rows
+
+    def storedWordsEqual(self, rows, wordBytes, lengths):
+        """ Compares the words stored at the given rows against a zero padded matrix of words, returning a boolean for each """
+        return storedWordsEqual(self.words, self.offsets, rows, wordBytes, lengths)
+
+    def gatherVectors(self, rows):
+        """ Returns a float32 matrix with the vector for every row in the given array, zeros where the row is -1 """
+        vectors = numpy.zeros([len(rows), self.dimensions], dtype = numpy.float32)
+        found = numpy.flatnonzero(rows != -1)
+        if len(found) > 0:
+            # Read each distinct row once, in file order, and then fan the results back out
+            distinctRows, inverse = numpy.unique(rows[found], return_inverse = True)
+            vectors[found] = self.vectors[distinctRows][inverse]
+        return vectors
+
+    def vector(self, word):
+        """ Returns the vector for the given word, or None if the word is not in the store """
+        row = self.lookup(word)
+        if row == -1:
+            return None
+        return self.vectors[row]
+
+    def normalizedVectors(self):
+        """ Returns the matrix of unit-length vectors used for nearest neighbour searches.
+
+            The matrix is only computed the first time it is needed, and is then saved into the store
+            folder as normalized.f32 so that later processes can simply map it.
+        """
+        if self.normalized is not None:
+            return self.normalized
+
+        filename = os.path.join(self.folder, "normalized.f32")
+        if not os.path.exists(filename):
+            temporaryFilename = filename + ".partial-" + str(os.getpid())
+            try:
+                with open(temporaryFilename, "wb") as file:
+                    for start in range(0, self.count, nearestBlockSize):
+                        file.write(normalizeRows(self.vectors[start:start + nearestBlockSize]).tobytes())
+                os.rename(temporaryFilename, filename)
+            except OSError as error:
+                # The store folder may be read-only, in which case we keep the matrix in memory
+                eprint("Could not save normalized word vectors to " + filename + ": " + str(error))
+                self.normalized = normalizeRows(self.vectors)
+                return self.normalized
+
+        self.normalized = self.mapFile("normalized.f32", numpy.dtype('<f4'), (self.count, self.dimensions))
+        return self.normalized
+
+    def nearestRows(self, vectors, count = 1):
+        """ Returns an int32 matrix with the rows of the count most similar words, by cosine similarity,
+            for each of the given vectors. The nearest row comes first. """
+        queries = normalizeRows(numpy.asarray(vectors, dtype = numpy.float32).reshape([-1, self.dimensions]))
+        normalized = self.normalizedVectors()
+        count = min(count, self.count)
+
+        bestScores = numpy.full([len(queries), count], -numpy.inf, dtype = numpy.float32)
+        bestRows = numpy.full([len(queries), count], -1, dtype = numpy.int32)
+
+        # Score the vocabulary one block at a time, merging each block's top results into the running best
+        for start in range(0, self.count, nearestBlockSize):
+            scores = numpy.dot(queries, normalized[start:start + nearestBlockSize].T)
+            blockCount = min(count, scores.shape[1])
+            top = numpy.argpartition(-scores, blockCount - 1, axis = 1)[:, :blockCount]
+
+            mergedScores = numpy.concatenate([bestScores, numpy.take_along_axis(scores, top, axis = 1)], axis = 1)
+            mergedRows = numpy.concatenate([bestRows, (top + start).astype(numpy.int32)], axis = 1)
+            order = numpy.argsort(-mergedScores, axis = 1)[:, :count]
+            bestScores = numpy.take_along_axis(mergedScores, order, axis = 1)
+            bestRows = numpy.take_along_axis(mergedRows, order, axis = 1)
+
+        return bestRows
+
+    def nearestWords(self, vectors):
+        """ Returns the most similar word for each of the given vectors """
+        return [self.word(row) for row in self.nearestRows(vectors, 1)[:, 0]]
+
+
+class EBWordVectorStoreWriter:
+    """ Writes a new EBWordVectorStore folder.
+
+        Rows are appended in order with append(). The hash table and header are only written by close(),
+        and the store is built in a temporary folder that is renamed into place, so a partially written
+        store is never visible to readers.
+    """
+    def __init__(self, folder, dimensions):
+        self.folder = folder
+        self.dimensions = dimensions
+        self.temporaryFolder = folder + ".partial-" + str(os.getpid())
+
+        if os.path.exists(self.temporaryFolder):
+            shutil.rmtree(self.temporaryFolder)
+        os.makedirs(self.temporaryFolder)
+
+        self.vectorsFile = open(os.path.join(self.temporaryFolder, "vectors.f32"), "wb")
+        self.wordsFile = open(os.path.join(self.temporaryFolder, "words.bin"), "wb")
+        self.offsets = [0]
+
+    def append(self, words, vectors):
+        """ Appends a block of words, along with a matrix containing one vector per word """
+        vectors = numpy.asarray(vectors, dtype = numpy.dtype('<f4'))
+        if vectors.shape != (len(words), self.dimensions):
+            raise Exception("Expected vectors of shape " + str((len(words), self.dimensions)) + " but got " + str(vectors.shape))
+
+        self.vectorsFile.write(vectors.tobytes())
+        for word in words:
+            encoded = word.encode('utf-8')
+            self.wordsFile.write(encoded)
+            self.offsets.append(self.offsets[-1] + len(encoded))
+
+    def close(self):
+        """ Builds the hash table, writes the header and moves the finished store into place """
+        self.vectorsFile.close()
+        self.wordsFile.close()
+
+        count = len(self.offsets) - 1
+        offsets = numpy.array(self.offsets, dtype = numpy.dtype('<i8'))
+        offsets.tofile(os.path.join(self.temporaryFolder, "offsets.i64"))
+
+        words = numpy.fromfile(os.path.join(self.temporaryFolder, "words.bin"), dtype = numpy.uint8)
+
+        # Keep the table at most half full so that probe sequences stay short
+        tableSize = 1
+        while tableSize < count * 2:
+            tableSize *= 2
+        mask = tableSize - 1
+
+        # Hash the words in blocks, so that one long word only pads the rows of its own block
+        slots = numpy.zeros([count], dtype = numpy.int64)
+        for start in range(0, count, nearestBlockSize):
+            rows = numpy.arange(start, min(start + nearestBlockSize, count))
+            slots[rows] = hashWords(*paddedWords(words, offsets, rows)).astype(numpy.int64) & mask
+
+        # The words are inserted in rounds, like the probing in resolveRows. Each round, every word still pending
+        # either claims the empty slot it reached, finds an earlier copy of itself, or moves on to the next slot.
+        table = numpy.full([tableSize], -1, dtype = numpy.dtype('<i4'))
+        pending = numpy.arange(count)
+        duplicates = 0
+        while len(pending) > 0:
+            candidates = table[slots[pending]].astype(numpy.int64)
+            empty = numpy.flatnonzero(candidates == -1)
+            occupied = numpy.flatnonzero(candidates != -1)
+
+            # When several words reach the same empty slot, the earliest row claims it. Copies of a word always probe
+            # the same slots together, so the first occurrence of a word wins.
+            claimedSlots, first = numpy.unique(slots[pending[empty]], return_index = True)
+            table[claimedSlots] = pending[empty[first]]
+
+            matched = numpy.zeros([len(occupied)], dtype = bool)
+            for start in range(0, len(occupied), nearestBlockSize):
+                block = occupied[start:start + nearestBlockSize]
+                wordBytes, lengths = paddedWords(words, offsets, pending[block])
+                matched[start:start + len(block)] = storedWordsEqual(words, offsets, candidates[block], wordBytes, lengths)
+            duplicates += int(numpy.count_nonzero(matched))
+
+            moving = pending[occupied[~matched]]
+            slots[moving] = (slots[moving] + 1) & mask
+
+            finished = numpy.zeros([len(pending)], dtype = bool)
+            finished[empty[first]] = True
+            finished[occupied[matched]] = True
+            pending = pending[~finished]
+
+        if duplicates > 0:
+            eprint("Ignored " + str(duplicates) + " duplicate words while building " + self.folder)
+
+        table.tofile(os.path.join(self.temporaryFolder, "table.i32"))
+
+        header = {
+            "version": storeFormatVersion,
+            "count": count,
+            "dimensions": self.dimensions,
+            "tableSize": tableSize,
+            "wordBytes": len(words)
+        }
+        with open(os.path.join(self.temporaryFolder, "header.json"), "w") as file:
+            json.dump(header, file)
+
+        # Another process may have finished the same store first, in which case we keep theirs
+        try:
+            os.rename(self.temporaryFolder, self.folder)
+        except OSError:
+            if not os.path.exists(os.path.join(self.folder, "header.json")):
+                raise
+            shutil.rmtree(self.temporaryFolder)
+
+
+def convertSqliteDatabase(databasePath, folder):
+    """ Converts a legacy sqlite word vector database, with float64 vectors stored in the
+        word_vectors table, into an EBWordVectorStore folder """
+    database = sqlite3.connect(databasePath)
+    cursor = database.cursor()
+    cursor.execute("SELECT word, tensor FROM word_vectors")
+
+    writer = None
+    while True:
+        rows = cursor.fetchmany(10000)
+        if len(rows) == 0:
+            break
+
+        words = [row[0] for row in rows]
+        vectors = numpy.array([numpy.frombuffer(row[1], dtype = numpy.float64) for row in rows], dtype = numpy.float32)
+
+        if writer is None:
+            writer = EBWordVectorStoreWriter(folder, vectors.shape[1])
+        writer.append(words, vectors)
+
+    database.close()
+
+    if writer is None:
+        raise Exception("The word vector database at " + databasePath + " is empty")
+    writer.close()
+
+
+def wordVectorStoreFolder(path):
+    """ Returns the store folder for the given path. The path may either be a store folder, or a legacy sqlite
+        database, whose store is the folder next to it named after the database with a .vectors extension. """
+    if os.path.isdir(path):
+        return path
+    return os.path.splitext(path)[0] + ".vectors"
+
+
+def openWordVectorStore(path):
+    """ Opens the word vector store for the given path. Databases are converted into stores when the
+        project is built, by scripts/convert_sqlite_word_vectors.py, rather than by the model processes. """
+    folder = wordVectorStoreFolder(path)
+    if not os.path.exists(os.path.join(folder, "header.json")):
+        raise Exception("The word vector store " + folder + " does not exist. Convert the word vectors with: python3 scripts/convert_sqlite_word_vectors.py " + path)
+
+    return EBWordVectorStore(folder)
+
+
+def acquireWordVectorStore(path):
+    """ Returns the word vector store for the given path, shared by everything in this process
+        which uses the same path. Every call must be balanced by a call to releaseWordVectorStore. """
+    key = os.path.realpath(path)
+    if key not in sharedStores:
+        sharedStores[key] = [openWordVectorStore(path), 0]
+    sharedStores[key][1] += 1
+    return sharedStores[key][0]
+
+
+def releaseWordVectorStore(store):
+    """ Releases a store returned by acquireWordVectorStore. The store is dropped from the process
+        once nothing is using it anymore. """
+    for key in list(sharedStores.keys()):
+        if sharedStores[key][0] is store:
+            sharedStores[key][1] -= 1
+            if sharedStores[key][1] == 0:
+                del sharedStores[key]
+            return
@@ -25,6 +25,7 @@ const
     EBModelProcessBase = require("../../../server/components/architecture/EBModelProcessBase"),
     fs = require('fs'),
     math = require("mathjs"),
+    os = require('os'),
     path = require('path'),
     Promise = require('bluebird'),
     temp = require('temp'),
@@ -55,6 +56,27 @@ class EBMatchingProcess extends EBModelProcessBase
         self.allLoadedEntries = [];
         self.testingSet = {};
         self.numProcesses = 1;
+
+        // The shared memory file which the training replicas use to average their gradients, when there is more than one
+        self.replicaFileName = null;
+    }
+
+    /**
+     * Kills the sub-processes, and removes the file shared between the training replicas
+     *
+     * @return {Promise} A promise that will resolve once the processes have been killed
+     */
+    killProcess()
+    {
+        const self = this;
+        return super.killProcess().then(() =>
+        {
+            if (self.replicaFileName)
+            {
+                fs.unlink(self.replicaFileName, () => {});
+                self.replicaFileName = null;
+            }
+        });
     }
 
     /**
@@ -68,7 +90,22 @@ class EBMatchingProcess extends EBModelProcessBase
         const primarySchema = registry.getInterpretation('object').transformSchemaForNeuralNetwork(this.architecture.primarySchema.filterIncluded());
         const secondarySchema = registry.getInterpretation('object').transformSchemaForNeuralNetwork(this.architecture.secondarySchema.filterIncluded());
 
-        return Promise.each(this.processes, (process) =>
+        // When there are several processes, each one is a replica that trains on a share of every batch. Each
+        // initialize gets a fresh file, so that no progress counters are left over from an earlier group.
+        if (this.replicaFileName)
+        {
+            fs.unlink(this.replicaFileName, () => {});
+            this.replicaFileName = null;
+        }
+        if (this.processes.length > 1)
+        {
+            this.replicaFileName = temp.path({
+                dir: fs.existsSync('/dev/shm') ? '/dev/shm' : os.tmpdir(),
+                prefix: 'electric-brain-replicas-'
+            });
+        }
+
+        return Promise.each(this.processes, (process, index) =>
         {
             // Now we handshake with the process and get version / name information
             return process.writeAndWaitForMatchingOutput({
@@ -76,7 +113,11 @@ class EBMatchingProcess extends EBModelProcessBase
                 primarySchema: primarySchema,
                 secondarySchema: secondarySchema,
                 primaryLayers: this.architecture.primaryFixedLayers,
-                secondaryLayers: this.architecture.secondaryFixedLayers
+                secondaryLayers: this.architecture.secondaryFixedLayers,
+                replicaCount: this.processes.length,
+                replicaIndex: index,
+                replicaFile: this.replicaFileName,
+                resources: this.resourceProfile || undefined
             }, {"type": "initialized"});
         });
     }
@@ -125,7 +166,7 @@ class EBMatchingProcess extends EBModelProcessBase
             ids: objects.map((object, index) => (index + 1).toString())
         };
 
-        return this.processes[0].writeAndWaitForMatchingOutput(message, {type: "evaluationCompleted"});
+        return this.processes[0].request(message);
     }
 
 
@@ -144,7 +185,7 @@ class EBMatchingProcess extends EBModelProcessBase
         };
 
         // TODO: Make this work with multiple sub-processes!
-        return this.processes[0].writeAndWaitForMatchingOutput(message, {type: "evaluationCompleted"}).then((result) =>
+        return this.processes[0].request(message).then((result) =>
         {
             return result;
         });
@@ -155,18 +196,66 @@ class EBMatchingProcess extends EBModelProcessBase
      * This method will execute a single training iteration with the given batch.
      *
      * @param {[string]} batchFilename The filename that contains the batch
+     * @param {object} [outputPolicy] Which vectors to send back, e.g. {mode: "none"}, {mode: "every", every: 10} or {mode: "sample", sampleSize: 8}. Defaults to all vectors.
      * @param {Promise} A Promise that will resolve when batch is complete
      */
-    executeTrainingIteration(batchFilename)
+    executeTrainingIteration(batchFilename, outputPolicy)
     {
         // Choose a bunch of random samples from the set that we have
         const message = {
             type: "iteration",
-            batchFilename: batchFilename
+            batchFilename: batchFilename,
+            outputPolicy: outputPolicy || {mode: "all"}
         };
 
-        // TODO: Make this work with multiple sub-processes!
-        return this.processes[0].writeAndWaitForMatchingOutput(message, {type: "iterationCompleted"});
+        // Every replica trains on its own share of the batch, so the vectors from all of them are merged together
+        return Promise.map(this.processes, (process) => process.request(message)).then((results) =>
+        {
+            return EBMatchingProcess.mergeReplicaResults(results);
+        });
+    }
+
+
+    /**
+     * This method trains for a number of steps over the given batch files in a single message. The process
+     * reads batches on a background thread ahead of the training steps, and only returns the losses.
+     *
+     * @param {[string]} batchFilenames The filenames that contain the batches
+     * @param {number} [steps] The number of steps to train for, cycling through the batches. Defaults to one step per batch.
+     * @param {number} [prefetch] The number of batches to keep loaded ahead of the training steps
+     * @param {boolean} [release] Whether to release the batches once the steps are complete
+     * @return {Promise} A promise that will resolve to an object with the losses for each step, and the mean loss
+     */
+    executeTrainingSteps(batchFilenames, steps, prefetch, release)
+    {
+        const message = {
+            type: "trainSteps",
+            batchFilenames: batchFilenames,
+            steps: steps || batchFilenames.length,
+            prefetch: prefetch || 2,
+            release: release || false
+        };
+
+        // Every replica applies the same averaged update, so they all report the same losses
+        return Promise.map(this.processes, (process) => process.request(message)).then((results) => results[0]);
+    }
+
+    /**
+     * Merges together the iteration results from each of the training replicas. The loss is the same in all of them,
+     * since it is averaged between the replicas, while the vectors from each replica are for its own share of the batch.
+     *
+     * @param {[object]} results The iteration result from each replica
+     * @return {object} A single iteration result
+     */
+    static mergeReplicaResults(results)
+    {
+        const merged = underscore.extend({}, results[0]);
+        if (results[0].primary)
+        {
+            merged.primary = underscore.extend.apply(underscore, [{}].concat(results.map((result) => result.primary)));
+            merged.secondary = underscore.extend.apply(underscore, [{}].concat(results.map((result) => result.secondary)));
+        }
+        return merged;
     }
 
 
@@ -197,7 +286,44 @@ class EBMatchingProcess extends EBModelProcessBase
             valences: valences,
             fileName: fileName
         };
-        return self.processes[0].writeAndWaitForMatchingOutput(message, {type: "batchPrepared", fileName: fileName});
+        return self.processes[0].request(message);
+    }
+
+
+    /**
+     * This method tells the process to group a pool of primary / secondary pairs into batches of similar
+     * sequence length, which wastes less computation on padding, and then write out a file for each batch.
+     *
+     * @param {[string]} primaryIds This the ids for each of the primary objects being saved
+     * @param {[object]} primaryObjects This contains of primary objects being saved
+     * @param {[string]} secondaryIds This the ids for each of the secondary objects being saved
+     * @param {[object]} secondaryObjects This contains of secondary objects being saved
+     * @param {[number]} valences An array of numbers, either 1 or -1, indicating whether each pair should be considered similar or different
+     * @param {number} batchSize The maximum number of pairs in each batch
+     * @param {[number]} [bucketBoundaries] Optional sorted sequence lengths at which buckets are split. When omitted, boundaries are chosen from quantiles of the lengths.
+     * @param {number} [bucketCount] The number of buckets to use when choosing boundaries automatically
+     *
+     * @return {Promise} A promise that will resolve to a list of batches, each with primaryIds, secondaryIds, fileName and paddingEfficiency
+     */
+    prepareBucketedBatches(primaryIds, primaryObjects, secondaryIds, secondaryObjects, valences, batchSize, bucketBoundaries, bucketCount)
+    {
+        const self = this;
+
+        const message = {
+            type: "prepareBucketedBatches",
+            primaryIds: primaryIds,
+            primarySamples: primaryObjects,
+            secondaryIds: secondaryIds,
+            secondarySamples: secondaryObjects,
+            valences: valences,
+            batchSize: batchSize,
+            bucketBoundaries: bucketBoundaries || null,
+            bucketCount: bucketCount || 8
+        };
+        return self.processes[0].request(message).then((result) =>
+        {
+            return result.batches;
+        });
     }
 }
 
@@ -36,7 +36,6 @@ const
     mongodb = require('mongodb'),
     path = require('path'),
     Promise = require('bluebird'),
-    temp = require('temp'),
     underscore = require('underscore');
 
 /**
@@ -120,6 +119,7 @@ class EBTrainMatchingModelTask extends EBTrainModelTaskBase
                 self.secondaryTrainingSet = new EBTrainingSet(self.application, self.model.architecture.secondaryDataSource, self.model.parameters.testingSetPortion);
 
                 self.trainingProcess = new EBMatchingProcess(self.model.architecture, self.architecturePlugin, self.application.config.get('overrideModelFolder'));
+                self.trainingProcess.numProcesses = Math.max(1, self.application.config.get('matchingTrainingReplicas'));
                 
                 this.setupCancellationCallback(self.model, () =>
                 {
@@ -318,7 +318,7 @@ class EBTrainMatchingModelTask extends EBTrainModelTaskBase
 
         return workerPromise.then((worker) =>
         {
-            const batchFileName = temp.path({suffix: '.npz'});
+            const batchFileName = this.trainingProcess.createBatchFileName();
 
             return worker.writeAndWaitForMatchingOutput({
                 "type": "prepareBatch",
@@ -451,6 +451,15 @@ class EBTrainMatchingModelTask extends EBTrainModelTaskBase
                                 // Update the time per iteration
                                 trainingResult.currentTimePerIteration = trainingResult.performance.total();
 
+                                // Without any vectors from the network, there is nothing to compute the accuracy from
+                                if (!result.primary)
+                                {
+                                    return {
+                                        trainingAccuracy: null,
+                                        loss: result.loss
+                                    };
+                                }
+
                                 // Store all of the secondary vectors
                                 for (const key of Object.keys(result.secondary))
                                 {
@@ -486,7 +495,10 @@ class EBTrainMatchingModelTask extends EBTrainModelTaskBase
                                 });
                             }).then((trainingIterationResult) =>
                             {
-                                self.rollingAverageTrainingaccuracy.accumulate(trainingIterationResult.trainingAccuracy * 100);
+                                if (trainingIterationResult.trainingAccuracy !== null)
+                                {
+                                    self.rollingAverageTrainingaccuracy.accumulate(trainingIterationResult.trainingAccuracy * 100);
+                                }
                                 return self.testIteration().then((testingAccuracy) =>
                                 {
                                     return {
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 import json
+import os
 import fileinput
 import sys
 import tensorflow as tf
@@ -11,15 +12,46 @@ import shape
 import losses
 from editor import generateEditorNetwork
 from schema import EBSchema
-from adamax import AdamaxOptimizer
+import bucketing
+from training_script import EBTrainingScript
+from inference import EBInferenceGraph, inferenceFeed, freezeGraph, writeInferenceGraph
+from output_policy import EBOutputPolicy, selectSamples
+from replicas import EBReplicaGroup
+
+class TrainingScript(EBTrainingScript):
+    # The lane that each type of message runs on, when it is sent with a requestId. See EBMessageDispatcher
+    messageLanes = {
+        "prepareBatch": "prepare",
+        "prepareBucketedBatches": "prepare",
+        "iteration": "train",
+        "trainSteps": "train",
+        "evaluateBatch": "evaluate"
+    }
 
-class TrainingScript:
     def __init__(self):
-        self.session = None
+        EBTrainingScript.__init__(self)
+
+        # Data-parallel training. Replicas are only used when there is more than one.
+        self.replicaCount = 1
+        self.replicaIndex = 0
+        self.replicaFile = None
+        self.replicas = None
+
+    def initialize(self, data):
+        # Kept as they were sent, to be written into exported inference graphs
+        self.schemaData = {"primary": data["primarySchema"], "secondary": data["secondarySchema"]}
+
+        self.replicaCount = data.get("replicaCount", 1)
+        self.replicaIndex = data.get("replicaIndex", 0)
+        self.replicaFile = data.get("replicaFile")
+
+        self.initializeGraph(EBSchema(data["primarySchema"]), EBSchema(data["secondarySchema"]), data["primaryLayers"], data["secondaryLayers"])
 
     def initializeGraph(self, primarySchema, secondarySchema, primaryFixedLayers, secondaryFixedLayers):
         self.primarySchema = primarySchema
         self.secondarySchema = secondarySchema
+        self.primaryFixedLayers = primaryFixedLayers
+        self.secondaryFixedLayers = secondaryFixedLayers
 
         # Create the primary and secondary components
         self.primaryComponent = EBNeuralNetworkObjectComponent(primarySchema, "primary")
@@ -56,119 +88,236 @@ class TrainingScript:
 
         self.totalLoss = tf.reduce_mean(loss)
 
-    def reset(self, optimizationAlgorithm, optimizationParameters):
-        if self.session is not None:
-            self.session.close()
-
-        self.session = tf.Session()
+    def rebuildGraph(self):
+        self.initializeGraph(self.primarySchema, self.secondarySchema, self.primaryFixedLayers, self.secondaryFixedLayers)
 
-        self.optimizationAlgorithm = optimizationAlgorithm
-        self.optimizationParameters = optimizationParameters
-
-        if optimizationAlgorithm == 'AdamaxOptimizer':
-            self.trainingStep = AdamaxOptimizer(**self.optimizationParameters).minimize(self.totalLoss)
+    def createTrainingStep(self, optimizer):
+        if self.replicaCount > 1:
+            self.createReplicaOps(optimizer)
         else:
-            self.trainingStep = getattr(tf.train, optimizationAlgorithm)(**self.optimizationParameters).minimize(self.totalLoss)
-
-        self.allSummaryOutputs = tf.summary.merge_all()
-        train_writer = tf.summary.FileWriter('./logs', self.session.graph)
-
-        self.session.run(tf.global_variables_initializer())
-
-    def prepareBatch(self, primarySamples, secondarySamples, primaryIds, secondaryIds, valences, filename):
+            EBTrainingScript.createTrainingStep(self, optimizer)
+
+    def initializeVariables(self, synchronize):
+        EBTrainingScript.initializeVariables(self, synchronize)
+        if self.replicaCount > 1 and synchronize:
+            self.broadcastVariables()
+
+    def createReplicaOps(self, optimizer):
+        """ Builds the ops for data-parallel training. Rather than minimizing the loss directly, each replica computes
+            the gradients for its own shard of the batch, and then applies the averaged gradients, which are fed back in. """
+        self.replicaVariables = tf.trainable_variables()
+        self.replicaSizes = [int(numpy.prod(variable.get_shape().as_list())) for variable in self.replicaVariables]
+
+        self.replicaGradients = []
+        for gradient, variable in zip(tf.gradients(self.totalLoss, self.replicaVariables), self.replicaVariables):
+            if gradient is None:
+                gradient = tf.zeros_like(variable)
+            # Sparse gradients, such as those from embedding lookups, are made dense so that they can be exchanged
+            self.replicaGradients.append(tf.convert_to_tensor(gradient))
+
+        # The same placeholders are used to feed in averaged gradients, and to feed in the weights from the first replica
+        self.replicaPlaceholders = [tf.placeholder(variable.dtype.base_dtype, shape = variable.get_shape()) for variable in self.replicaVariables]
+        self.trainingStep = optimizer.apply_gradients(list(zip(self.replicaPlaceholders, self.replicaVariables)))
+        self.replicaAssignments = [variable.assign(placeholder) for variable, placeholder in zip(self.replicaVariables, self.replicaPlaceholders)]
+
+        # Each exchanged vector holds the gradients, followed by the loss and the number of samples in the shard
+        # Each initialize is sent a fresh file, whose exchanges start again from the first round
+        if self.replicas is None or self.replicas.fileName != self.replicaFile:
+            self.replicas = EBReplicaGroup(self.replicaFile, self.replicaCount, self.replicaIndex, sum(self.replicaSizes) + 2)
+
+    def replicaFeed(self, vector):
+        """ Splits a flat vector back into a feed dictionary for the replica placeholders """
+        feedDict = {}
+        offset = 0
+        for placeholder, variable, size in zip(self.replicaPlaceholders, self.replicaVariables, self.replicaSizes):
+            feedDict[placeholder] = vector[offset:offset + size].reshape(variable.get_shape().as_list())
+            offset += size
+        return feedDict
+
+    def broadcastVariables(self):
+        """ Copies the initial weights of the first replica into all the others, so that every replica starts out identical """
+        values = self.session.run(self.replicaVariables)
+        vector = numpy.concatenate([numpy.ravel(value) for value in values]).astype(numpy.float32)
+        self.session.run(self.replicaAssignments, feed_dict = self.replicaFeed(self.replicas.broadcast(vector)))
+
+    def get_batch_axis(self, key):
+        # A batch holds keys from both components, and each component returns zero for keys that aren't its own
+        return max(self.primaryComponent.get_batch_axis(key), self.secondaryComponent.get_batch_axis(key))
+
+    def selectShard(self, feedDict):
+        """ Returns the part of the batch that this replica trains on. Pairs are dealt out to the replicas in turn. """
+        if self.replicaCount <= 1:
+            return feedDict
+        indexes = numpy.arange(self.replicaIndex, len(feedDict['valences:0']), self.replicaCount)
+        return selectSamples(self, feedDict, indexes)
+
+    def prepareBatch(self, primarySamples, secondarySamples, primaryIds, secondaryIds, valences, filename = None, heldBytes = 0):
+        """ Converts the pairs and writes them into the batch pool. Returns the handle for the batch """
         converted = {}
         converted.update(self.primaryComponent.convert_input_in(primarySamples))
         converted.update(self.secondaryComponent.convert_input_in(secondarySamples))
-        converted.update({"valences:0": numpy.array(valences)})
-        converted.update({"primaryIds": primaryIds})
-        converted.update({"secondaryIds": secondaryIds})
-
-        numpy.savez(filename, **converted)
-
-    def iteration(self, batchFileName):
-        feedDict = dict(numpy.load(batchFileName))
+        converted.update({"valences:0": numpy.array(valences, dtype = numpy.float32)})
+        converted.update({"primaryIds": numpy.array(primaryIds, dtype = str)})
+        converted.update({"secondaryIds": numpy.array(secondaryIds, dtype = str)})
+
+        return self.batchPool.write(converted, filename, heldBytes)
+
+    def prepareBucketedBatches(self, primarySamples, secondarySamples, primaryIds, secondaryIds, valences, batchSize, bucketBoundaries, bucketCount):
+        """ Groups the pairs into batches of similar sequence length, and writes a file for each batch """
+        lengths = []
+        for index in range(len(primarySamples)):
+            lengths.append(max(self.primaryComponent.get_padded_length(primarySamples[index]), self.secondaryComponent.get_padded_length(secondarySamples[index])))
+
+        # None of the batches can be released until they have all been returned, so they aren't waited on
+        heldBytes = 0
+        batches = []
+        for indexes in bucketing.bucketSamples(lengths, batchSize, bucketBoundaries, bucketCount):
+            fileName = self.prepareBatch([primarySamples[index] for index in indexes],
+                                         [secondarySamples[index] for index in indexes],
+                                         [primaryIds[index] for index in indexes],
+                                         [secondaryIds[index] for index in indexes],
+                                         [valences[index] for index in indexes],
+                                         None,
+                                         heldBytes)
+            heldBytes += os.path.getsize(fileName)
+
+            batches.append({
+                "primaryIds": [primaryIds[index] for index in indexes],
+                "secondaryIds": [secondaryIds[index] for index in indexes],
+                "fileName": fileName,
+                "paddingEfficiency": bucketing.paddingEfficiency([lengths[index] for index in indexes])
+            })
+        return batches
+
+    def iteration(self, batchFileName, outputPolicy):
+        """ Runs a training step. Depending on the output policy, the vectors may be returned for the whole batch,
+            for a sample of its pairs, or not evaluated at all, in which case None is returned for them. """
+        feedDict = self.selectShard(self.readBatch(batchFileName))
 
         primaryIds = feedDict['primaryIds']
         secondaryIds = feedDict['secondaryIds']
         del feedDict['primaryIds']
         del feedDict['secondaryIds']
 
-        evaluations = [self.totalLoss, self.primaryOutput, self.secondaryOutput, self.trainingStep]
+        step = self.iterationCount
+        self.iterationCount += 1
+        if not outputPolicy.includesOutputs(step):
+            totalLoss, values = self.runTrainingStep(feedDict)
+            return totalLoss, None, None, None, None
 
-        if self.allSummaryOutputs is not None:
-            evaluations.append(self.allSummaryOutputs)
+        # Vectors are left as numpy arrays, so that the binary protocol can send them without encoding
+        totalLoss, values = self.runTrainingStep(feedDict, [self.primaryOutput, self.secondaryOutput])
+        primaryOutputs, secondaryOutputs = values
 
-        evalTuple = self.session.run(evaluations, feed_dict = feedDict)
+        samples = outputPolicy.chooseSamples(len(primaryIds))
+        if samples is not None:
+            primaryOutputs = primaryOutputs[samples]
+            secondaryOutputs = secondaryOutputs[samples]
+            primaryIds = primaryIds[samples]
+            secondaryIds = secondaryIds[samples]
 
-        totalLoss = evalTuple[0]
+        return totalLoss, primaryOutputs, primaryIds, secondaryOutputs, secondaryIds
 
-        primaryOutputs = numpy.ndarray.tolist(evalTuple[1])
-        secondaryOutputs = numpy.ndarray.tolist(evalTuple[2])
+    def readTrainingBatch(self, batchFileName):
+        """ Returns the feed dictionary for this replica's part of a batch, without the ids """
+        feedDict = self.selectShard(self.readCachedBatch(batchFileName))
+        del feedDict['primaryIds']
+        del feedDict['secondaryIds']
+        return feedDict
+
+    def runTrainingStep(self, feedDict, evaluations = []):
+        if self.replicas is not None:
+            return self.runReplicaTrainingStep(feedDict, evaluations)
+        return EBTrainingScript.runTrainingStep(self, feedDict, evaluations)
+
+    def runReplicaTrainingStep(self, feedDict, evaluations):
+        """ Computes the gradients for this replica's shard, averages them with every other replica, weighted by
+            the number of samples in each shard, and applies the average. Every replica applies the same update. """
+        # Only the first replica writes summaries, for its own shard, since the replicas share the logs folder
+        writeSummary = self.allSummaryOutputs is not None and self.replicaIndex == 0
+
+        sampleCount = len(feedDict['valences:0'])
+        if sampleCount > 0:
+            runList = [self.totalLoss] + self.replicaGradients + evaluations
+            if writeSummary:
+                runList.append(self.allSummaryOutputs)
+            results = self.session.run(runList, feed_dict = feedDict)
+            if writeSummary:
+                self.writeSummary(results[-1])
+            gradients = results[1:1 + len(self.replicaGradients)]
+            values = results[1 + len(self.replicaGradients):1 + len(self.replicaGradients) + len(evaluations)]
+            vector = numpy.concatenate([numpy.ravel(gradient) for gradient in gradients] + [[results[0], 1.0]]) * sampleCount
+        else:
+            # Batches smaller than the number of replicas leave some shards empty. They still take part in the exchange.
+            values = [numpy.zeros([0], dtype = numpy.float32) for evaluation in evaluations]
+            vector = numpy.zeros([self.replicas.size], dtype = numpy.float32)
 
-        return float(totalLoss), primaryOutputs, primaryIds, secondaryOutputs, secondaryIds,
+        total = self.replicas.allreduceSum(vector.astype(numpy.float32))
+        totalSamples = max(float(total[-1]), 1.0)
+        self.session.run(self.trainingStep, feed_dict = self.replicaFeed(total[:-2] / totalSamples))
+        return float(total[-2] / totalSamples), values
 
     def evaluateBatchFile(self, batchFileName):
-        input = dict(numpy.load(batchFileName))
+        input = self.readBatch(batchFileName)
 
         primaryIds = input['primaryIds']
         secondaryIds = input['secondaryIds']
         del input['primaryIds']
         del input['secondaryIds']
 
-        evaluations = [self.primaryOutput, self.secondaryOutput]
-
-        evalTuple = self.session.run(evaluations, feed_dict = input)
-
-        primaryOutputs = numpy.ndarray.tolist(evalTuple[0])
-        secondaryOutputs = numpy.ndarray.tolist(evalTuple[1])
-
-        return (primaryOutputs, primaryIds, secondaryOutputs, secondaryIds)
-
-    def main(self):
-        """  This is the main entry point of the training script."""
-        for line in sys.stdin:
-            data = json.loads(line)
-            response={}
-            if (data["type"] == 'handshake'):
-                response["type"] = "handshake"
-                response["name"] = "TrainingScript.py"
-                response["version"] = "0.0.1"
-
-            elif (data["type"] == 'initialize'):
-                primarySchema = EBSchema(data["primarySchema"])
-                secondarySchema = EBSchema(data["secondarySchema"])
-                primaryLayers = data["primaryLayers"]
-                secondaryLayers = data["secondaryLayers"]
-
-                results = self.initializeGraph(primarySchema, secondarySchema, primaryLayers, secondaryLayers)
-
-                response["type"] = "initialized"
-            elif (data["type"] == 'iteration'):
-                totalLoss, primaryOutputs, primaryIds, secondaryOutputs, secondaryIds = self.iteration(data["batchFilename"])
-
-                response["primary"] = {}
-                for index in range(len(primaryOutputs)):
-                    response["primary"][primaryIds[index]] = primaryOutputs[index]
-
-                response["secondary"] = {}
-                for index in range(len(secondaryOutputs)):
-                    response["secondary"][secondaryIds[index]] = secondaryOutputs[index]
+        if self.inferenceGraph is not None:
+            outputs = self.inferenceGraph.run(input)
+            primaryOutputs = outputs["primary"]
+            secondaryOutputs = outputs["secondary"]
+        else:
+            feedDict = inferenceFeed()
+            feedDict.update(input)
 
-                response["type"] = "iterationCompleted"
-                response["loss"] = totalLoss
-            elif (data["type"] == 'reset'):
-                self.reset(data["optimizationAlgorithm"], data["optimizationParameters"])
-                response["type"] = "resetCompleted"
-            elif (data["type"] == 'prepareBatch'):
-                self.prepareBatch(data["primarySamples"], data["secondarySamples"], data["primaryIds"], data["secondaryIds"], data["valences"], data["fileName"])
+            evaluations = [self.primaryOutput, self.secondaryOutput]
 
-                response["fileName"] = data["fileName"]
-                response["type"] = "batchPrepared"
+            evalTuple = self.session.run(evaluations, feed_dict = feedDict)
 
+            primaryOutputs = evalTuple[0]
+            secondaryOutputs = evalTuple[1]
 
-            elif (data["type"] == 'evaluateBatch'):
-                primaryOutputs, primaryIds, secondaryOutputs, secondaryIds = self.evaluateBatchFile(data["batchFilename"])
+        return (primaryOutputs, primaryIds, secondaryOutputs, secondaryIds)
 
+    def exportInference(self, fileName):
+        """ Writes a frozen copy of the graph for serving, holding only what is needed to evaluate the vectors """
+        self.ensureSession()
+
+        placeholders = list(self.primaryPlaceholders.values()) + list(self.secondaryPlaceholders.values())
+        graphDef, usedInputs = freezeGraph(self.session, [placeholder.name for placeholder in placeholders], [self.primaryOutput, self.secondaryOutput])
+        signature = {
+            "inputs": usedInputs,
+            "outputs": {"primary": self.primaryOutput.name, "secondary": self.secondaryOutput.name},
+            "primarySchema": self.schemaData["primary"],
+            "secondarySchema": self.schemaData["secondary"]
+        }
+        writeInferenceGraph(fileName, graphDef, signature)
+
+    def loadInference(self, fileName):
+        """ Loads a frozen graph for serving. The components are only created for converting samples, so a
+            serving process does not need to be initialized with the schemas or build the training graph. """
+        if self.inferenceGraph is not None:
+            self.inferenceGraph.close()
+        self.inferenceGraph = EBInferenceGraph(fileName, self.sessionConfig)
+
+        signature = self.inferenceGraph.signature
+        self.schemaData = {"primary": signature["primarySchema"], "secondary": signature["secondarySchema"]}
+        self.primaryComponent = EBNeuralNetworkObjectComponent(EBSchema(signature["primarySchema"]), "primary")
+        self.secondaryComponent = EBNeuralNetworkObjectComponent(EBSchema(signature["secondarySchema"]), "secondary")
+
+    def handleScriptMessage(self, data, response):
+        """ Handles the messages specific to matching models """
+        if (data["type"] == 'iteration'):
+            outputPolicy = EBOutputPolicy(data.get("outputPolicy"))
+            totalLoss, primaryOutputs, primaryIds, secondaryOutputs, secondaryIds = self.iteration(data["batchFilename"], outputPolicy)
+            if data.get("release", False):
+                self.releaseBatch(data["batchFilename"])
+
+            # The vectors are left out entirely when the output policy skips this iteration
+            if primaryOutputs is not None:
                 response["primary"] = {}
                 for index in range(len(primaryOutputs)):
                     response["primary"][primaryIds[index]] = primaryOutputs[index]
@@ -177,15 +326,46 @@ class TrainingScript:
                 for index in range(len(secondaryOutputs)):
                     response["secondary"][secondaryIds[index]] = secondaryOutputs[index]
 
-                response["type"] = "evaluationCompleted"
-            elif (data["type"] == 'save'):
-                tf.train.export_meta_graph(filename="model.tfg")
-                response["type"] = "saved"
-            elif (data["type"] == 'load'):
-                pass
-
-            sys.stdout.write(json.dumps(response) + "\n")
-            sys.stdout.flush()
+            response["type"] = "iterationCompleted"
+            response["loss"] = totalLoss
+        elif (data["type"] == 'trainSteps'):
+            losses = self.trainSteps(data["batchFilenames"], data.get("steps"), data.get("prefetch", 2))
+            if data.get("release", False):
+                for batchFileName in data["batchFilenames"]:
+                    self.releaseBatch(batchFileName)
+
+            response["type"] = "stepsCompleted"
+            response["losses"] = losses
+            response["loss"] = float(numpy.mean(losses)) if len(losses) > 0 else None
+        elif (data["type"] == 'prepareBatch'):
+            response["fileName"] = self.prepareBatch(data["primarySamples"], data["secondarySamples"], data["primaryIds"], data["secondaryIds"], data["valences"], data.get("fileName"))
+            response["type"] = "batchPrepared"
+        elif (data["type"] == 'prepareBucketedBatches'):
+            batches = self.prepareBucketedBatches(data["primarySamples"], data["secondarySamples"], data["primaryIds"], data["secondaryIds"], data["valences"], data["batchSize"], data.get("bucketBoundaries"), data.get("bucketCount", 8))
+            response["batches"] = batches
+            response["type"] = "bucketedBatchesPrepared"
+
+        elif (data["type"] == 'evaluateBatch'):
+            primaryOutputs, primaryIds, secondaryOutputs, secondaryIds = self.evaluateBatchFile(data["batchFilename"])
+            if data.get("release", False):
+                self.releaseBatch(data["batchFilename"])
+
+            response["primary"] = {}
+            for index in range(len(primaryOutputs)):
+                response["primary"][primaryIds[index]] = primaryOutputs[index]
+
+            response["secondary"] = {}
+            for index in range(len(secondaryOutputs)):
+                response["secondary"][secondaryIds[index]] = secondaryOutputs[index]
+
+            response["type"] = "evaluationCompleted"
+        elif (data["type"] == 'exportInference'):
+            self.exportInference(data["fileName"])
+            response["type"] = "inferenceExported"
+            response["fileName"] = data["fileName"]
+        elif (data["type"] == 'loadInference'):
+            self.loadInference(data["fileName"])
+            response["type"] = "inferenceLoaded"
 
 if __name__ == "__main__":
     script = TrainingScript()
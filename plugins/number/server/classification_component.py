@@ -29,12 +29,12 @@ class EBNeuralNetworkClassificationComponent(EBNeuralNetworkComponentBase):
 
     def convert_input_in(self, input):
         converted = {}
-        converted[self.machineVariableName() + ":0"] = numpy.array([(-1 if value is None else value) for value in input])
+        converted[self.machineVariableName() + ":0"] = numpy.array([(-1 if value is None else value) for value in input], dtype = numpy.int32)
         return converted
 
     def convert_output_in(self, output):
         converted = {}
-        converted[self.machineVariableName() + ":0"] = numpy.array([(-1 if value is None else value) for value in output])
+        converted[self.machineVariableName() + ":0"] = numpy.array([(-1 if value is None else value) for value in output], dtype = numpy.int32)
         return converted
 
     def convert_output_out(self, outputs, inputs):
@@ -82,16 +82,12 @@ class EBNeuralNetworkClassificationComponent(EBNeuralNetworkComponentBase):
         output = outputs[self.machineVariableName()]
         placeholder = outputPlaceholders[self.machineVariableName()]
 
-        # If there is no value for the output, loss is 0
-        def checkSingleValue(value):
-            embedding = tf.one_hot(value[0], len(self.schema['enum']))
-            mask = tf.sign(tf.reduce_max(tf.abs(embedding), 0))
-            losses = tf.nn.softmax_cross_entropy_with_logits(labels=embedding, logits=value[1], dim=0) * mask
-            return [tf.to_int32(losses)] + [losses]
+        # Missing values are stored as -1. They are masked out of the loss, which is then averaged
+        # over only the values which are present
+        mask = tf.to_float(tf.greater_equal(placeholder, 0))
+        losses = tf.nn.sparse_softmax_cross_entropy_with_logits(labels = tf.maximum(placeholder, 0), logits = output) * mask
 
-        losses = tf.map_fn(checkSingleValue, [placeholder, output])[1]
-
-        loss = tf.reduce_mean(losses)
+        loss = tf.reduce_sum(losses) / tf.maximum(tf.reduce_sum(mask), 1.0)
         return [loss]
 
 
@@ -29,12 +29,12 @@ class EBNeuralNetworkNumberComponent(EBNeuralNetworkComponentBase):
 
     def convert_input_in(self, input):
         converted = {}
-        converted[self.machineVariableName() + ":0"] = numpy.array([(0 if value is None else value) for value in input])
+        converted[self.machineVariableName() + ":0"] = numpy.array([(0 if value is None else value) for value in input], dtype = numpy.float32)
         return converted
 
     def convert_output_in(self, output):
         converted = {}
-        converted[self.machineVariableName() + ":0"] = numpy.array([(0 if value is None else value) for value in output])
+        converted[self.machineVariableName() + ":0"] = numpy.array([(0 if value is None else value) for value in output], dtype = numpy.float32)
         return converted
 
     def convert_output_out(self, outputs, inputs):
@@ -55,7 +55,8 @@ class EBNeuralNetworkNumberComponent(EBNeuralNetworkComponentBase):
         return placeholders
 
     def get_input_stack(self, placeholders):
-        input = placeholders[self.machineVariableName()]
+        # Give the number a data dimension of size 1, matching its shape
+        input = tf.expand_dims(placeholders[self.machineVariableName()], -1)
         return ([input], [EBTensorShape(["*", 1], [EBTensorShape.Batch, EBTensorShape.Data], self.machineVariableName() )])
 
     def get_output_stack(self, inputs, shapes):
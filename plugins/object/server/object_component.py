@@ -32,44 +32,79 @@ class EBNeuralNetworkObjectComponent(plugins.EBNeuralNetworkComponentBase):
             subSchema = self.schema["properties"][variableName]
             self.subComponents[variableName] = plugins.createNeuralNetworkComponent(subSchema, prefix)
 
+        self.compileConversionPlan()
+
+    def compileConversionPlan(self):
+        """ Flattens the tree of nested objects into a list of the non-object components at its leaves,
+            along with a nested plan describing which properties lead to each of those leaves """
+        self.planLeaves = []
+
+        def compileNode(component):
+            node = []
+            for variableName in component.schema.propertyNames():
+                subComponent = component.subComponents[variableName]
+                if isinstance(subComponent, EBNeuralNetworkObjectComponent):
+                    node.append((variableName, compileNode(subComponent)))
+                else:
+                    node.append((variableName, len(self.planLeaves)))
+                    self.planLeaves.append(subComponent)
+            return node
+
+        self.planRoot = compileNode(self)
+
+    def splitColumns(self, values):
+        """ Walks each of the given objects once, and returns one column of values for each leaf of the
+            conversion plan. Missing values and anything underneath a None object are left as None. """
+        columns = [[None] * len(values) for leaf in self.planLeaves]
+
+        def walk(value, node, sampleIndex):
+            for variableName, child in node:
+                subValue = value.get(variableName)
+                if subValue is None:
+                    continue
+                if isinstance(child, int):
+                    columns[child][sampleIndex] = subValue
+                else:
+                    walk(subValue, child, sampleIndex)
 
-    def convert_input_in(self, inputs):
-        converted = {}
+        for sampleIndex in range(len(values)):
+            if values[sampleIndex] is not None:
+                walk(values[sampleIndex], self.planRoot, sampleIndex)
 
-        # Convert each of the sub variables
-        for variableName in self.schema.propertyNames():
-            subComponent = self.subComponents[variableName]
+        return columns
 
-            # Build up a list of the variables to be converted
-            subValues = []
-            for valueIndex in range(len(inputs)):
-                if inputs[valueIndex] is None:
-                    subValues.append(None)
-                else:
-                    subValues.append(inputs[valueIndex][variableName])
 
-            subConverted = subComponent.convert_input_in(subValues)
-            converted.update(subConverted)
+    def get_batch_axis(self, key):
+        # Check the longest names first, so that a property is never mistaken for another
+        # property whose name it starts with
+        subComponents = sorted(self.subComponents.values(), key = lambda component: len(component.machineVariableName()), reverse = True)
+        for subComponent in subComponents:
+            if key.startswith(subComponent.machineVariableName()):
+                return subComponent.get_batch_axis(key)
+        return 0
 
-        return converted
+    def get_padded_length(self, value):
+        if value is None:
+            return 0
+        return max([0] + [self.subComponents[variableName].get_padded_length(value.get(variableName)) for variableName in self.subComponents])
 
-    def convert_output_in(self, outputs):
+    def convert_input_in(self, inputs):
         converted = {}
 
-        # Convert each of the sub variables
-        for variableName in self.schema.propertyNames():
-            subComponent = self.subComponents[variableName]
+        # Convert each column of leaf values in a single call to its component
+        columns = self.splitColumns(inputs)
+        for leafIndex in range(len(self.planLeaves)):
+            converted.update(self.planLeaves[leafIndex].convert_input_in(columns[leafIndex]))
 
-            # Build up a list of the variables to be converted
-            subValues = []
-            for valueIndex in range(len(outputs)):
-                if outputs[valueIndex] is None:
-                    subValues.append(None)
-                else:
-                    subValues.append(outputs[valueIndex][variableName])
+        return converted
+
+    def convert_output_in(self, outputs):
+        converted = {}
 
-            subConverted = subComponent.convert_output_in(subValues)
-            converted.update(subConverted)
+        # Convert each column of leaf values in a single call to its component
+        columns = self.splitColumns(outputs)
+        for leafIndex in range(len(self.planLeaves)):
+            converted.update(self.planLeaves[leafIndex].convert_output_in(columns[leafIndex]))
 
         return converted
 
@@ -29,105 +29,97 @@ class EBNeuralNetworkSequenceComponent(EBNeuralNetworkComponentBase):
         self.schema = schema
         self.subComponent = plugins.createNeuralNetworkComponent(self.schema['items'], prefix)
 
-    def convert_input_in(self, input):
-        converted = {}
-
-        # Add in the sequence lengths
-        converted[self.machineVariableName() + "__length__:0"] = []
-
-        longest = 0
-        # Find the longest sequence
-        for sampleIndex in range(len(input)):
-            sequence = input[sampleIndex]
-            if self.schema['configuration']['component']['enforceSequenceLengthLimit']:
-                length = min(self.schema['configuration']['component']['maxSequenceLength'], len(sequence))
-            else:
-                length = len(sequence)
-            converted[self.machineVariableName() + "__length__:0"].append(length)
-            longest = max(longest, length)
-
-        # combine each of the inputs
-        for itemIndex in range(longest):
-            item = []
-            for sampleIndex in range(len(input)):
-                sequence = input[sampleIndex]
-                if len(sequence) > itemIndex:
-                    item.append(sequence[itemIndex])
-                else:
-                    item.append(None)
-
-            convertedItem = self.subComponent.convert_input_in(item)
-            for key in convertedItem:
-                array = convertedItem[key]
-                if key not in converted:
-                    # Create a larger array with a higher dimension
-                    converted[key] = numpy.zeros([longest] + list(array.shape))
-                converted[key][itemIndex] = array
-
-        return converted
+    def get_batch_axis(self, key):
+        # The lengths are indexed by sample. Everything underneath the sequence gets a time
+        # dimension inserted just before its batch dimension.
+        if key.startswith(self.machineVariableName() + "__length__"):
+            return 0
+        return self.subComponent.get_batch_axis(key) + 1
+
+    def get_padded_length(self, value):
+        if value is None:
+            return 0
+        if self.schema['configuration']['component']['enforceSequenceLengthLimit']:
+            return min(self.schema['configuration']['component']['maxSequenceLength'], len(value))
+        return len(value)
+
+    def pack(self, sequences, convert, enforceSequenceLengthLimit):
+        """ Converts a list of sequences into time-major arrays.
+
+            All of the items from every sequence are converted with a single call to the given
+            sub-component conversion function, and then scattered into place using the sequence lengths.
+        """
+        lengths = numpy.zeros([len(sequences)], dtype = numpy.int32)
+        items = []
+        for sampleIndex in range(len(sequences)):
+            sequence = sequences[sampleIndex]
+            if sequence is None:
+                sequence = []
+            if enforceSequenceLengthLimit:
+                sequence = sequence[:self.schema['configuration']['component']['maxSequenceLength']]
+            lengths[sampleIndex] = len(sequence)
+            items.extend(sequence)
+
+        longest = int(numpy.max(lengths)) if len(sequences) > 0 else 0
+
+        # Find the time index and sample index of every item
+        sampleIndexes = numpy.repeat(numpy.arange(len(sequences)), lengths)
+        timeIndexes = numpy.arange(len(items)) - numpy.repeat(numpy.cumsum(lengths) - lengths, lengths)
+
+        # One extra None is converted along with the items. Its conversion fills the padding.
+        convertedItems = convert(items + [None])
 
-    def convert_output_in(self, output):
         converted = {}
+        converted[self.machineVariableName() + "__length__:0"] = lengths
+        for key in convertedItems:
+            array = convertedItems[key]
+            axis = self.subComponent.get_batch_axis(key)
+            leading = (slice(None),) * axis
 
-        # Add in the sequence lengths
-        converted[self.machineVariableName() + "__length__:0"] = []
-
-        longest = 0
-        # Find the longest sequence
-        for sampleIndex in range(len(output)):
-            sequence = output[sampleIndex]
-            converted[self.machineVariableName() + "__length__:0"].append(len(sequence))
-            longest = max(len(sequence), longest)
-
-        # combine each of the outputs
-        for itemIndex in range(longest):
-            item = []
-            for sampleIndex in range(len(output)):
-                sequence = output[sampleIndex]
-                if len(sequence) > itemIndex:
-                    item.append(sequence[itemIndex])
-                else:
-                    item.append(None)
-
-            convertedItem = self.subComponent.convert_output_in(item)
-            for key in convertedItem:
-                array = convertedItem[key]
-                if key not in converted:
-                    # Create a larger array with a higher dimension
-                    converted[key] = numpy.zeros([longest] + list(array.shape))
-                converted[key][itemIndex] = array
+            packed = numpy.empty(array.shape[:axis] + (longest, len(sequences)) + array.shape[axis + 1:], dtype = array.dtype)
+            packed[...] = numpy.expand_dims(array[leading + (slice(-1, None),)], axis)
+            packed[leading + (timeIndexes, sampleIndexes)] = array[leading + (slice(0, -1),)]
+            converted[key] = packed
 
         return converted
 
+    def convert_input_in(self, input):
+        return self.pack(input, self.subComponent.convert_input_in, self.schema['configuration']['component']['enforceSequenceLengthLimit'])
 
-    def convert_output_out(self, outputs, inputs):
-        outputKeys = []
-        for key in outputs.keys():
-            if key.startswith(self.machineVariableName()):
-                outputKeys.append(key)
-
-        timeObjects = []
+    def convert_output_in(self, output):
+        return self.pack(output, self.subComponent.convert_output_in, False)
 
-        # Get the sequence lengths
-        sequenceLengths = inputs[self.machineVariableName() + "__length__:0"]
 
-        # For each output we have a multi-dimensional tensor with time
-        # as the top dimension so separate each of the items.
-        for key in outputKeys:
-            length = outputs[key].shape[0]
-            for index in range(length):
-                if len(timeObjects) <= index:
-                    timeObjects.append({})
-                timeObjects[index][key] = outputs[key][index]
-
-        objects = []
-        for timeIndex in range(len(timeObjects)):
-            batchItems = self.subComponent.convert_output_out(timeObjects[timeIndex], inputs)
+    def convert_output_out(self, outputs, inputs):
+        lengthKey = self.machineVariableName() + "__length__:0"
+        sequenceLengths = inputs[lengthKey]
+
+        # Every array underneath the sequence has its time dimension just before its batch dimension. For
+        # nested sequences, that comes after the time dimensions of the inner sequences.
+        def timeSlices(arrays):
+            slices = []
+            for key in arrays.keys():
+                if key.startswith(self.machineVariableName()) and key != lengthKey:
+                    axis = self.get_batch_axis(key) - 1
+                    for timeIndex in range(arrays[key].shape[axis]):
+                        if len(slices) <= timeIndex:
+                            slices.append({})
+                        slices[timeIndex][key] = numpy.take(arrays[key], timeIndex, axis = axis)
+            return slices
+
+        timeOutputs = timeSlices(outputs)
+        timeInputs = timeSlices(inputs)
+
+        objects = [[] for batchIndex in range(len(sequenceLengths))]
+        for timeIndex in range(len(timeOutputs)):
+            # The sub-component sees the inputs for the same time step, such as the lengths of inner sequences
+            stepInputs = dict(inputs)
+            if timeIndex < len(timeInputs):
+                stepInputs.update(timeInputs[timeIndex])
+
+            batchItems = self.subComponent.convert_output_out(timeOutputs[timeIndex], stepInputs)
             for batchIndex in range(len(batchItems)):
                 if timeIndex < sequenceLengths[batchIndex]:
-                    if len(objects) <= batchIndex:
-                        objects.append([])
-
                     objects[batchIndex].append(batchItems[batchIndex])
 
         return objects
@@ -143,31 +135,30 @@ class EBNeuralNetworkSequenceComponent(EBNeuralNetworkComponentBase):
         return placeholders
 
     def get_input_stack(self, placeholders):
-        # Find each of the placeholders for variables that exist underneath this sequence
-        subPlaceholderKeys = []
-        subPlaceholders = []
+        # Find each of the placeholders for variables that exist underneath this sequence, and fold
+        # their time dimension into the batch dimension so the sub-component runs on all items at once
+        subPlaceholders = {}
+        timeAndBatch = None
         for key in placeholders:
             if key.startswith(self.machineVariableName()) and (key != self.machineVariableName() + "__length__"):
-                subPlaceholderKeys.append(key)
-                subPlaceholders.append(placeholders[key])
-
-        mappedSubShapes = []
+                axis = self.subComponent.get_batch_axis(key)
+                subPlaceholders[key] = foldTime(placeholders[key], axis)
+                if timeAndBatch is None:
+                    timeAndBatch = tf.shape(placeholders[key])[axis:axis + 2]
 
-        allFields = self.schema.allFields()
+        subOutputs, subShapes = self.subComponent.get_input_stack(subPlaceholders)
 
-        def subInputStack(items):
-            subOutputs, subShapes = self.subComponent.get_input_stack({subPlaceholderKeys[i]: items[i] for i in range(len(items))})
-            mappedSubShapes.extend(subShapes)
-            return subOutputs
-
-        mappedSubOutputs = tf.map_fn(subInputStack, subPlaceholders, dtype=[tf.float32]*len(allFields))
+        # Split the time dimension back out of each of the sub outputs
+        unfoldedSubOutputs = []
+        for index in range(len(subOutputs)):
+            unfoldedSubOutputs.append(unfoldTime(subOutputs[index], subShapes[index].dimensionNames.index(EBTensorShape.Batch), timeAndBatch))
 
         mergedTensor = None
-        if len(mappedSubOutputs) > 1:
+        if len(unfoldedSubOutputs) > 1:
             # Now join together all of the different sub elements
-            mergedTensor = tf.concat(mappedSubOutputs, -1)
+            mergedTensor = tf.concat(unfoldedSubOutputs, -1)
         else:
-            mergedTensor = mappedSubOutputs[0]
+            mergedTensor = unfoldedSubOutputs[0]
 
         # Get the sequence lengths tensor
         sequenceLengths = placeholders[self.machineVariableName() + "__length__"]
@@ -183,65 +174,85 @@ class EBNeuralNetworkSequenceComponent(EBNeuralNetworkComponentBase):
     def get_output_stack(self, inputs, shapes):
         # Figure out which of the inputs correspond to this sequence.
         origSequence = None
+        origShape = None
         for shapeIndex in range(len(shapes)):
             if shapes[shapeIndex].variableName == self.machineVariableName():
                 origSequence = inputs[shapeIndex]
+                origShape = shapes[shapeIndex]
 
         if origSequence is None:
             raise Exception("Electric Brain does not currently support generative models. Please stay tuned for the next version of EB.")
 
-        subShapes = {}
-        outputKeys = []
-        def subStack(item):
-            # Remove time dimension from the shapes
-            newShapes = [shape.popDimension() for shape in shapes]
-            localOutputs, localShapes = self.subComponent.get_output_stack([item[0]], newShapes)
-            subShapes.update(localShapes)
-            outputKeys.extend(localOutputs.keys())
-            return list(localOutputs.values())
-
-        # Individual outputs
-        subOutputArray = tf.map_fn(subStack, [origSequence])
-
-        subOutputs = {outputKeys[index]: subOutputArray[index] for index in range(len(subOutputArray))}
+        # Run the sub-component once over every item, with time folded into the batch
+        timeAndBatch = tf.shape(origSequence)[0:2]
+        localOutputs, localShapes = self.subComponent.get_output_stack([foldTime(origSequence, 0)], [origShape.popDimension()])
 
-        # Remap subShapes to add the time dimension to each shape
-        subShapes = {key: subShapes[key].pushDimension("*", EBTensorShape.Time) for key in subShapes.keys()}
+        # Split the time dimension back out of each output, just before its batch dimension
+        subOutputs = {}
+        subShapes = {}
+        for key in localOutputs.keys():
+            axis = localShapes[key].dimensionNames.index(EBTensorShape.Batch)
+            subOutputs[key] = unfoldTime(localOutputs[key], axis, timeAndBatch)
+            subShapes[key] = localShapes[key].insertDimension(axis, "*", EBTensorShape.Time)
 
         # Return the sub outputs
         return (subOutputs, subShapes)
 
 
     def get_criterion_stack(self, outputs, outputShapes, outputPlaceholders):
-        # Find each of the placeholders for variables that exist underneath this sequence
+        # Find each of the outputs and placeholders for variables that exist underneath this sequence
         outputKeys = []
         for key in outputs.keys():
             if key.startswith(self.machineVariableName()) and (key != self.machineVariableName() + "__length__"):
                 outputKeys.append(key)
 
-        losses = []
-
-        def subStack(values):
-            # Remove the time dimension from all output shapes
-            outputs = {outputKeys[index]: values[index] for index in range(len(outputKeys))}
-            shapes = {outputKeys[index]: outputShapes[outputKeys[index]].popDimension() for index in range(len(outputKeys))}
-            placeholders = {outputKeys[index]: values[index + len(outputKeys)] for index in range(len(outputKeys))}
-
-            losses = self.subComponent.get_criterion_stack(outputs, shapes, placeholders)
-            return losses + losses
-
-        tensorsToMap = [outputs[key] for key in outputKeys] + [outputPlaceholders[key] for key in outputKeys]
-
-        # Map both the network outputs and the actual outputs, and apply the sub-stacks to them
-        subLosses = tf.map_fn(subStack, tensorsToMap)
-
-        # Remove half of the sub-losses
-        subLosses = subLosses[:len(outputKeys)]
-
-        return subLosses
-
-
-
-
-
-
+        placeholderKeys = []
+        for key in outputPlaceholders.keys():
+            if key.startswith(self.machineVariableName()) and (key != self.machineVariableName() + "__length__"):
+                placeholderKeys.append(key)
+
+        if len(outputKeys) == 0:
+            return []
+
+        # Find which items fall within the length of their sequence, in the same time-major order
+        # that folding the time dimension into the batch dimension produces
+        sequenceLengths = outputPlaceholders[self.machineVariableName() + "__length__"]
+        firstAxis = self.subComponent.get_batch_axis(placeholderKeys[0])
+        maxLength = tf.shape(outputPlaceholders[placeholderKeys[0]])[firstAxis]
+        valid = tf.reshape(tf.transpose(tf.sequence_mask(sequenceLengths, maxLength)), [-1])
+        validIndexes = tf.reshape(tf.where(valid), [-1])
+
+        # Fold time into the batch and drop the padding, so the sub-criterion only ever sees real items
+        foldedOutputs = {}
+        foldedShapes = {}
+        for key in outputKeys:
+            axis = outputShapes[key].dimensionNames.index(EBTensorShape.Batch) - 1
+            foldedOutputs[key] = tf.gather(foldTime(outputs[key], axis), validIndexes, axis = axis)
+            foldedShapes[key] = outputShapes[key].removeDimension(axis)
+
+        foldedPlaceholders = {}
+        for key in placeholderKeys:
+            axis = self.subComponent.get_batch_axis(key)
+            foldedPlaceholders[key] = tf.gather(foldTime(outputPlaceholders[key], axis), validIndexes, axis = axis)
+
+        return self.subComponent.get_criterion_stack(foldedOutputs, foldedShapes, foldedPlaceholders)
+
+
+def foldTime(tensor, axis):
+    """ Merges the time dimension at the given axis into the batch dimension that follows it """
+    dynamicShape = tf.shape(tensor)
+    folded = tf.reshape(tensor, tf.concat([dynamicShape[:axis], [-1], dynamicShape[axis + 2:]], 0))
+    if tensor.get_shape().ndims is not None:
+        staticShape = tensor.get_shape().as_list()
+        folded.set_shape(staticShape[:axis] + [None] + staticShape[axis + 2:])
+    return folded
+
+
+def unfoldTime(tensor, axis, timeAndBatch):
+    """ Splits the merged dimension at the given axis back into a time dimension and a batch dimension """
+    dynamicShape = tf.shape(tensor)
+    unfolded = tf.reshape(tensor, tf.concat([dynamicShape[:axis], timeAndBatch, dynamicShape[axis + 1:]], 0))
+    if tensor.get_shape().ndims is not None:
+        staticShape = tensor.get_shape().as_list()
+        unfolded.set_shape(staticShape[:axis] + [None, None] + staticShape[axis + 1:])
+    return unfolded
@@ -18,19 +18,19 @@
 import tensorflow as tf
 from shape import EBTensorShape, createSummaryModule
 from plugins import EBNeuralNetworkComponentBase
-from utils import eprint
 from editor import generateEditorNetwork
 import numpy
-import sqlite3
 import sys
-import sklearn
+from word_vectors import acquireWordVectorStore, releaseWordVectorStore, hashWord
 
 class EBNeuralNetworkWordComponent(EBNeuralNetworkComponentBase):
     def __init__(self, schema, prefix):
         super(EBNeuralNetworkWordComponent, self).__init__(schema, prefix)
         self.schema = schema
 
-        self.vectorDB = sqlite3.connect(sys.argv[1])
+        # Every word component in the process shares the same vector store
+        self.vectorStore = acquireWordVectorStore(sys.argv[1])
+        self.vectorSize = self.vectorStore.dimensions
 
         self.wordVectorsVariableName = self.machineVariableName() + "_wordVectors"
         self.embeddingIndexVariableName = self.machineVariableName() + "_embeddingIndex"
@@ -38,76 +38,47 @@ class EBNeuralNetworkWordComponent(EBNeuralNetworkComponentBase):
         self.wordVectorsPlaceholderName = self.wordVectorsVariableName + ":0"
         self.embeddingIndexPlaceholderName = self.embeddingIndexVariableName + ":0"
 
-        self.embeddingDictionary = {}
-        self.currentEmbeddingIndex = 0
+        # Words which are not in the vocabulary are hashed into a fixed number of learned embeddings
+        self.outOfVocabularyBuckets = int(self.schema['configuration']['component'].get('outOfVocabularyBuckets', 10000))
 
-        self.wordVectorDictionary = {}
-        self.wordTensors = []
-
-        cur = self.vectorDB.cursor()
-        index = 0
-        while True:
-            tensorBytes = cur.execute("SELECT tensor,word FROM word_vectors", []).fetchone()
-            if tensorBytes is None:
-                break
-            tensor = numpy.fromstring(tensorBytes[0])
-            word = tensorBytes[1]
-
-            self.wordVectorDictionary[word] = index
-            self.wordTensors.append(tensor)
-            index += 1
-
-        self.wordVectorTree = sklearn.neighbors.BallTree(self.wordTensors, leaf_size=100)
+    def __del__(self):
+        # The store is not set when the constructor failed before acquiring it
+        if getattr(self, 'vectorStore', None) is not None:
+            releaseWordVectorStore(self.vectorStore)
 
     def convert_input_in(self, input):
-        cur = self.vectorDB.cursor()
-
         converted = {}
-        converted[self.wordVectorsPlaceholderName] = []
-        converted[self.embeddingIndexPlaceholderName] = []
 
-        for index in range(len(input)):
+        # Resolve every distinct word in the batch at once, then gather all the vectors in one operation
+        rows = self.vectorStore.lookupRows(input)
+        converted[self.wordVectorsPlaceholderName] = self.vectorStore.gatherVectors(rows)
+
+        # Words which are not in the vocabulary get a learned embedding instead
+        embeddingIndexes = numpy.full([len(input)], -1, dtype = numpy.int32)
+        buckets = {}
+        for index in numpy.flatnonzero(rows == -1):
             word = input[index]
-            if word is None:
-                converted[self.wordVectorsPlaceholderName].append([0] * 300)
-                converted[self.embeddingIndexPlaceholderName].append(-1)
-            else:
-                tensorBytes = cur.execute("SELECT tensor FROM word_vectors WHERE word = ?", [word]).fetchone()
-                if tensorBytes is None:
-                    converted[self.wordVectorsPlaceholderName].append([0] * 300)
-                    if not word in self.embeddingDictionary:
-                        self.embeddingDictionary[word] = self.currentEmbeddingIndex
-                        self.currentEmbeddingIndex += 1
-
-                    converted[self.embeddingIndexPlaceholderName].append(self.embeddingDictionary[word])
-                else:
-                    tensor = numpy.fromstring(tensorBytes[0])
-                    converted[self.wordVectorsPlaceholderName].append(tensor)
-                    converted[self.embeddingIndexPlaceholderName].append(-1)
-
-        converted[self.wordVectorsPlaceholderName] = numpy.array(converted[self.wordVectorsPlaceholderName])
-        converted[self.embeddingIndexPlaceholderName] = numpy.array(converted[self.embeddingIndexPlaceholderName])
+            if word is not None:
+                if not word in buckets:
+                    buckets[word] = hashWord(word.encode('utf-8')) % self.outOfVocabularyBuckets
+                embeddingIndexes[index] = buckets[word]
+        converted[self.embeddingIndexPlaceholderName] = embeddingIndexes
 
         return converted
 
     def convert_output_in(self, output):
-        cur = self.vectorDB.cursor()
-        converted = []
-        for value in input:
-            tensorBytes = cur.execute("SELECT tensor FROM word_vectors WHERE word = ?", )
-            tensor = numpy.fromstring(tensorBytes)
-
-            converted.append(value)
-
-        return converted
+        # Output words are fed through the same placeholders as input words
+        return self.convert_input_in(output)
 
     def convert_output_out(self, outputs, inputs):
-        raise Exception("Unimplemented")
+        # Decode each predicted vector into the closest word in the vocabulary
+        output = outputs[self.wordVectorsPlaceholderName]
+        return self.vectorStore.nearestWords(output)
 
     def get_input_placeholders(self, extraDimensions):
         placeholders = {}
 
-        placeholders[self.wordVectorsPlaceholderName] = tf.placeholder(tf.float32, name = self.wordVectorsVariableName, shape = ([None] * extraDimensions) + [300])
+        placeholders[self.wordVectorsPlaceholderName] = tf.placeholder(tf.float32, name = self.wordVectorsVariableName, shape = ([None] * extraDimensions) + [self.vectorSize])
         placeholders[self.embeddingIndexPlaceholderName] = tf.placeholder(tf.int32, name = self.embeddingIndexVariableName, shape = ([None] * extraDimensions) + [])
 
         return placeholders
@@ -115,7 +86,7 @@ class EBNeuralNetworkWordComponent(EBNeuralNetworkComponentBase):
     def get_output_placeholders(self, extraDimensions):
         placeholders = {}
 
-        placeholders[self.wordVectorsPlaceholderName] = tf.placeholder(tf.float32, name = self.wordVectorsVariableName, shape = ([None] * extraDimensions) + [300])
+        placeholders[self.wordVectorsPlaceholderName] = tf.placeholder(tf.float32, name = self.wordVectorsVariableName, shape = ([None] * extraDimensions) + [self.vectorSize])
         placeholders[self.embeddingIndexPlaceholderName] = tf.placeholder(tf.int32, name = self.embeddingIndexVariableName, shape = ([None] * extraDimensions) + [])
 
         return placeholders
@@ -124,28 +95,42 @@ class EBNeuralNetworkWordComponent(EBNeuralNetworkComponentBase):
         wordVectors = placeholders[self.wordVectorsPlaceholderName]
         embeddingIndexes = placeholders[self.embeddingIndexPlaceholderName]
 
-        # Create a large tensor to be used for learned embedding lookups
+        # Create a tensor to be used for learned embedding lookups
         with tf.variable_scope(self.machineVariableName()):
-            learnedEmbeddings = tf.get_variable("embeddings", dtype = tf.float32, shape=[10000,300])
-
-            def handleWordItem(items):
-                wordVector = items[0]
-                embeddingIndex = items[1]
+            learnedEmbeddings = tf.get_variable("embeddings", dtype = tf.float32, shape=[self.outOfVocabularyBuckets, self.vectorSize])
 
-                output = tf.cond(tf.equal(embeddingIndex, -1), lambda: wordVector, lambda: learnedEmbeddings[embeddingIndex])
-                return [output, output]
+            # Pretrained vectors are zero wherever a learned embedding is used, so the two can simply
+            # be added together once the learned embeddings are masked to the words that use them
+            isLearned = tf.expand_dims(tf.to_float(tf.greater_equal(embeddingIndexes, 0)), -1)
+            learned = tf.gather(learnedEmbeddings, tf.maximum(embeddingIndexes, 0))
+            output = wordVectors + learned * isLearned
 
-            output = tf.map_fn(handleWordItem, [wordVectors, embeddingIndexes])[0]
-
-            return ([output], [EBTensorShape(["*", 300], [EBTensorShape.Batch, EBTensorShape.Data], self.machineVariableName() )])
+            return ([output], [EBTensorShape(["*", self.vectorSize], [EBTensorShape.Batch, EBTensorShape.Data], self.machineVariableName() )])
 
 
     def get_output_stack(self, inputs, shapes):
-        raise Exception("Unimplemented")
+        # Summarize the tensors being currently activated
+        summaryNode = createSummaryModule(inputs, shapes)
 
-    def get_criterion_stack(self, outputs, outputShapes, outputPlaceholders):
-        raise Exception("Unimplemented")
+        # Generate the neural network provided from the UI, defaulting to a single dense layer
+        layers = self.schema['configuration']['component'].get('layers', [{"name": "dense", "units": "outputSize"}])
+        outputLayer, outputSize = generateEditorNetwork(layers, summaryNode, {"outputSize": self.vectorSize})
 
+        # The output is keyed the same as the placeholder holding the expected word vectors, so
+        # that the criterion stack can pair them up
+        outputs = {self.wordVectorsPlaceholderName: outputLayer}
+        outputShapes = {self.wordVectorsPlaceholderName: EBTensorShape(["*", self.vectorSize], [EBTensorShape.Batch, EBTensorShape.Data], self.machineVariableName())}
+        return (outputs, outputShapes)
 
+    def get_criterion_stack(self, outputs, outputShapes, outputPlaceholders):
+        output = outputs[self.wordVectorsPlaceholderName]
+        placeholder = outputPlaceholders[self.wordVectorsPlaceholderName]
 
+        # Cosine distance between the predicted and expected vectors. Missing and out of vocabulary
+        # words have zero vectors, and are masked out of the loss.
+        mask = tf.sign(tf.reduce_max(tf.abs(placeholder), -1))
+        similarity = tf.reduce_sum(tf.nn.l2_normalize(output, -1) * tf.nn.l2_normalize(placeholder, -1), -1)
+        losses = (1.0 - similarity) * mask
 
+        loss = tf.reduce_sum(losses) / tf.maximum(tf.reduce_sum(mask), 1.0)
+        return [loss]
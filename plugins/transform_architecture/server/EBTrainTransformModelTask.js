@@ -35,7 +35,6 @@ const
     mongodb = require('mongodb'),
     path = require('path'),
     Promise = require('bluebird'),
-    temp = require('temp'),
     underscore = require('underscore');
 
 /**
@@ -288,8 +287,8 @@ class EBTrainTransformModelTask extends EBTrainModelTaskBase
 
         return workerPromise.then((worker) =>
         {
-            const inputFileName = temp.path({suffix: '.npz'});
-            const outputFileName = temp.path({suffix: '.npz'});
+            const inputFileName = this.trainingProcess.createBatchFileName();
+            const outputFileName = this.trainingProcess.createBatchFileName();
             return worker.writeAndWaitForMatchingOutput({
                 "type": "prepareBatch",
                 "batchNumber": batchNumber,
@@ -423,8 +422,19 @@ class EBTrainTransformModelTask extends EBTrainModelTaskBase
                                 // Update the time per iteration
                                 trainingResult.currentTimePerIteration = trainingResult.performance.total();
 
-                                // Zip together original objects with the actual outputs from the network, and compute accuracies
-                                return Promise.mapSeries(underscore.zip(batch.objects, result.objects), (zipped) =>
+                                // Without any outputs from the network, there is nothing to compute the accuracy from
+                                if (!result.objects)
+                                {
+                                    return {
+                                        trainingAccuracy: null,
+                                        loss: result.loss
+                                    };
+                                }
+
+                                // Zip together original objects with the actual outputs from the network, and compute accuracies.
+                                // When the outputs were sampled, only the sampled objects are compared.
+                                const originals = result.sampleIndexes ? Array.from(result.sampleIndexes).map((index) => batch.objects[index]) : batch.objects;
+                                return Promise.mapSeries(underscore.zip(originals, result.objects), (zipped) =>
                                 {
                                     return self.outputTransformer.convertObjectOut(this.application.interpretationRegistry, zipped[1]).then((actual) =>
                                     {
@@ -463,7 +473,10 @@ class EBTrainTransformModelTask extends EBTrainModelTaskBase
                                 });
                             }).then((trainingIterationResult) =>
                             {
-                                self.rollingAverageTrainingaccuracy.accumulate(trainingIterationResult.trainingAccuracy * 100);
+                                if (trainingIterationResult.trainingAccuracy !== null)
+                                {
+                                    self.rollingAverageTrainingaccuracy.accumulate(trainingIterationResult.trainingAccuracy * 100);
+                                }
                                 return self.testIteration().then((testingAccuracy) =>
                                 {
                                     return {
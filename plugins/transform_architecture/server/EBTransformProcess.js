@@ -72,7 +72,8 @@ class EBTransformProcess extends EBModelProcessBase
             return process.writeAndWaitForMatchingOutput({
                 type: "initialize",
                 inputSchema: inputSchema,
-                outputSchema: outputSchema
+                outputSchema: outputSchema,
+                resources: this.resourceProfile || undefined
             }, {"type": "initialized"});
         });
     }
@@ -121,7 +122,75 @@ class EBTransformProcess extends EBModelProcessBase
             ids: objects.map((object, index) => (index + 1).toString())
         };
 
-        return this.processes[0].writeAndWaitForMatchingOutput(message, {type: "evaluationCompleted"});
+        return this.processes[0].request(message);
+    }
+
+
+    /**
+     * This method puts the process into serving mode, where evaluate requests which arrive close
+     * together are merged into a single batch before being run through the network.
+     *
+     * @param {object} options An object with maxBatchSize, the most samples to merge into one batch, and
+     *                         maxLatency, the most milliseconds a request may wait for others to join it
+     * @return {Promise} A promise that will resolve once serving mode has started
+     */
+    startServing(options)
+    {
+        const message = underscore.extend({type: "startServing"}, options || {});
+        return this.processes[0].writeAndWaitForMatchingOutput(message, {type: "servingStarted"});
+    }
+
+
+    /**
+     * This method takes the process out of serving mode, once the requests already queued have been run
+     *
+     * @return {Promise} A promise that will resolve to the final serving statistics
+     */
+    stopServing()
+    {
+        const message = {type: "stopServing"};
+        return this.processes[0].writeAndWaitForMatchingOutput(message, {type: "servingStopped"}).then((response) => response.stats);
+    }
+
+
+    /**
+     * This method returns statistics for tuning serving mode - the number of requests, batches and samples,
+     * along with histograms of the batch sizes and of the number of requests queued as each batch was formed
+     *
+     * @return {Promise} A promise that will resolve to the statistics, or null when not in serving mode
+     */
+    getServingStatistics()
+    {
+        const message = {type: "servingStats"};
+        return this.processes[0].writeAndWaitForMatchingOutput(message, {type: "servingStats"}).then((response) => response.stats);
+    }
+
+
+    /**
+     * This method turns on the cache of outputs for individual objects, so that objects which have been
+     * evaluated before are not run through the network again. The cache is cleared whenever the model
+     * changes, on load, reset and every training iteration.
+     *
+     * @param {object} options An object with maxEntries, the number of outputs to keep (zero disables the cache),
+     *                         and ttl, the number of seconds an output may be reused for (leave out for no limit)
+     * @return {Promise} A promise that will resolve once the cache has been configured
+     */
+    configurePredictionCache(options)
+    {
+        const message = underscore.extend({type: "configurePredictionCache"}, options || {});
+        return this.processes[0].writeAndWaitForMatchingOutput(message, {type: "predictionCacheConfigured"});
+    }
+
+
+    /**
+     * This method returns the hits, misses, hit ratio, expired entries and evictions of the prediction cache
+     *
+     * @return {Promise} A promise that will resolve to the statistics
+     */
+    getPredictionCacheStatistics()
+    {
+        const message = {type: "predictionCacheStats"};
+        return this.processes[0].writeAndWaitForMatchingOutput(message, {type: "predictionCacheStats"}).then((response) => response.stats);
     }
 
 
@@ -140,7 +209,7 @@ class EBTransformProcess extends EBModelProcessBase
         };
 
         // TODO: Make this work with multiple sub-processes!
-        return this.processes[0].writeAndWaitForMatchingOutput(message, {type: "evaluationCompleted"}).then((result) =>
+        return this.processes[0].request(message).then((result) =>
         {
             return result.objects;
         });
@@ -152,19 +221,45 @@ class EBTransformProcess extends EBModelProcessBase
      *
      * @param {[string]} inputBatchFilename The filename that contains this input batch
      * @param {[string]} outputBatchFilename The filename that contains this output batch
-     * @param {Promise} A Promise that will resolve when batch is complete
+     * @param {object} [outputPolicy] Which outputs to send back, e.g. {mode: "none"}, {mode: "every", every: 10} or {mode: "sample", sampleSize: 8}. Defaults to all outputs.
+     * @param {Promise} A Promise that will resolve when batch is complete. When outputs were sampled, sampleIndexes lists the samples that objects correspond to.
      */
-    executeTrainingIteration(inputBatchFilename, outputBatchFilename)
+    executeTrainingIteration(inputBatchFilename, outputBatchFilename, outputPolicy)
     {
         // Choose a bunch of random samples from the set that we have
         const message = {
             type: "iteration",
             inputBatchFilename: inputBatchFilename,
-            outputBatchFilename: outputBatchFilename
+            outputBatchFilename: outputBatchFilename,
+            outputPolicy: outputPolicy || {mode: "all"}
         };
 
         // TODO: Make this work with multiple sub-processes!
-        return this.processes[0].writeAndWaitForMatchingOutput(message, {type: "iterationCompleted"});
+        return this.processes[0].request(message);
+    }
+
+
+    /**
+     * This method trains for a number of steps over the given batches in a single message. The process
+     * reads batches on a background thread ahead of the training steps, and only returns the losses.
+     *
+     * @param {[object]} batches A list of objects, each with an inputFileName and outputFileName
+     * @param {number} [steps] The number of steps to train for, cycling through the batches. Defaults to one step per batch.
+     * @param {number} [prefetch] The number of batches to keep loaded ahead of the training steps
+     * @param {boolean} [release] Whether to release the batches once the steps are complete
+     * @return {Promise} A promise that will resolve to an object with the losses for each step, and the mean loss
+     */
+    executeTrainingSteps(batches, steps, prefetch, release)
+    {
+        const message = {
+            type: "trainSteps",
+            batches: batches.map((batch) => ({inputFileName: batch.inputFileName, outputFileName: batch.outputFileName})),
+            steps: steps || batches.length,
+            prefetch: prefetch || 2,
+            release: release || false
+        };
+
+        return this.processes[0].request(message);
     }
 
 
@@ -182,7 +277,7 @@ class EBTransformProcess extends EBModelProcessBase
         const self = this;
 
         const message = {type: "prepareInputBatch", ids: ids, samples: objects, fileName: fileName};
-        return self.processes[0].writeAndWaitForMatchingOutput(message, {type: "batchInputPrepared", fileName: fileName});
+        return self.processes[0].request(message);
     }
 
 
@@ -199,7 +294,39 @@ class EBTransformProcess extends EBModelProcessBase
     {
         const self = this;
         const message = {type: "prepareOutputBatch", ids: ids, samples: objects, fileName: fileName};
-        return self.processes[0].writeAndWaitForMatchingOutput(message, {type: "batchOutputPrepared", fileName: fileName});
+        return self.processes[0].request(message);
+    }
+
+
+    /**
+     * This method tells the process to group a pool of samples into batches of similar sequence length,
+     * which wastes less computation on padding, and then write out the input and output files for each batch.
+     *
+     * @param {[string]} ids The ids for each of the samples
+     * @param {[object]} inputObjects The input objects for each of the samples
+     * @param {[object]} outputObjects The output objects for each of the samples
+     * @param {number} batchSize The maximum number of samples in each batch
+     * @param {[number]} [bucketBoundaries] Optional sorted sequence lengths at which buckets are split. When omitted, boundaries are chosen from quantiles of the lengths.
+     * @param {number} [bucketCount] The number of buckets to use when choosing boundaries automatically
+     *
+     * @return {Promise} A promise that will resolve to a list of batches, each with ids, inputFileName, outputFileName and paddingEfficiency
+     */
+    prepareBucketedBatches(ids, inputObjects, outputObjects, batchSize, bucketBoundaries, bucketCount)
+    {
+        const self = this;
+        const message = {
+            type: "prepareBucketedBatches",
+            ids: ids,
+            inputSamples: inputObjects,
+            outputSamples: outputObjects,
+            batchSize: batchSize,
+            bucketBoundaries: bucketBoundaries || null,
+            bucketCount: bucketCount || 8
+        };
+        return self.processes[0].request(message).then((result) =>
+        {
+            return result.batches;
+        });
     }
 }
 
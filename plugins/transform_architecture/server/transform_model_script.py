@@ -4,6 +4,7 @@ import sys
 sys.path.insert(0, '..')
 
 import json
+import os
 import fileinput
 import sys
 import tensorflow as tf
@@ -11,11 +12,44 @@ import numpy
 from object_component import EBNeuralNetworkObjectComponent
 from utils import eprint
 from schema import EBSchema
-from adamax import AdamaxOptimizer
+import bucketing
+from training_script import EBTrainingScript
+from inference import EBInferenceGraph, inferenceFeed, freezeGraph, writeInferenceGraph
+from microbatch import EBMicroBatcher
+from prediction_cache import EBPredictionCache
+from output_policy import EBOutputPolicy, selectSamples, countSamples
+
+class TrainingScript(EBTrainingScript):
+    # The lane that each type of message runs on, when it is sent with a requestId. See EBMessageDispatcher
+    messageLanes = {
+        "prepareInputBatch": "prepare",
+        "prepareOutputBatch": "prepare",
+        "prepareBucketedBatches": "prepare",
+        "iteration": "train",
+        "trainSteps": "train",
+        "evaluate": "evaluate",
+        "evaluateBatch": "evaluate"
+    }
 
-class TrainingScript:
     def __init__(self):
-        self.session = None
+        EBTrainingScript.__init__(self)
+
+        # Merges evaluate requests into batches while in serving mode
+        self.microBatcher = None
+
+        # Outputs of recently evaluated samples. Disabled until configured.
+        self.predictionCache = EBPredictionCache()
+
+    def messageLane(self, data):
+        # While serving, evaluate requests wait in the micro-batcher, so they need the many threads of the serve lane
+        if data["type"] == 'evaluate' and self.microBatcher is not None:
+            return "serve"
+        return EBTrainingScript.messageLane(self, data)
+
+    def initialize(self, data):
+        # Kept as they were sent, to be written into exported inference graphs
+        self.schemaData = {"input": data["inputSchema"], "output": data["outputSchema"]}
+        self.initializeGraph(EBSchema(data["inputSchema"]), EBSchema(data["outputSchema"]))
 
     def initializeGraph(self, inputSchema, outputSchema):
         self.inputSchema = inputSchema
@@ -42,131 +76,227 @@ class TrainingScript:
 
         self.totalLoss = tf.reduce_mean(self.outputLosses)
 
-    def reset(self, optimizationAlgorithm, optimizationParameters):
-        if self.session is not None:
-            self.session.close()
-
-        self.session = tf.Session()
-
-        self.optimizationAlgorithm = optimizationAlgorithm
-        self.optimizationParameters = optimizationParameters
-
-        if optimizationAlgorithm == 'AdamaxOptimizer':
-            self.trainingStep = AdamaxOptimizer(**self.optimizationParameters).minimize(self.totalLoss)
-        else:
-            self.trainingStep = getattr(tf.train, optimizationAlgorithm)(**self.optimizationParameters).minimize(self.totalLoss)
+    def rebuildGraph(self):
+        self.initializeGraph(self.inputSchema, self.outputSchema)
 
-        self.allSummaryOutputs = tf.summary.merge_all()
-        train_writer = tf.summary.FileWriter('./logs', self.session.graph)
+    def weightsChanged(self):
+        self.predictionCache.invalidate()
 
-        self.session.run(tf.global_variables_initializer())
-
-
-    def prepareInputBatch(self, objects, filename):
+    def prepareInputBatch(self, objects, filename = None, heldBytes = 0):
+        """ Converts the objects and writes them into the batch pool. Returns the handle for the batch """
         converted = self.inputComponent.convert_input_in(objects)
-        numpy.savez(filename, **converted)
+        return self.batchPool.write(converted, filename, heldBytes)
 
-    def prepareOutputBatch(self, objects, filename):
+    def prepareOutputBatch(self, objects, filename = None, heldBytes = 0):
+        """ Converts the objects and writes them into the batch pool. Returns the handle for the batch """
         converted = self.outputComponent.convert_output_in(objects)
-        numpy.savez(filename, **converted)
-
-    def iteration(self, inputFileName, outputFileName):
-        input = dict(numpy.load(inputFileName))
-        output = dict(numpy.load(outputFileName))
+        return self.batchPool.write(converted, filename, heldBytes)
+
+    def prepareBucketedBatches(self, ids, inputSamples, outputSamples, batchSize, bucketBoundaries, bucketCount):
+        """ Groups the samples into batches of similar sequence length, and writes an input and output file for each batch """
+        lengths = []
+        for index in range(len(inputSamples)):
+            lengths.append(max(self.inputComponent.get_padded_length(inputSamples[index]), self.outputComponent.get_padded_length(outputSamples[index])))
+
+        # None of the batches can be released until they have all been returned, so they aren't waited on
+        heldBytes = 0
+        batches = []
+        for indexes in bucketing.bucketSamples(lengths, batchSize, bucketBoundaries, bucketCount):
+            inputFileName = self.prepareInputBatch([inputSamples[index] for index in indexes], None, heldBytes)
+            heldBytes += os.path.getsize(inputFileName)
+            outputFileName = self.prepareOutputBatch([outputSamples[index] for index in indexes], None, heldBytes)
+            heldBytes += os.path.getsize(outputFileName)
+
+            batches.append({
+                "ids": [ids[index] for index in indexes],
+                "inputFileName": inputFileName,
+                "outputFileName": outputFileName,
+                "paddingEfficiency": bucketing.paddingEfficiency([lengths[index] for index in indexes])
+            })
+        return batches
+
+    def iteration(self, inputFileName, outputFileName, outputPolicy):
+        """ Runs a training step. Depending on the output policy, the outputs may be converted for the whole batch,
+            for a sample of it, or not evaluated at all. Returns the loss, the output objects and the sample indexes. """
+        input = self.readBatch(inputFileName)
+        output = self.readBatch(outputFileName)
 
         feedDict = {}
         feedDict.update(input)
         feedDict.update(output)
 
-        evaluations = [self.totalLoss, self.outputs, self.trainingStep]
-
-        if self.allSummaryOutputs is not None:
-            evaluations.append(self.allSummaryOutputs)
+        step = self.iterationCount
+        self.iterationCount += 1
+        if not outputPolicy.includesOutputs(step):
+            totalLoss, values = self.runTrainingStep(feedDict)
+            return totalLoss, None, None
 
-        evalTuple = self.session.run(evaluations, feed_dict = feedDict)
+        totalLoss, values = self.runTrainingStep(feedDict, [self.outputs])
+        outputs = values[0]
 
-        totalLoss = evalTuple[0]
-        outputs = evalTuple[1]
+        samples = outputPolicy.chooseSamples(countSamples(self.outputComponent, outputs))
+        if samples is not None:
+            outputs = selectSamples(self.outputComponent, outputs, samples)
+            input = selectSamples(self.inputComponent, input, samples)
 
         outputs = self.outputComponent.convert_output_out(outputs, input)
 
-        return float(totalLoss), outputs
+        return totalLoss, outputs, samples
+
+    def readTrainingBatch(self, batch):
+        """ Returns the feed dictionary for a batch given as an object with inputFileName and outputFileName """
+        feedDict = self.readCachedBatch(batch["inputFileName"])
+        feedDict.update(self.readCachedBatch(batch["outputFileName"]))
+        return feedDict
 
     def evaluate(self, input):
-        feedDict = {}
-        feedDict.update(input)
-        outputs = self.session.run([self.outputs], feed_dict = feedDict)[0]
+        if self.inferenceGraph is not None:
+            outputs = self.inferenceGraph.run(input)
+        else:
+            feedDict = inferenceFeed()
+            feedDict.update(input)
+            outputs = self.session.run([self.outputs], feed_dict = feedDict)[0]
         outputs = self.outputComponent.convert_output_out(outputs, input)
         return outputs
 
-    def evaluateBatchFile(self, batchFileName):
-        input = dict(numpy.load(batchFileName))
-        return self.evaluate(input)
-
-    def main(self):
-        """  This is the main entry point of the training script."""
-        for line in sys.stdin:
-            data = json.loads(line)
-            response={}
-            if (data["type"] == 'handshake'):
-                response["type"] = "handshake"
-                response["name"] = "TrainingScript.py"
-                response["version"] = "0.0.1"
+    def evaluateSamples(self, samples):
+        """ Returns the output objects for a list of samples. Samples found in the prediction cache are not
+            evaluated again. """
+        if not self.predictionCache.enabled():
+            return self.runSamples(samples)
+
+        keys, outputs = self.predictionCache.lookup(samples)
+        missing = [index for index in range(len(samples)) if outputs[index] is None]
+        if len(missing) > 0:
+            computed = self.runSamples([samples[index] for index in missing])
+            for index, output in zip(missing, computed):
+                outputs[index] = output
+                self.predictionCache.store(keys[index], output)
+        return outputs
 
-            elif (data["type"] == 'initialize'):
-                inputSchema = EBSchema(data["inputSchema"])
-                outputSchema = EBSchema(data["outputSchema"])
+    def runSamples(self, samples):
+        """ Converts and evaluates a list of samples. In serving mode, the samples are merged with those from
+            other evaluate requests waiting at the same time. """
+        if self.microBatcher is not None:
+            return self.microBatcher.submit(samples).result()
+        return self.evaluate(self.inputComponent.convert_input_in(samples))
 
-                results = self.initializeGraph(inputSchema, outputSchema)
+    def startServing(self, maxBatchSize, maxLatency):
+        self.stopServing()
+        self.microBatcher = EBMicroBatcher(lambda samples: self.evaluate(self.inputComponent.convert_input_in(samples)), maxBatchSize, maxLatency)
 
-                response["type"] = "initialized"
-            elif (data["type"] == 'iteration'):
-                totalLoss, outputs = self.iteration(data["inputBatchFilename"], data["outputBatchFilename"])
+    def stopServing(self):
+        if self.microBatcher is not None:
+            self.microBatcher.stop()
+            self.microBatcher = None
 
-                response["type"] = "iterationCompleted"
-                response["loss"] = totalLoss
-                response["objects"] = outputs
-            elif (data["type"] == 'reset'):
-                self.reset(data["optimizationAlgorithm"], data["optimizationParameters"])
-                response["type"] = "resetCompleted"
-            elif (data["type"] == 'prepareInputBatch'):
-                self.prepareInputBatch(data["samples"], data["fileName"])
-                response["fileName"] = data["fileName"]
-                response["type"] = "batchInputPrepared"
-            elif (data["type"] == 'prepareOutputBatch'):
-                self.prepareOutputBatch(data["samples"], data["fileName"])
-                response["fileName"] = data["fileName"]
-                response["type"] = "batchOutputPrepared"
-            elif (data["type"] == 'evaluate'):
-                input = self.inputComponent.convert_input_in(data["samples"])
-                outputs = self.evaluate(input)
-                response["type"] = "evaluationCompleted"
-                response["objects"] = outputs
-            elif (data["type"] == 'evaluateBatch'):
-                outputs = self.evaluateBatchFile(data["batchFilename"])
+    def evaluateBatchFile(self, batchFileName):
+        input = self.readBatch(batchFileName)
+        return self.evaluate(input)
 
-                response["type"] = "evaluationCompleted"
+    def exportInference(self, fileName):
+        """ Writes a frozen copy of the graph for serving, holding only what is needed to evaluate the outputs """
+        self.ensureSession()
+
+        inputNames = [self.inputPlaceholders[key].name for key in self.inputPlaceholders]
+        graphDef, usedInputs = freezeGraph(self.session, inputNames, list(self.outputs.values()))
+        signature = {
+            "inputs": usedInputs,
+            "outputs": {key: self.outputs[key].name for key in self.outputs},
+            "inputSchema": self.schemaData["input"],
+            "outputSchema": self.schemaData["output"]
+        }
+        writeInferenceGraph(fileName, graphDef, signature)
+
+    def loadInference(self, fileName):
+        """ Loads a frozen graph for serving. The components are only created for converting samples, so a
+            serving process does not need to be initialized with the schemas or build the training graph. """
+        if self.inferenceGraph is not None:
+            self.inferenceGraph.close()
+        self.inferenceGraph = EBInferenceGraph(fileName, self.sessionConfig)
+        self.weightsChanged()
+
+        signature = self.inferenceGraph.signature
+        self.schemaData = {"input": signature["inputSchema"], "output": signature["outputSchema"]}
+        self.inputComponent = EBNeuralNetworkObjectComponent(EBSchema(signature["inputSchema"]), "input")
+        self.outputComponent = EBNeuralNetworkObjectComponent(EBSchema(signature["outputSchema"]), "output")
+
+    def load(self, fileName):
+        EBTrainingScript.load(self, fileName)
+        tf.set_random_seed(565)
+
+    def handleScriptMessage(self, data, response):
+        """ Handles the messages specific to transform models """
+        if (data["type"] == 'iteration'):
+            outputPolicy = EBOutputPolicy(data.get("outputPolicy"))
+            totalLoss, outputs, samples = self.iteration(data["inputBatchFilename"], data["outputBatchFilename"], outputPolicy)
+            self.weightsChanged()
+            if data.get("release", False):
+                self.releaseBatch(data["inputBatchFilename"])
+                self.releaseBatch(data["outputBatchFilename"])
+
+            response["type"] = "iterationCompleted"
+            response["loss"] = totalLoss
+            if outputs is not None:
                 response["objects"] = outputs
-            elif (data["type"] == 'save'):
-                if self.session is None:
-                    self.reset("AdadeltaOptimizer", {})
-
-                saver = tf.train.Saver()
-                saver.save(self.session, "model.tfg")
-
-                response["type"] = "saved"
-            elif (data["type"] == 'load'):
-                if self.session is None:
-                    self.reset("AdadeltaOptimizer", {})
-
-                saver = tf.train.Saver()
-                saver.restore(self.session, "model.tfg")
-
-                tf.set_random_seed(565)
-                response["type"] = "loaded"
-
-            sys.stdout.write(json.dumps(response) + "\n")
-            sys.stdout.flush()
+            if samples is not None:
+                response["sampleIndexes"] = samples
+        elif (data["type"] == 'trainSteps'):
+            losses = self.trainSteps(data["batches"], data.get("steps"), data.get("prefetch", 2))
+            if data.get("release", False):
+                for batch in data["batches"]:
+                    self.releaseBatch(batch["inputFileName"])
+                    self.releaseBatch(batch["outputFileName"])
+
+            response["type"] = "stepsCompleted"
+            response["losses"] = losses
+            response["loss"] = float(numpy.mean(losses)) if len(losses) > 0 else None
+        elif (data["type"] == 'prepareInputBatch'):
+            response["fileName"] = self.prepareInputBatch(data["samples"], data.get("fileName"))
+            response["type"] = "batchInputPrepared"
+        elif (data["type"] == 'prepareOutputBatch'):
+            response["fileName"] = self.prepareOutputBatch(data["samples"], data.get("fileName"))
+            response["type"] = "batchOutputPrepared"
+        elif (data["type"] == 'prepareBucketedBatches'):
+            batches = self.prepareBucketedBatches(data["ids"], data["inputSamples"], data["outputSamples"], data["batchSize"], data.get("bucketBoundaries"), data.get("bucketCount", 8))
+            response["batches"] = batches
+            response["type"] = "bucketedBatchesPrepared"
+        elif (data["type"] == 'evaluate'):
+            outputs = self.evaluateSamples(data["samples"])
+            response["type"] = "evaluationCompleted"
+            response["objects"] = outputs
+        elif (data["type"] == 'evaluateBatch'):
+            outputs = self.evaluateBatchFile(data["batchFilename"])
+            if data.get("release", False):
+                self.releaseBatch(data["batchFilename"])
+
+            response["type"] = "evaluationCompleted"
+            response["objects"] = outputs
+        elif (data["type"] == 'exportInference'):
+            self.exportInference(data["fileName"])
+            response["type"] = "inferenceExported"
+            response["fileName"] = data["fileName"]
+        elif (data["type"] == 'loadInference'):
+            self.loadInference(data["fileName"])
+            response["type"] = "inferenceLoaded"
+        elif (data["type"] == 'startServing'):
+            # The latency is given in milliseconds
+            self.startServing(data.get("maxBatchSize", 32), data.get("maxLatency", 5) / 1000.0)
+            response["type"] = "servingStarted"
+        elif (data["type"] == 'stopServing'):
+            stats = self.microBatcher.stats() if self.microBatcher is not None else None
+            self.stopServing()
+            response["type"] = "servingStopped"
+            response["stats"] = stats
+        elif (data["type"] == 'servingStats'):
+            response["type"] = "servingStats"
+            response["stats"] = self.microBatcher.stats() if self.microBatcher is not None else None
+        elif (data["type"] == 'configurePredictionCache'):
+            self.predictionCache = EBPredictionCache(data.get("maxEntries", 0), data.get("ttl"))
+            response["type"] = "predictionCacheConfigured"
+        elif (data["type"] == 'predictionCacheStats'):
+            response["type"] = "predictionCacheStats"
+            response["stats"] = self.predictionCache.stats()
 
 if __name__ == "__main__":
     script = TrainingScript()
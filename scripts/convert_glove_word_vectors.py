@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+#
+# Electric Brain is an easy to use platform for machine learning.
+# Copyright (C) 2016 Electric Brain Software Corporation
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Converts a GloVe text file into a word vector store, as read by lib/python/word_vectors.py.
+
+    The text file is split into byte ranges which are parsed in parallel by a pool of processes. Each
+    parsed range is written into a work folder next to the output, so an interrupted conversion picks up
+    where it left off when it is run again with the same arguments. The work folder is discarded if the input
+    file or the chunk size has changed since.
+
+    To use the result with Electric Brain, write the store to data/english_word_vectors_tensorflow.vectors
+
+        python3 scripts/convert_glove_word_vectors.py glove.42B.300d.txt data/english_word_vectors_tensorflow.vectors
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib', 'python'))
+from word_vectors import EBWordVectorStoreWriter
+
+
+def findChunks(filename, chunkSize):
+    """ Splits the file into byte ranges of roughly chunkSize bytes, each ending on a line boundary """
+    fileSize = os.path.getsize(filename)
+    chunks = []
+    with open(filename, 'rb') as file:
+        start = 0
+        while start < fileSize:
+            file.seek(min(start + chunkSize, fileSize))
+            file.readline()
+            end = min(file.tell(), fileSize)
+            chunks.append((start, end))
+            start = end
+    return chunks
+
+
+def detectDimensions(filename):
+    with open(filename, 'rb') as file:
+        return len(file.readline().rstrip().split(b' ')) - 1
+
+
+def chunkPaths(workFolder, chunkIndex):
+    base = os.path.join(workFolder, "chunk-%06d" % chunkIndex)
+    return base + ".npy", base + ".words"
+
+
+def prepareWorkFolder(workFolder, filename, chunks, dimensions):
+    """ Creates the work folder, or reuses the one left by a previous run when it was for the same input file,
+        split into the same chunks. Otherwise its chunks would be stale, so it is cleared out. """
+    stat = os.stat(filename)
+    manifest = {
+        "input": os.path.abspath(filename),
+        "size": stat.st_size,
+        "modified": stat.st_mtime_ns,
+        "dimensions": dimensions,
+        "chunks": [list(chunk) for chunk in chunks]
+    }
+
+    manifestPath = os.path.join(workFolder, "manifest.json")
+    if os.path.exists(workFolder):
+        previous = None
+        if os.path.exists(manifestPath):
+            with open(manifestPath, 'r') as file:
+                previous = json.load(file)
+        if previous == manifest:
+            return
+        print("Discarding the work folder " + workFolder + ", which was left by a run with a different input file or chunk size")
+        shutil.rmtree(workFolder)
+
+    os.makedirs(workFolder)
+    with open(manifestPath, 'w') as file:
+        json.dump(manifest, file)
+
+
+def parseChunk(arguments):
+    """ Parses one byte range of the text file, and writes its vectors and words into the work folder.
+        Returns the number of lines in the chunk. """
+    filename, workFolder, chunkIndex, start, end, dimensions = arguments
+    vectorsPath, wordsPath = chunkPaths(workFolder, chunkIndex)
+
+    with open(filename, 'rb') as file:
+        file.seek(start)
+        data = file.read(end - start)
+
+    lines = [line for line in data.split(b'\n') if line.strip()]
+
+    # Fast path - split the word off each line, and parse all the numbers in the chunk in one call
+    words = []
+    numbers = []
+    for line in lines:
+        word, separator, rest = line.partition(b' ')
+        words.append(word)
+        numbers.append(rest)
+    try:
+        vectors = numpy.fromstring(b' '.join(numbers), dtype = numpy.float32, sep = ' ')
+    except ValueError:
+        vectors = None
+
+    if vectors is None or vectors.size != len(lines) * dimensions:
+        # Some GloVe files contain words with spaces in them, so split those from the right instead
+        words = []
+        numbers = []
+        for line in lines:
+            parts = line.rstrip().rsplit(b' ', dimensions)
+            words.append(parts[0])
+            numbers.append(b' '.join(parts[1:]))
+        vectors = numpy.fromstring(b' '.join(numbers), dtype = numpy.float32, sep = ' ')
+
+    vectors = vectors.reshape([len(lines), dimensions])
+
+    # The words file is renamed into place last, so its existence marks the chunk as complete
+    numpy.save(vectorsPath + ".partial.npy", vectors)
+    os.rename(vectorsPath + ".partial.npy", vectorsPath)
+    with open(wordsPath + ".partial", 'wb') as file:
+        file.write(b'\n'.join(words))
+    os.rename(wordsPath + ".partial", wordsPath)
+
+    return len(lines)
+
+
+def readChunk(workFolder, chunkIndex):
+    vectorsPath, wordsPath = chunkPaths(workFolder, chunkIndex)
+    vectors = numpy.load(vectorsPath)
+    with open(wordsPath, 'rb') as file:
+        data = file.read()
+    words = [word.decode('utf-8', errors = 'replace') for word in data.split(b'\n')] if len(data) > 0 else []
+    return words, vectors
+
+
+def readFrequencyList(filename, limit):
+    """ Reads a list of words, one per line and most frequent first, into a dictionary of word to rank """
+    ranks = {}
+    with open(filename, 'r', encoding = 'utf-8', errors = 'replace') as file:
+        for line in file:
+            parts = line.split()
+            if len(parts) == 0 or parts[0] in ranks:
+                continue
+            ranks[parts[0]] = len(ranks)
+            if limit is not None and len(ranks) >= limit:
+                break
+    return ranks
+
+
+def assembleStore(output, workFolder, chunkCount, dimensions, frequencyRanks):
+    writer = EBWordVectorStoreWriter(output, dimensions)
+
+    if frequencyRanks is not None:
+        # Write the most frequent words first, in frequency order, so they are contiguous in memory
+        prefixWords = [None] * len(frequencyRanks)
+        prefixVectors = numpy.zeros([len(frequencyRanks), dimensions], dtype = numpy.float32)
+        for chunkIndex in range(chunkCount):
+            words, vectors = readChunk(workFolder, chunkIndex)
+            for index in range(len(words)):
+                rank = frequencyRanks.get(words[index])
+                if rank is not None and prefixWords[rank] is None:
+                    prefixWords[rank] = words[index]
+                    prefixVectors[rank] = vectors[index]
+
+        found = [rank for rank in range(len(prefixWords)) if prefixWords[rank] is not None]
+        writer.append([prefixWords[rank] for rank in found], prefixVectors[found])
+
+    for chunkIndex in range(chunkCount):
+        words, vectors = readChunk(workFolder, chunkIndex)
+        if frequencyRanks is not None:
+            keep = [index for index in range(len(words)) if words[index] not in frequencyRanks]
+            words = [words[index] for index in keep]
+            vectors = vectors[keep]
+        writer.append(words, vectors)
+
+    writer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Converts a GloVe text file into an Electric Brain word vector store.")
+    parser.add_argument("input", help = "The GloVe text file, e.g. glove.42B.300d.txt")
+    parser.add_argument("output", help = "The folder to write the word vector store to")
+    parser.add_argument("--processes", type = int, default = multiprocessing.cpu_count(), help = "The number of parser processes")
+    parser.add_argument("--chunk-size", type = int, default = 64, help = "The size of each byte range, in megabytes")
+    parser.add_argument("--frequency-list", default = None, help = "A file listing words most frequent first. Those words are written at the start of the store.")
+    parser.add_argument("--frequency-limit", type = int, default = None, help = "Only move this many words from the frequency list to the start of the store")
+    args = parser.parse_args()
+
+    if os.path.exists(os.path.join(args.output, "header.json")):
+        print("The word vector store " + args.output + " already exists")
+        return
+
+    dimensions = detectDimensions(args.input)
+    chunks = findChunks(args.input, args.chunk_size * 1024 * 1024)
+
+    workFolder = args.output + ".work"
+    prepareWorkFolder(workFolder, args.input, chunks, dimensions)
+
+    # Skip any chunks which were completed by a previous run
+    pending = []
+    for chunkIndex in range(len(chunks)):
+        if not os.path.exists(chunkPaths(workFolder, chunkIndex)[1]):
+            start, end = chunks[chunkIndex]
+            pending.append((args.input, workFolder, chunkIndex, start, end, dimensions))
+
+    print("Parsing " + str(len(pending)) + " of " + str(len(chunks)) + " chunks with " + str(dimensions) + " dimensions")
+
+    total = 0
+    startTime = time.time()
+    with multiprocessing.Pool(args.processes) as pool:
+        for lineCount in pool.imap_unordered(parseChunk, pending):
+            total += lineCount
+            elapsed = max(time.time() - startTime, 1e-6)
+            print("total " + str(total) + " lines, " + str(int(total / elapsed)) + " lines/sec")
+            sys.stdout.flush()
+
+    frequencyRanks = None
+    if args.frequency_list is not None:
+        frequencyRanks = readFrequencyList(args.frequency_list, args.frequency_limit)
+
+    print("Writing word vector store to " + args.output)
+    assembleStore(args.output, workFolder, len(chunks), dimensions, frequencyRanks)
+
+    shutil.rmtree(workFolder)
+
+
+if __name__ == "__main__":
+    main()
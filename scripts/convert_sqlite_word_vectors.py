@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+#
+# Electric Brain is an easy to use platform for machine learning.
+# Copyright (C) 2016 Electric Brain Software Corporation
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Converts a legacy sqlite word vector database into a word vector store, as read by lib/python/word_vectors.py.
+
+    This is run when the project is built, so that the model processes only ever open the converted store. By
+    default the store is written next to the database, named after it with a .vectors extension.
+
+        python3 scripts/convert_sqlite_word_vectors.py data/english_word_vectors_tensorflow.db
+"""
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib', 'python'))
+from word_vectors import convertSqliteDatabase, wordVectorStoreFolder
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Converts a sqlite word vector database into an Electric Brain word vector store.")
+    parser.add_argument("input", help = "The sqlite database, e.g. data/english_word_vectors_tensorflow.db")
+    parser.add_argument("output", nargs = "?", default = None, help = "The folder to write the word vector store to. Defaults to the database name with a .vectors extension")
+    args = parser.parse_args()
+
+    output = args.output or wordVectorStoreFolder(args.input)
+    if os.path.exists(os.path.join(output, "header.json")):
+        print("The word vector store " + output + " already exists")
+        return
+
+    print("Converting " + args.input + " into a word vector store at " + output)
+    convertSqliteDatabase(args.input, output)
+
+
+if __name__ == "__main__":
+    main()
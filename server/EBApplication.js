@@ -151,6 +151,12 @@ class EBApplication extends EBApplicationBase
                 default: '',
                 env: "MODEL_FOLDER"
             },
+            matchingTrainingReplicas: {
+                doc: "The number of processes used to train matching models. Each process trains on a share of every batch, and their gradients are averaged.",
+                format: "nat",
+                default: 1,
+                env: "MATCHING_TRAINING_REPLICAS"
+            },
             companyName: {
                 doc: "This config is used to specify what the company name is on the frontend. Used for white-labelling",
                 format: String,
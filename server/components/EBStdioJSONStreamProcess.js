@@ -20,7 +20,6 @@
 
 const
     childProcess = require('child_process'),
-    chunkingStreams = require('chunking-streams'),
     EventEmitter = require('events'),
     Promise = require('bluebird'),
     stream = require('stream'),
@@ -43,6 +42,8 @@ class EBStdioJSONStreamProcess extends EventEmitter
     {
         super();
         this.running = true;
+        this.protocol = 'json';
+        this.nextRequestId = 1;
     }
 
     /**
@@ -172,6 +173,217 @@ class EBStdioJSONStreamProcess extends EventEmitter
         });
     }
 
+    /**
+     * Sends a message to the sub-process tagged with a new request id, and waits for the response carrying the
+     * same id. The sub-process may handle tagged messages concurrently and respond to them out of order, so
+     * several requests can be in flight at once.
+     *
+     * @param {object} object The message to be sent to the sub-process. It is not modified.
+     * @return {Promise} Resolves with the response, or rejects if the sub-process responds with an error
+     */
+    request(object)
+    {
+        const self = this;
+        const requestId = self.nextRequestId;
+        self.nextRequestId += 1;
+
+        // Start waiting before writing, since the response may arrive before the write callback
+        const responsePromise = self.waitForMatchingOutput({requestId: requestId});
+        return self.write(underscore.extend({}, object, {requestId: requestId})).then(() => responsePromise).then((response) =>
+        {
+            if (response.type === 'error')
+            {
+                throw new Error(`Error from sub-process while handling "${object.type}": ${response.message}`);
+            }
+            return response;
+        });
+    }
+
+    /**
+     * Encodes a message into a binary frame. A frame starts with the marker "EBF1", followed by the
+     * length of a JSON header and the length of a payload, both as 32 bit little endian integers.
+     * Any typed arrays within the message are moved into the payload, and are replaced within the
+     * header by an object of the form {"$tensor": {dtype, shape, offset, length}}
+     *
+     * @param {object} message The message to be encoded
+     * @return {Buffer} The encoded frame
+     */
+    static encodeFrame(message)
+    {
+        const buffers = [];
+        let payloadLength = 0;
+
+        const encodeValue = (value) =>
+        {
+            // Values such as dates, ObjectIDs and Buffers are converted the same way JSON.stringify would convert them
+            if (value !== null && typeof value === 'object' && typeof value.toJSON === 'function')
+            {
+                return encodeValue(value.toJSON());
+            }
+            else if (ArrayBuffer.isView(value) && EBStdioJSONStreamProcess.typedArrayDTypes[value.constructor.name])
+            {
+                // Keep tensors aligned so that they can be viewed directly on the other side
+                const padding = (8 - (payloadLength % 8)) % 8;
+                if (padding > 0)
+                {
+                    buffers.push(Buffer.alloc(padding));
+                    payloadLength += padding;
+                }
+                const offset = payloadLength;
+                buffers.push(Buffer.from(value.buffer, value.byteOffset, value.byteLength));
+                payloadLength += value.byteLength;
+                return {"$tensor": {
+                    dtype: EBStdioJSONStreamProcess.typedArrayDTypes[value.constructor.name],
+                    shape: [value.length],
+                    offset: offset,
+                    length: value.byteLength
+                }};
+            }
+            else if (Array.isArray(value))
+            {
+                return value.map(encodeValue);
+            }
+            else if (value !== null && typeof value === 'object')
+            {
+                return underscore.mapObject(value, encodeValue);
+            }
+            return value;
+        };
+
+        const header = Buffer.from(JSON.stringify(encodeValue(message)));
+        const prefix = Buffer.alloc(12);
+        prefix.write("EBF1", 0, 4, 'ascii');
+        prefix.writeUInt32LE(header.length, 4);
+        prefix.writeUInt32LE(payloadLength, 8);
+        return Buffer.concat([prefix, header].concat(buffers));
+    }
+
+    /**
+     * Returns the total length in bytes of the binary frame starting at the beginning of the given buffer,
+     * as declared by its prefix.
+     *
+     * @param {Buffer} buffer The bytes received so far
+     * @return {number} The length of the frame, or null if the buffer does not yet hold the whole 12 byte prefix
+     */
+    static frameLength(buffer)
+    {
+        if (buffer.length < 12)
+        {
+            return null;
+        }
+
+        if (buffer.toString('ascii', 0, 4) !== "EBF1")
+        {
+            throw new Error("Received a malformed frame from the sub-process.");
+        }
+
+        return 12 + buffer.readUInt32LE(4) + buffer.readUInt32LE(8);
+    }
+
+    /**
+     * Decodes a single binary frame from the start of the given buffer. Tensors within the frame
+     * are decoded as typed arrays, or as arrays of typed arrays for tensors with more than one dimension.
+     *
+     * @param {Buffer} buffer The bytes received so far
+     * @return {object} Null if the buffer does not yet contain a whole frame, otherwise an object with the decoded message and the length of the frame in bytes
+     */
+    static decodeFrame(buffer)
+    {
+        const frameLength = EBStdioJSONStreamProcess.frameLength(buffer);
+        if (frameLength === null || buffer.length < frameLength)
+        {
+            return null;
+        }
+
+        const headerLength = buffer.readUInt32LE(4);
+        const payloadLength = buffer.readUInt32LE(8);
+
+        const header = JSON.parse(buffer.toString('utf8', 12, 12 + headerLength));
+
+        // Copy the payload into its own memory, so that typed arrays can be aligned within it
+        const payload = new Uint8Array(payloadLength);
+        buffer.copy(Buffer.from(payload.buffer), 0, 12 + headerLength, frameLength);
+
+        const decodeTensor = (tensor) =>
+        {
+            const dtypes = {
+                float32: Float32Array,
+                float64: Float64Array,
+                int8: Int8Array,
+                int16: Int16Array,
+                int32: Int32Array,
+                uint8: Uint8Array,
+                uint16: Uint16Array,
+                uint32: Uint32Array,
+                bool: Uint8Array
+            };
+
+            let flat = null;
+            if (tensor.dtype === 'int64' || tensor.dtype === 'uint64')
+            {
+                // There is no 64 bit typed array that all supported versions of Node have, so use plain numbers instead
+                const view = new DataView(payload.buffer, tensor.offset, tensor.length);
+                flat = [];
+                for (let index = 0; index < tensor.length / 8; index += 1)
+                {
+                    const high = tensor.dtype === 'int64' ? view.getInt32(index * 8 + 4, true) : view.getUint32(index * 8 + 4, true);
+                    flat.push(high * 4294967296 + view.getUint32(index * 8, true));
+                }
+            }
+            else
+            {
+                const TypedArray = dtypes[tensor.dtype];
+                if (!TypedArray)
+                {
+                    throw new Error(`Received a tensor with an unsupported dtype: ${tensor.dtype}`);
+                }
+                flat = new TypedArray(payload.buffer, tensor.offset, tensor.length / TypedArray.BYTES_PER_ELEMENT);
+            }
+
+            // Split multi-dimensional tensors into nested arrays, with each row being a view on the data
+            const split = (start, dimension) =>
+            {
+                if (dimension === tensor.shape.length - 1 || tensor.shape.length === 0)
+                {
+                    const length = tensor.shape.length === 0 ? 1 : tensor.shape[dimension];
+                    return flat.subarray ? flat.subarray(start, start + length) : flat.slice(start, start + length);
+                }
+
+                const stride = tensor.shape.slice(dimension + 1).reduce((product, size) => product * size, 1);
+                const rows = [];
+                for (let index = 0; index < tensor.shape[dimension]; index += 1)
+                {
+                    rows.push(split(start + index * stride, dimension + 1));
+                }
+                return rows;
+            };
+
+            return split(0, 0);
+        };
+
+        const decodeValue = (value) =>
+        {
+            if (Array.isArray(value))
+            {
+                return value.map(decodeValue);
+            }
+            else if (value !== null && typeof value === 'object')
+            {
+                if (value.$tensor && Object.keys(value).length === 1)
+                {
+                    return decodeTensor(value.$tensor);
+                }
+                return underscore.mapObject(value, decodeValue);
+            }
+            return value;
+        };
+
+        return {
+            message: decodeValue(header),
+            length: frameLength
+        };
+    }
+
     /**
      * Starts up the sub process. This takes the same arguments as the NodeJS native
      * child_process.spawn. See https://nodejs.org/dist/latest/docs/api/child_process.html
@@ -195,42 +407,123 @@ class EBStdioJSONStreamProcess extends EventEmitter
                 objectMode: true,
                 transform: function(chunk, encoding, next)
                 {
-                    this.push(`${JSON.stringify(chunk)}\n`);
+                    if (jsonStreamProcess.protocol === 'binary')
+                    {
+                        this.push(EBStdioJSONStreamProcess.encodeFrame(chunk));
+                    }
+                    else
+                    {
+                        this.push(`${JSON.stringify(chunk)}\n`);
+                    }
                     return next();
                 }
             });
 
             jsonStreamProcess.input.pipe(jsonStreamProcess.process.stdin);
 
+            // Bytes received from the sub-process which have not yet formed a complete message. They are kept as
+            // a list of chunks, and only joined once a whole message has arrived, so that a large frame is not
+            // copied again every time another piece of it arrives.
+            let pendingChunks = [];
+            let pendingLength = 0;
+
+            // How far into the pending bytes has already been searched for a newline
+            let scannedLength = 0;
+
+            const takePending = (length) =>
+            {
+                const joined = pendingChunks.length === 1 ? pendingChunks[0] : Buffer.concat(pendingChunks, pendingLength);
+                const rest = joined.slice(length);
+                pendingChunks = rest.length > 0 ? [rest] : [];
+                pendingLength = rest.length;
+                scannedLength = 0;
+                return joined.slice(0, length);
+            };
+
+            const findNewline = () =>
+            {
+                let chunkStart = 0;
+                for (const chunk of pendingChunks)
+                {
+                    if (chunkStart + chunk.length > scannedLength)
+                    {
+                        const index = chunk.indexOf(10, Math.max(scannedLength - chunkStart, 0));
+                        if (index !== -1)
+                        {
+                            return chunkStart + index;
+                        }
+                    }
+                    chunkStart += chunk.length;
+                }
+                scannedLength = pendingLength;
+                return -1;
+            };
 
             jsonStreamProcess.output = new stream.Transform({
                 objectMode: true,
                 transform: function(chunk, encoding, next)
                 {
-                    // Take its output and interpret it as a JSON object
-                    try
-                    {
-                        this.push(JSON.parse(chunk.toString()));
-                        return next();
-                    }
-                    catch (err)
+                    pendingChunks.push(chunk);
+                    pendingLength += chunk.length;
+
+                    while (true)
                     {
-                        console.error(`error`, `Error from sub-process "${command} ${args.join(' ')}". Output is not valid JSON: ${chunk}`);
-                        console.error(err);
-                        return next();
+                        if (jsonStreamProcess.protocol === 'binary')
+                        {
+                            if (pendingLength < 12)
+                            {
+                                break;
+                            }
+
+                            // The prefix declares the length of the frame, so nothing is joined until all of it is here
+                            if (pendingChunks[0].length < 12)
+                            {
+                                pendingChunks = [Buffer.concat(pendingChunks, pendingLength)];
+                            }
+                            const frameLength = EBStdioJSONStreamProcess.frameLength(pendingChunks[0]);
+                            if (pendingLength < frameLength)
+                            {
+                                break;
+                            }
+                            this.push(EBStdioJSONStreamProcess.decodeFrame(takePending(frameLength)).message);
+                        }
+                        else
+                        {
+                            // Each line contains a single JSON object
+                            const newline = findNewline();
+                            if (newline === -1)
+                            {
+                                break;
+                            }
+                            const line = takePending(newline + 1).slice(0, newline);
+
+                            let message = null;
+                            try
+                            {
+                                message = JSON.parse(line.toString());
+                            }
+                            catch (err)
+                            {
+                                console.error(`error`, `Error from sub-process "${command} ${args.join(' ')}". Output is not valid JSON: ${line}`);
+                                console.error(err);
+                                continue;
+                            }
+
+                            // The sub-process switches protocols straight after responding to a handshake
+                            if (message.type === 'handshake' && message.protocol)
+                            {
+                                jsonStreamProcess.protocol = message.protocol;
+                            }
+
+                            this.push(message);
+                        }
                     }
-                }
-            });
 
-            // Create a new chunker on the standard output to chunk it into single lines, each line containing a JSON object.
-            const lineChunker = new chunkingStreams.LineCounter({
-                numLines: 1,
-                flushTail: false
+                    return next();
+                }
             });
 
-            // Pipe the output through the chunker into the output stream which decodes it as JSON
-            jsonStreamProcess.process.stdout.pipe(lineChunker);
-            lineChunker.pipe(jsonStreamProcess.output);
+            jsonStreamProcess.process.stdout.pipe(jsonStreamProcess.output);
 
             jsonStreamProcess.process.stderr.on('data', (data) =>
             {
@@ -289,4 +582,18 @@ class EBStdioJSONStreamProcess extends EventEmitter
 
 }
 
+/**
+ * The dtype names used within binary frames, for each of the typed arrays that can be sent
+ */
+EBStdioJSONStreamProcess.typedArrayDTypes = {
+    Float32Array: 'float32',
+    Float64Array: 'float64',
+    Int8Array: 'int8',
+    Int16Array: 'int16',
+    Int32Array: 'int32',
+    Uint8Array: 'uint8',
+    Uint16Array: 'uint16',
+    Uint32Array: 'uint32'
+};
+
 module.exports = EBStdioJSONStreamProcess;
@@ -24,6 +24,7 @@ const
     EBStdioJSONStreamProcess = require("../EBStdioJSONStreamProcess"),
     fs = require('fs'),
     math = require("mathjs"),
+    os = require('os'),
     path = require('path'),
     Promise = require('bluebird'),
     temp = require('temp'),
@@ -54,6 +55,135 @@ class EBModelProcessBase
         self.testingSet = {};
         self.numProcesses = 1;
         self.running = false;
+
+        // Whether to offer the binary framed protocol to the sub-processes during the handshake.
+        // Batches of tensors are then transferred as raw little-endian data rather than as JSON.
+        self.useBinaryProtocol = false;
+
+        // The maximum number of bytes that unreleased batches may hold in the shared batch pool
+        self.batchPoolBytes = 1024 * 1024 * 1024;
+
+        // The folder holding the batch pool for this group of processes. It is created when the processes
+        // start and removed when they are killed, so that the pool limit only counts batches from this group.
+        self.batchPoolFolder = null;
+        self.batchPoolExitHandler = null;
+
+        // The number of bytes of read batches each process may keep, so that the batches a trainSteps message cycles through are not read again
+        self.batchCacheBytes = 512 * 1024 * 1024;
+
+        // The number of versioned checkpoints each process keeps in its checkpoints folder, before deleting the oldest
+        self.checkpointsToKeep = 5;
+
+        // Whether training steps should write TensorBoard summaries into the logs folder of each process
+        self.writeSummaries = false;
+
+        // Limits on the threads and cores used by each process, so that several models can share a machine.
+        // An object with any of intraOpThreads, interOpThreads, cpuAffinity (a list of cores) and allowGrowth.
+        self.resourceProfile = null;
+
+        // The configuration each process reports that it is actually running with
+        self.effectiveResources = [];
+    }
+
+    /**
+     * Returns the folder that batch pools are created within. This is shared memory when it is available.
+     *
+     * @returns {string} The folder
+     */
+    static batchPoolRoot()
+    {
+        return fs.existsSync('/dev/shm') ? '/dev/shm' : os.tmpdir();
+    }
+
+    /**
+     * Deletes a batch pool folder along with any batches left inside it.
+     *
+     * @param {string} folder The batch pool folder
+     */
+    static removeBatchPool(folder)
+    {
+        try
+        {
+            fs.readdirSync(folder).forEach((fileName) =>
+            {
+                fs.unlinkSync(path.join(folder, fileName));
+            });
+            fs.rmdirSync(folder);
+        }
+        catch (err)
+        {
+            // The folder may already have been removed by another process
+        }
+    }
+
+    /**
+     * Removes the batch pools left behind by processes which have since died, so that their
+     * batches do not hold on to shared memory.
+     */
+    static purgeStaleBatchPools()
+    {
+        const root = EBModelProcessBase.batchPoolRoot();
+        fs.readdirSync(root).forEach((fileName) =>
+        {
+            const match = /^electric-brain-batches-(\d+)-/.exec(fileName);
+            if (!match)
+            {
+                return;
+            }
+
+            try
+            {
+                // Signal 0 only checks whether the process that created the pool is still alive
+                process.kill(Number(match[1]), 0);
+            }
+            catch (err)
+            {
+                if (err.code === 'ESRCH')
+                {
+                    EBModelProcessBase.removeBatchPool(path.join(root, fileName));
+                }
+            }
+        });
+    }
+
+    /**
+     * Creates the batch pool folder for this group of processes, if it has not been created already.
+     *
+     * @returns {string} The batch pool folder
+     */
+    createBatchPool()
+    {
+        const self = this;
+        if (!self.batchPoolFolder)
+        {
+            EBModelProcessBase.purgeStaleBatchPools();
+
+            self.batchPoolFolder = temp.mkdirSync({
+                dir: EBModelProcessBase.batchPoolRoot(),
+                prefix: `electric-brain-batches-${process.pid}-`
+            });
+
+            // Make sure the batches are not left behind if this process exits without killing the sub-processes
+            const batchPoolFolder = self.batchPoolFolder;
+            self.batchPoolExitHandler = () => EBModelProcessBase.removeBatchPool(batchPoolFolder);
+            process.once('exit', self.batchPoolExitHandler);
+        }
+        return self.batchPoolFolder;
+    }
+
+    /**
+     * Returns a new file name for a prepared batch, within the batch pool of this group of processes.
+     * The sub-processes use the folder of each batch to cap the memory used by the pool.
+     *
+     * @returns {string} The file name, which is used as the handle for the batch
+     */
+    createBatchFileName()
+    {
+        return temp.path({
+            dir: this.createBatchPool(),
+            prefix: 'electric-brain-batch-',
+            suffix: '.batch'
+        });
     }
     
     /**
@@ -214,8 +344,17 @@ class EBModelProcessBase
                 {
                     const writeAndWaitPromise = Promise.each(self.processes, (process) =>
                     {
-                        // Now we handshake with the process and get version / name information
-                        return process.writeAndWaitForMatchingOutput({type: "handshake"}, {"type": "handshake"});
+                        // Now we handshake with the process and get version / name information. The process
+                        // switches to the binary protocol after its response, if we offer it.
+                        const protocols = self.useBinaryProtocol ? ["json", "binary"] : ["json"];
+                        return process.writeAndWaitForMatchingOutput({
+                            type: "handshake",
+                            protocols: protocols,
+                            batchPoolBytes: self.batchPoolBytes,
+                            batchPoolFolder: self.createBatchPool(),
+                            batchCacheBytes: self.batchCacheBytes,
+                            checkpointsToKeep: self.checkpointsToKeep
+                        }, {"type": "handshake"});
                     });
                     writeAndWaitPromise.then(() => next(), (err) => next(err));
                 },
@@ -252,7 +391,19 @@ class EBModelProcessBase
         {
             return process.process.kill();
         });
-        return writeAndWaitPromise;
+        return writeAndWaitPromise.then(() =>
+        {
+            if (self.batchPoolFolder)
+            {
+                EBModelProcessBase.removeBatchPool(self.batchPoolFolder);
+                self.batchPoolFolder = null;
+            }
+            if (self.batchPoolExitHandler)
+            {
+                process.removeListener('exit', self.batchPoolExitHandler);
+                self.batchPoolExitHandler = null;
+            }
+        });
     }
 
 
@@ -270,17 +421,24 @@ class EBModelProcessBase
     {
         const self = this;
 
-        const writeAndWaitPromise = Promise.each(self.processes, (process) =>
+        // The processes are reset at the same time, since training replicas exchange their initial weights while resetting
+        const writeAndWaitPromise = Promise.map(self.processes, (process) =>
             {
                 return process.writeAndWaitForMatchingOutput({
                     type: "reset",
                     initializationRangeBottom: initializationRangeBottom,
                     initializationRangeTop: initializationRangeTop,
                     optimizationAlgorithm: optimizationAlgorithm,
-                    optimizationParameters: optimizationParameters
+                    optimizationParameters: optimizationParameters,
+                    resources: self.resourceProfile || undefined,
+                    summaries: self.writeSummaries
                 }, {type: "resetCompleted"});
             });
-        return writeAndWaitPromise;
+        return writeAndWaitPromise.then((responses) =>
+        {
+            self.effectiveResources = responses.map((response) => response.resources);
+            return responses;
+        });
     }
 
     /**
@@ -313,6 +471,20 @@ class EBModelProcessBase
         });
     }
     
+    /**
+     * This gets the statistics for the batch cache in each process, such as the number of hits and misses
+     *
+     * @return {Promise} A promise that will resolve to a list with the cache statistics object from each process
+     */
+    getBatchCacheStatistics()
+    {
+        const self = this;
+        return Promise.map(self.processes, (process) =>
+        {
+            return process.writeAndWaitForMatchingOutput({type: "batchCacheStats"}, {type: "batchCacheStats"}).then((response) => response.stats);
+        });
+    }
+
     /**
      * This function retrieves the diagrams that are generated by tensorflow.
      *
@@ -388,7 +560,7 @@ class EBModelProcessBase
             const promise = self.processes[0].writeAndWaitForMatchingOutput(message, {type: "saved"});
             promise.then((response) =>
             {
-                const stream = fs.createReadStream(path.join(self.scriptFolder, 'model.tfg'));
+                const stream = fs.createReadStream(response.fileName || path.join(self.scriptFolder, 'model.tfg'));
 
                 return callback(null, stream);
             }, (err) => callback(err));
@@ -413,6 +585,76 @@ class EBModelProcessBase
         });
         return writeAndWaitPromise;
     }
+
+
+    /**
+     * This method snapshots the model into a new versioned checkpoint. The checkpoint is written
+     * in the background, so training can carry on straight away.
+     *
+     * @return {Promise} A promise that will resolve to the version number of the checkpoint
+     */
+    saveCheckpoint()
+    {
+        const message = {type: "save", wait: false};
+        return this.processes[0].writeAndWaitForMatchingOutput(message, {type: "saved"}).then((response) => response.version);
+    }
+
+
+    /**
+     * This method restores every process from one of the versioned checkpoints
+     *
+     * @param {number} version The version number of the checkpoint to restore
+     * @return {Promise} A promise that will resolve when the checkpoint has been loaded
+     */
+    loadCheckpoint(version)
+    {
+        const self = this;
+        const message = {
+            type: "load",
+            version: version
+        };
+        return Promise.each(self.processes, (process) =>
+        {
+            return process.writeAndWaitForMatchingOutput(message, {type: "loaded"});
+        });
+    }
+
+
+    /**
+     * This method exports a frozen, inference-only copy of the model. Variables are folded into
+     * constants, dropout is switched off, and the optimizer and summaries are left behind.
+     *
+     * @param {string} fileName The file to write the frozen graph into
+     * @return {Promise} A promise that will resolve when the file has been written
+     */
+    exportInferenceGraph(fileName)
+    {
+        const message = {
+            type: "exportInference",
+            fileName: fileName
+        };
+        return this.processes[0].writeAndWaitForMatchingOutput(message, {type: "inferenceExported"});
+    }
+
+
+    /**
+     * This method has every process serve evaluations from a frozen graph written by exportInferenceGraph
+     *
+     * @param {string} fileName The file holding the frozen graph
+     * @return {Promise} A promise that will resolve when the graph has been loaded
+     */
+    loadInferenceGraph(fileName)
+    {
+        const self = this;
+        const message = {
+            type: "loadInference",
+            fileName: fileName
+        };
+        return Promise.each(self.processes, (process) =>
+        {
+            return process.writeAndWaitForMatchingOutput(message, {type: "inferenceLoaded"});
+        });
+    }
 }
 
 module.exports = EBModelProcessBase;
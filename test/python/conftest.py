@@ -0,0 +1,30 @@
+#
+# Electric Brain is an easy to use platform for machine learning.
+# Copyright (C) 2016 Electric Brain Software Corporation
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# The python modules import each other by their bare names, since they are copied into a single folder
+# when the model scripts are generated. The tests put the same folders onto the path.
+
+import os
+import sys
+
+root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+sys.path.insert(0, os.path.join(root, "lib", "python"))
+sys.path.insert(0, os.path.join(root, "scripts"))
+for plugin in sorted(os.listdir(os.path.join(root, "plugins"))):
+    serverFolder = os.path.join(root, "plugins", plugin, "server")
+    if os.path.isdir(serverFolder):
+        sys.path.append(serverFolder)
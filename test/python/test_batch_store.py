@@ -0,0 +1,180 @@
+#
+# Electric Brain is an easy to use platform for machine learning.
+# Copyright (C) 2016 Electric Brain Software Corporation
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import numpy
+import pytest
+from batch_store import EBBatchPool, EBBatchCache, layoutSegment, writeSegment, readSegment, segmentAlignment
+
+
+def testSegmentRoundTrip(tmpdir):
+    arrays = {
+        "values": numpy.arange(30, dtype = numpy.float32).reshape([5, 6]),
+        "ids": numpy.array([3, 1, 2], dtype = numpy.int64),
+        "words": numpy.array(["a", "bc", "def"]),
+        "scalar": numpy.float64(2.5),
+        "empty": numpy.zeros([0, 4], dtype = numpy.int32)
+    }
+    fileName = str(tmpdir.join("batch"))
+    layout = layoutSegment(arrays)
+    writeSegment(fileName, layout)
+
+    assert os.path.getsize(fileName) == layout["size"]
+    assert not os.path.exists(fileName + ".partial")
+
+    result = readSegment(fileName)
+    assert sorted(result.keys()) == sorted(arrays.keys())
+    for key in arrays:
+        assert result[key].dtype == numpy.asarray(arrays[key]).dtype
+        assert result[key].shape == numpy.shape(arrays[key])
+        assert numpy.array_equal(result[key], arrays[key])
+
+
+def testSegmentArraysAreAligned():
+    layout = layoutSegment({"a": numpy.zeros([3], dtype = numpy.int8), "b": numpy.zeros([7], dtype = numpy.float32)})
+    assert layout["start"] % segmentAlignment == 0
+    assert all(descriptor["offset"] % segmentAlignment == 0 for descriptor in layout["descriptors"].values())
+
+
+def testSegmentArraysAreReadOnly(tmpdir):
+    fileName = str(tmpdir.join("batch"))
+    writeSegment(fileName, layoutSegment({"values": numpy.ones([4])}))
+    with pytest.raises(ValueError):
+        readSegment(fileName)["values"][0] = 5
+
+
+def testReadingAnotherFormatReturnsNone(tmpdir):
+    fileName = str(tmpdir.join("batch.npz"))
+    with open(fileName, 'wb') as file:
+        numpy.savez(file, values = numpy.ones([3]))
+    assert readSegment(fileName) is None
+
+
+def testObjectArraysAreRejected():
+    with pytest.raises(Exception, match = "dtype"):
+        layoutSegment({"values": numpy.array([{}, None], dtype = object)})
+
+
+def testPoolWriteReadRelease(tmpdir):
+    pool = EBBatchPool(str(tmpdir))
+    handle = pool.write({"values": numpy.arange(100, dtype = numpy.int32)})
+
+    assert os.path.dirname(handle) == str(tmpdir)
+    assert pool.usage() == os.path.getsize(handle)
+    assert numpy.array_equal(pool.read(handle)["values"], numpy.arange(100))
+
+    pool.release(handle)
+    pool.release(handle)
+    assert pool.usage() == 0
+
+
+def testPoolReadsOlderNpzBatches(tmpdir):
+    handle = str(tmpdir.join("old.batch"))
+    with open(handle, 'wb') as file:
+        numpy.savez(file, values = numpy.arange(3))
+    assert numpy.array_equal(EBBatchPool(str(tmpdir)).read(handle)["values"], [0, 1, 2])
+
+
+def testPoolOnlyCountsTheFolderOfTheBatch(tmpdir):
+    ours = tmpdir.mkdir("ours")
+    theirs = tmpdir.mkdir("theirs")
+    EBBatchPool(str(theirs)).write({"values": numpy.zeros([10000], dtype = numpy.float64)})
+
+    # The batches in the other folder do not count towards this pool, so the write does not wait
+    pool = EBBatchPool(str(ours), maxBytes = 20000, waitTimeout = 0)
+    handle = pool.write({"values": numpy.zeros([100])}, str(ours.join("electric-brain-batch-1.batch")))
+    assert pool.usage() == os.path.getsize(handle)
+
+
+def testPoolWaitsForSpace(tmpdir):
+    pool = EBBatchPool(str(tmpdir), maxBytes = 10000, waitTimeout = 0.1)
+    pool.write({"values": numpy.zeros([1000], dtype = numpy.float64)})
+
+    with pytest.raises(Exception, match = "Timed out"):
+        pool.write({"values": numpy.zeros([1000], dtype = numpy.float64)})
+
+
+def testPoolAllowsAnOversizedBatchWhenEmpty(tmpdir):
+    pool = EBBatchPool(str(tmpdir), maxBytes = 100, waitTimeout = 0)
+    handle = pool.write({"values": numpy.zeros([1000])})
+    assert os.path.exists(handle)
+
+
+def testPoolDoesNotWaitOnBatchesTheCallerHolds(tmpdir):
+    pool = EBBatchPool(str(tmpdir), maxBytes = 10000, waitTimeout = 0)
+    heldBytes = 0
+    for index in range(3):
+        handle = pool.write({"values": numpy.zeros([1000], dtype = numpy.float64)}, None, heldBytes)
+        heldBytes += os.path.getsize(handle)
+    assert pool.usage() == heldBytes
+
+    with pytest.raises(Exception, match = "Timed out"):
+        pool.write({"values": numpy.zeros([1000], dtype = numpy.float64)})
+
+
+def testCacheHitsWhenABatchIsRevisited(tmpdir):
+    pool = EBBatchPool(str(tmpdir))
+    cache = EBBatchCache()
+    handle = pool.write({"values": numpy.arange(10)})
+
+    first = cache.get(handle, pool.read)
+    second = cache.get(handle, pool.read)
+    assert first is second
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+    assert cache.stats()["bytes"] == first["values"].nbytes
+
+
+def testCacheRereadsARewrittenBatch(tmpdir):
+    pool = EBBatchPool(str(tmpdir))
+    cache = EBBatchCache()
+    handle = pool.write({"values": numpy.zeros([3])})
+    cache.get(handle, pool.read)
+
+    pool.write({"values": numpy.ones([3])}, handle)
+    os.utime(handle, ns = (0, 1))
+    assert numpy.array_equal(cache.get(handle, pool.read)["values"], numpy.ones([3]))
+    assert cache.stats()["entries"] == 1
+
+
+def testCacheEvictsTheLargestOfTheOldest(tmpdir):
+    pool = EBBatchPool(str(tmpdir))
+    cache = EBBatchCache(maxBytes = 900, evictionWindow = 2)
+    small = pool.write({"values": numpy.zeros([10])})
+    large = pool.write({"values": numpy.zeros([100])})
+    newest = pool.write({"values": numpy.zeros([10])})
+    for handle in [small, large, newest]:
+        cache.get(handle, pool.read)
+
+    assert cache.stats()["evictions"] == 1
+    assert sorted(key[0] for key in cache.entries) == sorted([small, newest])
+
+
+def testCacheDropsReleasedAndDeletedBatches(tmpdir):
+    pool = EBBatchPool(str(tmpdir))
+    cache = EBBatchCache()
+    released = pool.write({"values": numpy.zeros([10])})
+    deleted = pool.write({"values": numpy.zeros([10])})
+    cache.get(released, pool.read)
+    cache.get(deleted, pool.read)
+
+    cache.discard(released)
+    os.unlink(deleted)
+    cache.prune()
+    assert cache.stats()["entries"] == 0
+    assert cache.stats()["bytes"] == 0
@@ -0,0 +1,52 @@
+#
+# Electric Brain is an easy to use platform for machine learning.
+# Copyright (C) 2016 Electric Brain Software Corporation
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import numpy
+from bucketing import bucketSamples, quantileBoundaries, paddingEfficiency
+
+
+def testEverySampleIsBatchedOnce():
+    lengths = numpy.random.RandomState(0).randint(1, 100, size = 1000)
+    batches = bucketSamples(lengths, 32)
+
+    indexes = sorted(index for batch in batches for index in batch)
+    assert indexes == list(range(1000))
+    assert all(len(batch) <= 32 for batch in batches)
+
+
+def testBatchesFollowTheGivenBoundaries():
+    lengths = [1, 50, 2, 49, 3, 10, 11]
+    batches = bucketSamples(lengths, 10, bucketBoundaries = [5, 20])
+
+    assert batches == [[0, 2, 4], [5, 6], [3, 1]]
+
+
+def testBatchesAreSortedByLength():
+    lengths = [5, 3, 4, 1, 2]
+    assert bucketSamples(lengths, 2, bucketBoundaries = []) == [[3, 4], [1, 2], [0]]
+
+
+def testQuantileBoundaries():
+    assert quantileBoundaries([], 4) == []
+    assert quantileBoundaries([1, 2, 3], 1) == []
+    assert quantileBoundaries(list(range(1, 101)), 4) == [26, 51, 76]
+
+
+def testPaddingEfficiency():
+    assert paddingEfficiency([]) == 1.0
+    assert paddingEfficiency([0, 0]) == 1.0
+    assert paddingEfficiency([2, 4]) == 0.75
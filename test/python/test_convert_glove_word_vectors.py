@@ -0,0 +1,107 @@
+#
+# Electric Brain is an easy to use platform for machine learning.
+# Copyright (C) 2016 Electric Brain Software Corporation
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+import numpy
+import convert_glove_word_vectors as convert
+from word_vectors import EBWordVectorStore
+
+
+def writeGlove(path, entries):
+    with open(path, 'wb') as file:
+        for word, vector in entries:
+            file.write(word.encode('utf-8') + b' ' + b' '.join(("%g" % value).encode('ascii') for value in vector) + b'\n')
+
+
+def gloveEntries(count, dimensions = 3):
+    return [("word" + str(index), [index + offset / 10.0 for offset in range(dimensions)]) for index in range(count)]
+
+
+def runConverter(monkeypatch, arguments):
+    monkeypatch.setattr(sys, "argv", ["convert_glove_word_vectors.py"] + arguments)
+    convert.main()
+
+
+def testFindChunksEndOnLineBoundaries(tmpdir):
+    path = str(tmpdir.join("glove.txt"))
+    writeGlove(path, gloveEntries(100))
+    with open(path, 'rb') as file:
+        data = file.read()
+
+    chunks = convert.findChunks(path, 64)
+    assert chunks[0][0] == 0
+    assert chunks[-1][1] == len(data)
+    for index in range(len(chunks)):
+        start, end = chunks[index]
+        assert data[end - 1:end] == b'\n'
+        if index > 0:
+            assert start == chunks[index - 1][1]
+
+
+def testParseChunkHandlesWordsWithSpaces(tmpdir):
+    path = str(tmpdir.join("glove.txt"))
+    writeGlove(path, [("new york", [1, 2]), ("cat", [3, 4])])
+    workFolder = str(tmpdir.join("work"))
+    os.makedirs(workFolder)
+
+    assert convert.parseChunk((path, workFolder, 0, 0, os.path.getsize(path), 2)) == 2
+    words, vectors = convert.readChunk(workFolder, 0)
+    assert words == ["new york", "cat"]
+    numpy.testing.assert_array_equal(vectors, [[1, 2], [3, 4]])
+
+
+def testConvertsWithFrequencyOrder(tmpdir, monkeypatch):
+    entries = gloveEntries(50)
+    path = str(tmpdir.join("glove.txt"))
+    writeGlove(path, entries)
+    frequencyPath = str(tmpdir.join("frequency.txt"))
+    with open(frequencyPath, 'w') as file:
+        file.write("word42\nunknown\nword7\n")
+
+    output = str(tmpdir.join("store"))
+    runConverter(monkeypatch, [path, output, "--processes", "2", "--frequency-list", frequencyPath])
+
+    store = EBWordVectorStore(output)
+    assert store.count == 50
+    assert [store.word(0), store.word(1)] == ["word42", "word7"]
+    for word, vector in entries:
+        numpy.testing.assert_allclose(store.vector(word), vector, rtol = 1e-6)
+    assert not os.path.exists(output + ".work")
+
+
+def testDiscardsWorkFolderFromDifferentChunks(tmpdir):
+    path = str(tmpdir.join("glove.txt"))
+    writeGlove(path, gloveEntries(100))
+    workFolder = str(tmpdir.join("store.work"))
+
+    chunks = convert.findChunks(path, 64)
+    convert.prepareWorkFolder(workFolder, path, chunks, 3)
+    convert.parseChunk((path, workFolder, 0, chunks[0][0], chunks[0][1], 3))
+
+    # The same chunks reuse the completed work
+    convert.prepareWorkFolder(workFolder, path, chunks, 3)
+    assert os.path.exists(convert.chunkPaths(workFolder, 0)[1])
+
+    # Different chunks, or a changed input file, throw it away
+    convert.prepareWorkFolder(workFolder, path, convert.findChunks(path, 256), 3)
+    assert not os.path.exists(convert.chunkPaths(workFolder, 0)[1])
+
+    convert.parseChunk((path, workFolder, 0, chunks[0][0], chunks[0][1], 3))
+    writeGlove(path, gloveEntries(101))
+    convert.prepareWorkFolder(workFolder, path, convert.findChunks(path, 256), 3)
+    assert not os.path.exists(convert.chunkPaths(workFolder, 0)[1])
@@ -0,0 +1,116 @@
+#
+# Electric Brain is an easy to use platform for machine learning.
+# Copyright (C) 2016 Electric Brain Software Corporation
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import threading
+import pytest
+from microbatch import EBHistogram, EBMicroBatcher
+
+
+def testHistogramBuckets():
+    histogram = EBHistogram()
+    for value in [1, 2, 3, 4, 5, 8, 9, 0]:
+        histogram.record(value)
+    assert histogram.summary() == {"1": 2, "2": 1, "4": 2, "8": 2, "16": 1}
+
+
+def testHistogramCountsFromManyThreads():
+    histogram = EBHistogram()
+
+    def record():
+        for value in range(1000):
+            histogram.record(value % 8)
+
+    threads = [threading.Thread(target = record) for index in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sum(histogram.summary().values()) == 8000
+
+
+def testRequestsAreMergedAndSplitBack():
+    runs = []
+
+    def run(samples):
+        runs.append(list(samples))
+        return [sample * 10 for sample in samples]
+
+    # A long latency with a batch size the requests fill exactly, so they are all merged
+    batcher = EBMicroBatcher(run, maxBatchSize = 6, maxLatency = 5)
+    futures = [batcher.submit([1, 2]), batcher.submit([3]), batcher.submit([4, 5, 6])]
+
+    assert futures[0].result(timeout = 5) == [10, 20]
+    assert futures[1].result(timeout = 5) == [30]
+    assert futures[2].result(timeout = 5) == [40, 50, 60]
+    assert runs == [[1, 2, 3, 4, 5, 6]]
+    batcher.stop()
+
+    stats = batcher.stats()
+    assert stats["requests"] == 3
+    assert stats["batches"] == 1
+    assert stats["samples"] == 6
+    assert stats["batchSizes"] == {"8": 1}
+
+
+def testRequestsAreNotSplitAcrossBatches():
+    runs = []
+    batcher = EBMicroBatcher(lambda samples: runs.append(list(samples)) or samples, maxBatchSize = 4, maxLatency = 0.05)
+    futures = [batcher.submit([1, 2, 3]), batcher.submit([4, 5])]
+
+    assert futures[1].result(timeout = 5) == [4, 5]
+    assert runs == [[1, 2, 3], [4, 5]]
+    batcher.stop()
+
+
+def testLargeRequestRunsAlone():
+    runs = []
+    batcher = EBMicroBatcher(lambda samples: runs.append(list(samples)) or samples, maxBatchSize = 2, maxLatency = 5)
+    assert batcher.submit([1, 2, 3, 4]).result(timeout = 5) == [1, 2, 3, 4]
+    assert runs == [[1, 2, 3, 4]]
+    batcher.stop()
+
+
+def testSingleRequestRunsAfterTheLatency():
+    batcher = EBMicroBatcher(lambda samples: samples, maxBatchSize = 100, maxLatency = 0.01)
+    assert batcher.submit(["a"]).result(timeout = 5) == ["a"]
+    batcher.stop()
+
+
+def testErrorsReachEveryRequestInTheBatch():
+    def run(samples):
+        raise ValueError("bad batch")
+
+    batcher = EBMicroBatcher(run, maxBatchSize = 2, maxLatency = 5)
+    futures = [batcher.submit([1]), batcher.submit([2])]
+    for future in futures:
+        with pytest.raises(ValueError, match = "bad batch"):
+            future.result(timeout = 5)
+
+    # The batcher keeps running after a failed batch
+    assert batcher.submit([3, 4]).exception(timeout = 5) is not None
+    batcher.stop()
+
+
+def testStopRunsQueuedRequests():
+    batcher = EBMicroBatcher(lambda samples: samples, maxBatchSize = 100, maxLatency = 60)
+    future = batcher.submit([1, 2])
+    batcher.stop()
+
+    assert future.result(timeout = 0) == [1, 2]
+    with pytest.raises(Exception, match = "stopped"):
+        batcher.submit([3])
@@ -0,0 +1,89 @@
+#
+# Electric Brain is an easy to use platform for machine learning.
+# Copyright (C) 2016 Electric Brain Software Corporation
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import numpy
+import pytest
+from output_policy import EBOutputPolicy, selectSamples, countSamples
+
+
+class FakeComponent:
+    """ Sequence arrays hold time first, with the samples along their second axis """
+    def get_batch_axis(self, key):
+        return 1 if key.endswith("sequence") else 0
+
+
+def testDefaultPolicyReturnsEverything():
+    for policy in [None, {}, "all"]:
+        outputPolicy = EBOutputPolicy(policy)
+        assert outputPolicy.mode == "all"
+        assert outputPolicy.includesOutputs(7)
+        assert outputPolicy.chooseSamples(32) is None
+
+
+def testNonePolicy():
+    assert not EBOutputPolicy("none").includesOutputs(0)
+
+
+def testEveryPolicy():
+    outputPolicy = EBOutputPolicy({"mode": "every", "every": 5})
+    assert [step for step in range(12) if outputPolicy.includesOutputs(step)] == [0, 5, 10]
+    assert outputPolicy.chooseSamples(32) is None
+
+    # An interval below one behaves like every iteration
+    assert EBOutputPolicy({"mode": "every", "every": 0}).includesOutputs(3)
+
+
+def testSamplePolicy():
+    outputPolicy = EBOutputPolicy({"mode": "sample", "sampleSize": 4})
+    indexes = outputPolicy.chooseSamples(20)
+
+    assert len(indexes) == 4
+    assert len(set(indexes.tolist())) == 4
+    assert list(indexes) == sorted(indexes)
+    assert all(0 <= index < 20 for index in indexes)
+
+    # Small batches are returned whole
+    assert outputPolicy.chooseSamples(4) is None
+    assert outputPolicy.chooseSamples(3) is None
+
+
+def testUnknownModeIsRejected():
+    with pytest.raises(Exception, match = "Unknown output policy"):
+        EBOutputPolicy("some")
+
+
+def testSelectSamplesAlongEachBatchAxis():
+    arrays = {
+        "values": numpy.arange(10).reshape([5, 2]),
+        "values_sequence": numpy.arange(15).reshape([3, 5]),
+        "lengths": [1, 2, 3, 4, 5],
+        "scalar": numpy.float32(1)
+    }
+    selected = selectSamples(FakeComponent(), arrays, [1, 3])
+
+    assert numpy.array_equal(selected["values"], [[2, 3], [6, 7]])
+    assert numpy.array_equal(selected["values_sequence"], [[1, 3], [6, 8], [11, 13]])
+    assert selected["lengths"] is arrays["lengths"]
+    assert selected["scalar"] is arrays["scalar"]
+
+
+def testCountSamples():
+    component = FakeComponent()
+    assert countSamples(component, {"values_sequence": numpy.zeros([3, 7])}) == 7
+    assert countSamples(component, {"scalar": numpy.float32(1), "values": numpy.zeros([4, 2])}) == 4
+    assert countSamples(component, {}) == 0
@@ -0,0 +1,90 @@
+#
+# Electric Brain is an easy to use platform for machine learning.
+# Copyright (C) 2016 Electric Brain Software Corporation
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import time
+from prediction_cache import EBPredictionCache, canonicalHash
+
+
+def testCanonicalHashIgnoresKeyOrder():
+    assert canonicalHash({"a": 1, "b": [1, 2]}) == canonicalHash({"b": [1, 2], "a": 1})
+    assert canonicalHash({"a": 1}) != canonicalHash({"a": 2})
+    assert canonicalHash({"text": "café"}) == canonicalHash({"text": "café"})
+
+
+def testLookupAndStore():
+    cache = EBPredictionCache(maxEntries = 10)
+    assert cache.enabled()
+
+    keys, outputs = cache.lookup([{"a": 1}, {"a": 2}])
+    assert outputs == [None, None]
+    cache.store(keys[0], "one")
+
+    keys, outputs = cache.lookup([{"a": 1}, {"a": 2}])
+    assert outputs == ["one", None]
+
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 3
+    assert stats["hitRatio"] == 0.25
+    assert stats["entries"] == 1
+
+
+def testDisabledByDefault():
+    assert not EBPredictionCache().enabled()
+    assert EBPredictionCache().stats()["hitRatio"] is None
+
+
+def testLeastRecentlyUsedEviction():
+    cache = EBPredictionCache(maxEntries = 2)
+    keys, outputs = cache.lookup([{"id": 1}, {"id": 2}, {"id": 3}])
+    cache.store(keys[0], 1)
+    cache.store(keys[1], 2)
+
+    # Using the first entry makes the second the least recently used
+    cache.lookup([{"id": 1}])
+    cache.store(keys[2], 3)
+
+    assert cache.lookup([{"id": 1}, {"id": 2}, {"id": 3}])[1] == [1, None, 3]
+    assert cache.stats()["evictions"] == 1
+
+
+def testInvalidateClearsAndDropsOldOutputs():
+    cache = EBPredictionCache(maxEntries = 10)
+    keys, outputs = cache.lookup([{"id": 1}, {"id": 2}])
+    cache.store(keys[0], 1)
+
+    cache.invalidate()
+    assert cache.stats()["entries"] == 0
+    assert cache.stats()["modelVersion"] == 1
+
+    # An output computed by the previous version of the model is not cached
+    cache.store(keys[1], 2)
+    assert cache.lookup([{"id": 1}, {"id": 2}])[1] == [None, None]
+    assert cache.stats()["entries"] == 0
+
+
+def testExpiredEntriesAreMisses():
+    cache = EBPredictionCache(maxEntries = 10, ttl = 0.01)
+    keys, outputs = cache.lookup([{"id": 1}])
+    cache.store(keys[0], 1)
+    assert cache.lookup([{"id": 1}])[1] == [1]
+
+    time.sleep(0.02)
+    assert cache.lookup([{"id": 1}])[1] == [None]
+    assert cache.stats()["expired"] == 1
+    assert cache.stats()["entries"] == 0
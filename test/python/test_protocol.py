@@ -0,0 +1,101 @@
+#
+# Electric Brain is an easy to use platform for machine learning.
+# Copyright (C) 2016 Electric Brain Software Corporation
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import io
+import numpy
+import pytest
+from protocol import EBBinaryProtocol, EBJSONProtocol, frameHeader, frameMagic, negotiateProtocol
+
+
+def roundTrip(protocolClass, message):
+    output = io.BytesIO()
+    protocolClass(output = output).writeMessage(message)
+    return protocolClass(input = io.BytesIO(output.getvalue())).readMessage()
+
+
+def testBinaryRoundTrip():
+    message = {
+        "type": "batch",
+        "values": numpy.arange(12, dtype = numpy.float32).reshape([3, 4]),
+        "nested": [{"ids": numpy.array([1, 2, 3], dtype = numpy.int64)}],
+        "flag": numpy.bool_(True)
+    }
+    result = roundTrip(EBBinaryProtocol, message)
+
+    assert result["type"] == "batch"
+    assert result["values"].dtype == numpy.float32
+    assert result["values"].shape == (3, 4)
+    assert numpy.array_equal(result["values"], message["values"])
+    assert numpy.array_equal(result["nested"][0]["ids"], [1, 2, 3])
+    assert result["flag"] is True
+
+
+def testBinaryFrameLayout():
+    output = io.BytesIO()
+    EBBinaryProtocol(output = output).writeMessage({"a": numpy.zeros([1], dtype = numpy.int8), "b": numpy.ones([2], dtype = numpy.float64)})
+    data = output.getvalue()
+
+    magic, headerLength, payloadLength = frameHeader.unpack(data[:frameHeader.size])
+    assert magic == frameMagic
+    assert len(data) == frameHeader.size + headerLength + payloadLength
+
+    # The float64 tensor is aligned after the single int8 byte
+    assert payloadLength == 8 + 16
+
+
+def testBinaryReadsSeveralFramesAndStopsAtEnd():
+    output = io.BytesIO()
+    writer = EBBinaryProtocol(output = output)
+    writer.writeMessage({"id": 1})
+    writer.writeMessage({"id": 2, "values": numpy.ones([5], dtype = numpy.int32)})
+
+    reader = EBBinaryProtocol(input = io.BytesIO(output.getvalue()))
+    assert reader.readMessage() == {"id": 1}
+    assert reader.readMessage()["id"] == 2
+    assert reader.readMessage() is None
+
+
+def testBinaryTruncatedFrameReturnsNone():
+    output = io.BytesIO()
+    EBBinaryProtocol(output = output).writeMessage({"values": numpy.ones([100], dtype = numpy.float32)})
+    truncated = output.getvalue()[:-10]
+
+    assert EBBinaryProtocol(input = io.BytesIO(truncated)).readMessage() is None
+
+
+def testBinaryRejectsMalformedFrame():
+    data = frameHeader.pack(b'XXXX', 2, 0) + b'{}'
+    with pytest.raises(Exception, match = "malformed"):
+        EBBinaryProtocol(input = io.BytesIO(data)).readMessage()
+
+
+def testJSONRoundTripConvertsArrays():
+    result = roundTrip(EBJSONProtocol, {"values": numpy.array([[1.5, 2.5]]), "count": numpy.int32(3)})
+    assert result == {"values": [[1.5, 2.5]], "count": 3}
+
+
+def testJSONSkipsBlankLines():
+    reader = EBJSONProtocol(input = io.BytesIO(b'\n  \n{"id": 1}\n'))
+    assert reader.readMessage() == {"id": 1}
+    assert reader.readMessage() is None
+
+
+def testNegotiateProtocol():
+    assert negotiateProtocol({"protocols": ["json", "binary"]}).name == "binary"
+    assert negotiateProtocol({"protocols": ["json"]}).name == "json"
+    assert negotiateProtocol({}).name == "json"
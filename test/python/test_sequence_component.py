@@ -0,0 +1,110 @@
+#
+# Electric Brain is an easy to use platform for machine learning.
+# Copyright (C) 2016 Electric Brain Software Corporation
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import numpy
+import pytest
+
+tf = pytest.importorskip("tensorflow")
+
+from schema import EBSchema
+from sequence_component import EBNeuralNetworkSequenceComponent
+
+
+def numberSequenceSchema(enforceSequenceLengthLimit = False, maxSequenceLength = 100):
+    return EBSchema({
+        "type": ["array"],
+        "metadata": {"variablePath": ".values"},
+        "configuration": {"component": {"enforceSequenceLengthLimit": enforceSequenceLengthLimit, "maxSequenceLength": maxSequenceLength}},
+        "items": {
+            "type": ["number"],
+            "metadata": {"variablePath": ".values[]"},
+            "configuration": {"component": {}}
+        }
+    })
+
+
+def testPackIsTimeMajorWithPadding():
+    component = EBNeuralNetworkSequenceComponent(numberSequenceSchema(), "input")
+    converted = component.convert_input_in([[1, 2, 3], None, [4]])
+
+    lengths = converted[component.machineVariableName() + "__length__:0"]
+    assert lengths.tolist() == [3, 0, 1]
+
+    values = converted[component.subComponent.machineVariableName() + ":0"]
+    assert values.shape == (3, 3)
+    numpy.testing.assert_array_equal(values, [[1, 0, 4], [2, 0, 0], [3, 0, 0]])
+
+
+def testPackEnforcesTheLengthLimit():
+    component = EBNeuralNetworkSequenceComponent(numberSequenceSchema(True, 2), "input")
+    converted = component.convert_input_in([[1, 2, 3], [4]])
+
+    assert converted[component.machineVariableName() + "__length__:0"].tolist() == [2, 1]
+    numpy.testing.assert_array_equal(converted[component.subComponent.machineVariableName() + ":0"], [[1, 4], [2, 0]])
+
+    # The limit only applies to inputs
+    outputs = component.convert_output_in([[1, 2, 3], [4]])
+    assert outputs[component.machineVariableName() + "__length__:0"].tolist() == [3, 1]
+
+
+def testPackNestedSequences():
+    schema = EBSchema({
+        "type": ["array"],
+        "metadata": {"variablePath": ".rows"},
+        "configuration": {"component": {"enforceSequenceLengthLimit": False, "maxSequenceLength": 100}},
+        "items": {
+            "type": ["array"],
+            "metadata": {"variablePath": ".rows[]"},
+            "configuration": {"component": {"enforceSequenceLengthLimit": False, "maxSequenceLength": 100}},
+            "items": {"type": ["number"], "metadata": {"variablePath": ".rows[][]"}, "configuration": {"component": {}}}
+        }
+    })
+    component = EBNeuralNetworkSequenceComponent(schema, "input")
+    converted = component.convert_input_in([[[1, 2], [3]], [[4]]])
+
+    inner = component.subComponent
+    values = converted[inner.subComponent.machineVariableName() + ":0"]
+
+    # Each time dimension goes just before the batch dimension, so the inner time comes first, then the outer time
+    assert values.shape == (2, 2, 2)
+    numpy.testing.assert_array_equal(values[:, :, 0], [[1, 3], [2, 0]])
+    numpy.testing.assert_array_equal(values[:, :, 1], [[4, 0], [0, 0]])
+    assert converted[inner.machineVariableName() + "__length__:0"].shape == (2, 2)
+    numpy.testing.assert_array_equal(converted[inner.machineVariableName() + "__length__:0"], [[2, 1], [1, 0]])
+
+
+def testConvertOutputOutUnpacksNestedSequences():
+    schema = EBSchema({
+        "type": ["array"],
+        "metadata": {"variablePath": ".rows"},
+        "configuration": {"component": {"enforceSequenceLengthLimit": False, "maxSequenceLength": 100}},
+        "items": {
+            "type": ["array"],
+            "metadata": {"variablePath": ".rows[]"},
+            "configuration": {"component": {"enforceSequenceLengthLimit": False, "maxSequenceLength": 100}},
+            "items": {"type": ["number"], "metadata": {"variablePath": ".rows[][]"}, "configuration": {"component": {}}}
+        }
+    })
+    component = EBNeuralNetworkSequenceComponent(schema, "output")
+    sequences = [[[1, 2], [3]], [], [[4]]]
+    converted = component.convert_output_in(sequences)
+
+    # Number outputs have a trailing dimension of one value, after the batch dimension
+    leaf = component.subComponent.subComponent.machineVariableName()
+    outputs = {leaf: numpy.expand_dims(converted[leaf + ":0"], -1)}
+
+    assert component.convert_output_out(outputs, converted) == sequences
@@ -0,0 +1,134 @@
+#
+# Electric Brain is an easy to use platform for machine learning.
+# Copyright (C) 2016 Electric Brain Software Corporation
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import pytest
+import sqlite3
+import numpy
+from word_vectors import EBWordVectorStore, EBWordVectorStoreWriter, openWordVectorStore, convertSqliteDatabase, wordVectorStoreFolder, hashWord, hashWords
+
+
+words = ["the", "cat", "sat", "on", "mat", "café", "日本"]
+
+
+def writeStore(folder, words, vectors):
+    writer = EBWordVectorStoreWriter(folder, vectors.shape[1])
+    writer.append(words[:3], vectors[:3])
+    writer.append(words[3:], vectors[3:])
+    writer.close()
+    return EBWordVectorStore(folder)
+
+
+def testRoundTrip(tmpdir):
+    vectors = numpy.arange(len(words) * 4, dtype = numpy.float32).reshape([len(words), 4])
+    store = writeStore(str(tmpdir.join("store")), words, vectors)
+
+    assert store.count == len(words)
+    assert store.dimensions == 4
+    for row in range(len(words)):
+        assert store.word(row) == words[row]
+        assert store.lookup(words[row]) == row
+        numpy.testing.assert_array_equal(store.vector(words[row]), vectors[row])
+
+
+def testMissingWords(tmpdir):
+    vectors = numpy.ones([len(words), 3], dtype = numpy.float32)
+    store = writeStore(str(tmpdir.join("store")), words, vectors)
+
+    assert store.lookup("dog") == -1
+    assert store.lookup("") == -1
+    assert store.vector("dog") is None
+
+
+def testDuplicateWordsKeepTheFirstRow(tmpdir):
+    vectors = numpy.arange(6, dtype = numpy.float32).reshape([3, 2])
+    store = writeStore(str(tmpdir.join("store")), ["a", "b", "a"], vectors)
+
+    assert store.lookup("a") == 0
+    numpy.testing.assert_array_equal(store.vector("a"), [0, 1])
+
+
+def testGatherVectors(tmpdir):
+    vectors = numpy.arange(len(words) * 2, dtype = numpy.float32).reshape([len(words), 2])
+    store = writeStore(str(tmpdir.join("store")), words, vectors)
+
+    gathered = store.gatherVectors(numpy.array([2, -1, 0, 2], dtype = numpy.int32))
+    numpy.testing.assert_array_equal(gathered, [vectors[2], [0, 0], vectors[0], vectors[2]])
+
+
+def testEmptyStore(tmpdir):
+    writer = EBWordVectorStoreWriter(str(tmpdir.join("store")), 5)
+    writer.close()
+    store = EBWordVectorStore(str(tmpdir.join("store")))
+
+    assert store.count == 0
+    assert store.lookup("anything") == -1
+
+
+def testConvertsSqliteDatabase(tmpdir):
+    databasePath = str(tmpdir.join("vectors.db"))
+    database = sqlite3.connect(databasePath)
+    database.execute("CREATE TABLE word_vectors (word TEXT, tensor BLOB)")
+    for index in range(len(words)):
+        database.execute("INSERT INTO word_vectors VALUES (?, ?)", (words[index], numpy.full([3], index, dtype = numpy.float64).tobytes()))
+    database.commit()
+    database.close()
+
+    with pytest.raises(Exception, match = "does not exist"):
+        openWordVectorStore(databasePath)
+
+    convertSqliteDatabase(databasePath, wordVectorStoreFolder(databasePath))
+    assert os.path.isdir(str(tmpdir.join("vectors.vectors")))
+
+    store = openWordVectorStore(databasePath)
+    numpy.testing.assert_array_equal(store.vector("mat"), [4, 4, 4])
+    assert store.lookup("café") == 5
+
+
+def testHashWordsMatchesHashWord():
+    encoded = numpy.char.encode(numpy.array(words + ["", "a much longer word than the others"]), 'utf-8')
+    lengths = numpy.char.str_len(encoded)
+    wordBytes = numpy.frombuffer(encoded.tobytes(), dtype = numpy.uint8).reshape([len(encoded), encoded.dtype.itemsize])
+
+    hashes = hashWords(wordBytes, lengths)
+    assert [int(hash) for hash in hashes] == [hashWord(word) for word in encoded.tolist()]
+
+
+def testLookupRows(tmpdir):
+    vocabulary = ["word" + str(index) for index in range(500)]
+    store = writeStore(str(tmpdir.join("store")), vocabulary, numpy.zeros([500, 2], dtype = numpy.float32))
+
+    query = ["word3", None, "missing", "word499", "word3", "", "word0"]
+    rows = store.lookupRows(query)
+    assert rows.dtype == numpy.int32
+    assert rows.tolist() == [3, -1, -1, 499, 3, -1, 0]
+    assert rows.tolist() == [store.lookup(word) if word is not None else -1 for word in query]
+
+
+def testLookupRowsResolvesCollisions(tmpdir):
+    # A small table relative to the vocabulary forces long probe sequences
+    vocabulary = [str(index) for index in range(2000)]
+    store = writeStore(str(tmpdir.join("store")), vocabulary, numpy.zeros([2000, 1], dtype = numpy.float32))
+
+    query = vocabulary[::-1] + ["x" + word for word in vocabulary[:100]]
+    assert store.lookupRows(query).tolist() == list(range(1999, -1, -1)) + [-1] * 100
+
+
+def testLookupRowsWithNoWords(tmpdir):
+    store = writeStore(str(tmpdir.join("store")), words, numpy.zeros([len(words), 1], dtype = numpy.float32))
+    assert store.lookupRows([]).tolist() == []
+    assert store.lookupRows([None, None]).tolist() == [-1, -1]